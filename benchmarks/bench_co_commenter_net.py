@@ -0,0 +1,39 @@
+"""
+benchmarks build_co_commenter_net (combinations loop) against
+build_co_commenter_net_sparse (B^T B) and checks both give the same weights
+
+python -m benchmarks.bench_co_commenter_net
+"""
+from time import time
+import networkx as nx
+
+from benchmarks.synthetic import synthetic_comments_df
+from graphs.build_commenter_networks import build_co_commenter_net, build_co_commenter_net_sparse
+
+
+def edge_weights(G: nx.Graph) -> dict:
+    return {frozenset((u, v)): d["weight"] for u, v, d in G.edges(data=True)}
+
+
+def main():
+    for n_comments in [5000, 20000, 50000]:
+        df = synthetic_comments_df(n_comments=n_comments)
+        print(f"{n_comments} comments")
+
+        start = time()
+        G_loop = build_co_commenter_net(df, nx.Graph())
+        end = time()
+        print(f"    combinations loop: {end - start:.3f} seconds")
+
+        start = time()
+        G_sparse = build_co_commenter_net_sparse(df, nx.Graph())
+        end = time()
+        print(f"    sparse product:    {end - start:.3f} seconds")
+
+        assert set(G_loop.nodes()) == set(G_sparse.nodes())
+        assert edge_weights(G_loop) == edge_weights(G_sparse)
+        print(f"    same weights on {G_loop.number_of_edges()} edges")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+
+def synthetic_comments_df(n_comments=20000, n_videos=50, n_commenters=5000, seed=42) -> pd.DataFrame:
+    """
+    random comments dataframe with the columns used by the network builders.
+    commenter activity follows a zipf-like distribution, as in the crawled channels
+    """
+    rng = np.random.default_rng(seed)
+
+    popularity = 1 / np.arange(1, n_commenters + 1)
+    popularity /= popularity.sum()
+
+    videos = rng.integers(0, n_videos, size=n_comments)
+    commenters = rng.choice(n_commenters, size=n_comments, p=popularity)
+
+    return pd.DataFrame({
+        "video_id": [f"video_{v}" for v in videos],
+        "comment_author_channel_id": [f"UC{c:08d}" for c in commenters],
+    })
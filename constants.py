@@ -19,13 +19,21 @@ YTBRS_LIST = [
 # crawler paths
 CRAWLER_PATH = "./data/"
 YOUTUBERS_PATH = CRAWLER_PATH+"youtubers.json"
+# typed parquet comments of every youtuber, partitioned by youtuber (crawler.dataset)
+COMMENTS_DATASET_PATH = CRAWLER_PATH+"comments_dataset/"
 
 
 # api key
 load_dotenv()
 DEVELOPER_KEY = os.getenv("API_KEY")
+# optional comma separated list of keys, used round robin by the crawler
+DEVELOPER_KEYS = [k for k in os.getenv("API_KEYS", "").split(",") if k] or [DEVELOPER_KEY]
+# quota units per key per day
+DAILY_QUOTA = 10000
 
 
 # networks constants
 CURR_YTBR = "felipeneto"
 CURR_PATH = f"./data/{CURR_YTBR}/"
+# size of the stage cache kept under {CURR_PATH}cache/, bytes
+CACHE_MAX_BYTES = 5 * 1024 ** 3
@@ -0,0 +1,166 @@
+import json
+import sqlite3
+import threading
+
+"""
+crawl state store, so an interrupted comment crawl (crash, quota exhaustion)
+resumes where it stopped. Kept in a sqlite file per youtuber, every fetched page
+is committed together with its rows and the token of the next page
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    video_title TEXT,
+    pos INTEGER,
+    page INTEGER DEFAULT 0,
+    page_token TEXT,
+    done INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS replies (
+    parent_id TEXT PRIMARY KEY,
+    video_id TEXT,
+    video_title TEXT,
+    video_pos INTEGER,
+    video_page INTEGER,
+    parent_pos INTEGER,
+    page INTEGER DEFAULT 0,
+    page_token TEXT,
+    done INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rows (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_pos INTEGER,
+    video_page INTEGER,
+    parent_pos INTEGER,
+    reply_page INTEGER,
+    data TEXT
+);
+"""
+
+
+class CrawlCheckpoint:
+    """
+    per video / per page crawl state:
+    - videos: next page index and nextPageToken, done flag
+    - replies: pending reply threads (comments with more than 5 replies) and their page token
+    - rows: parsed rows of every committed page, with their position in the serial crawl order
+
+    thread safe, pages can be committed from worker threads
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def register_videos(self, videos):
+        """
+        adds videos not seen before, keeping the state of known ones
+        """
+        with self._lock, self._conn:
+            offset = self._conn.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM videos").fetchone()[0]
+            for i, v in enumerate(videos):
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO videos (video_id, video_title, pos) VALUES (?, ?, ?)",
+                    (v["video_id"], v["video_title"], offset + i))
+
+    def video_state(self, video_id):
+        """
+        returns (pos, page, page_token, done)
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT pos, page, page_token, done FROM videos WHERE video_id = ?",
+                (video_id,)).fetchone()
+
+    def pending_videos(self) -> list:
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT video_id, video_title FROM videos WHERE done = 0 ORDER BY pos")
+            return [{"video_id": vid, "video_title": title} for vid, title in cur]
+
+    def pending_replies(self) -> list:
+        """
+        reply threads registered but not finished, as (parent_id, video_id, video_title)
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT parent_id, video_id, video_title FROM replies WHERE done = 0 "
+                "ORDER BY video_pos, video_page, parent_pos").fetchall()
+
+    def reply_state(self, parent_id):
+        """
+        returns (video_pos, video_page, parent_pos, page, page_token, done)
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT video_pos, video_page, parent_pos, page, page_token, done "
+                "FROM replies WHERE parent_id = ?", (parent_id,)).fetchone()
+
+    def commit_video_page(self, video_id, rows, many_replies_ids, next_page_token):
+        """
+        stores the rows of the current page of video_id, registers its reply threads
+        and moves the video to next_page_token (done if None)
+        """
+        with self._lock, self._conn:
+            pos, page, title = self._conn.execute(
+                "SELECT pos, page, video_title FROM videos WHERE video_id = ?",
+                (video_id,)).fetchone()
+            self._insert_rows(rows, pos, page, -1, 0)
+            for j, parent_id in enumerate(many_replies_ids):
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO replies (parent_id, video_id, video_title, video_pos, "
+                    "video_page, parent_pos) VALUES (?, ?, ?, ?, ?, ?)",
+                    (parent_id, video_id, title, pos, page, j))
+            self._conn.execute(
+                "UPDATE videos SET page = page + 1, page_token = ?, done = ? WHERE video_id = ?",
+                (next_page_token, int(not next_page_token), video_id))
+
+    def commit_reply_page(self, parent_id, rows, next_page_token):
+        """
+        stores the rows of the current replies page of parent_id and moves it to next_page_token
+        """
+        with self._lock, self._conn:
+            video_pos, video_page, parent_pos, page = self._conn.execute(
+                "SELECT video_pos, video_page, parent_pos, page FROM replies WHERE parent_id = ?",
+                (parent_id,)).fetchone()
+            self._insert_rows(rows, video_pos, video_page, parent_pos, page)
+            self._conn.execute(
+                "UPDATE replies SET page = page + 1, page_token = ?, done = ? WHERE parent_id = ?",
+                (next_page_token, int(not next_page_token), parent_id))
+
+    def iter_rows(self, batch_size=10000):
+        """
+        yields batches of committed rows, in the order of a serial crawl
+        """
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute(
+                "SELECT data FROM rows ORDER BY video_pos, video_page, parent_pos, reply_page, seq")
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield [json.loads(d) for d, in batch]
+
+    def progress(self) -> dict:
+        with self._lock:
+            q = self._conn.execute
+            return {
+                "videos_done": q("SELECT COUNT(*) FROM videos WHERE done = 1").fetchone()[0],
+                "videos": q("SELECT COUNT(*) FROM videos").fetchone()[0],
+                "pending_replies": q("SELECT COUNT(*) FROM replies WHERE done = 0").fetchone()[0],
+                "rows": q("SELECT COUNT(*) FROM rows").fetchone()[0],
+            }
+
+    def _insert_rows(self, rows, video_pos, video_page, parent_pos, reply_page):
+        self._conn.executemany(
+            "INSERT INTO rows (video_pos, video_page, parent_pos, reply_page, data) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(video_pos, video_page, parent_pos, reply_page, json.dumps(r)) for r in rows])
@@ -1,33 +1,89 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import googleapiclient.discovery
 import googleapiclient.errors
-import pandas as pd
 
-from constants import YTBRS_LIST, CRAWLER_PATH, YOUTUBERS_PATH, DEVELOPER_KEY
+from constants import YTBRS_LIST, CRAWLER_PATH, YOUTUBERS_PATH, DEVELOPER_KEY, DEVELOPER_KEYS, DAILY_QUOTA
+from profiling import stage
 from .parser import *
+from .scheduler import RequestScheduler, error_reason
+from .checkpoint import CrawlCheckpoint
+from .sink import make_comment_sink
+from .dataset import write_comments_dataset
+from .incremental import load_watermarks, save_watermarks, build_watermarks, new_comment_threads, merge_comments
 
 
 class Crawling:
 
-    def __init__(self):
+    def __init__(self, max_workers=1, api_endpoint=None, api_keys=None,
+                 requests_per_second=None, daily_quota=DAILY_QUOTA,
+                 sink_format="csv", chunk_rows=50000, comments_dataset=None):
+        """
+        params:
+        - max_workers: number of concurrent requests when crawling comments, 1 crawls serially
+        - api_endpoint: overrides the YouTube Data API root url, i.e. a local fake server
+        - api_keys: developer keys used round robin, defaults to DEVELOPER_KEYS
+        - requests_per_second: target request rate, None for no limit
+        - daily_quota: quota units per key
+        - sink_format: "csv" or "parquet", format of the comment parts written while crawling
+        - chunk_rows: rows kept in memory before a part is written
+        - comments_dataset: root of the typed parquet comment dataset (crawler.dataset),
+          i.e. COMMENTS_DATASET_PATH, also written after a crawl. None writes only the csv
+        """
 
         os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "0"
 
         self._api_service_name = "youtube"
         self._api_version = "v3"
+        self._api_endpoint = api_endpoint
+        self.max_workers = max_workers
+        self.sink_format = sink_format
+        self.chunk_rows = chunk_rows
+        self.comments_dataset = comments_dataset
 
         self.yt_channel_ids = []
 
         if not os.path.exists(CRAWLER_PATH):
             os.makedirs(CRAWLER_PATH)
 
-        self._build_youtube_client()
+        # every request goes through the scheduler, which picks the key and client
+        # (googleapiclient clients are not thread safe, it builds one per thread)
+        self.scheduler = RequestScheduler(api_keys or DEVELOPER_KEYS,
+                                          self._new_youtube_client,
+                                          requests_per_second=requests_per_second,
+                                          daily_quota=daily_quota)
+
+    def _new_youtube_client(self, developer_key=DEVELOPER_KEY):
+        client_options = None
+        if self._api_endpoint:
+            client_options = {"api_endpoint": self._api_endpoint}
+        return googleapiclient.discovery.build(self._api_service_name,
+                                               self._api_version,
+                                               developerKey=developer_key,
+                                               client_options=client_options)
+
+    def _new_sink(self, path):
+        youtuber = os.path.basename(os.path.normpath(path))
+        return make_comment_sink(path, youtuber, self.sink_format, self.chunk_rows)
+
+    def _save_comments(self, sink, path):
+        """
+        writes the crawled rows to {path}_comments.csv and to the youtuber's
+        partition of the comment dataset
+        """
+        sink.to_csv(f'{path}_comments.csv')
+        if self.comments_dataset is not None:
+            sink.to_dataset(self.comments_dataset, os.path.basename(os.path.normpath(path)))
 
-    def _build_youtube_client(self):
-        self.youtube = googleapiclient.discovery.build(self._api_service_name,
-                                                       self._api_version,
-                                                       developerKey=DEVELOPER_KEY)
+    def _execute(self, endpoint, build_request):
+        """
+        executes a request through the quota aware scheduler
+        - endpoint: i.e. "commentThreads.list"
+        - build_request: function youtube client -> request
+        """
+        with stage(f"request.{endpoint}"):
+            return self.scheduler.execute(endpoint, build_request)
 
     def build_channels_list(self):
         """
@@ -39,25 +95,32 @@ class Crawling:
             print(f"Crawling info from @{name} ...")
 
             # make request to yt API with channel user @
-            request = self.youtube.channels().list(
+            response = self._execute("channels.list", lambda yt: yt.channels().list(
                 part="snippet,contentDetails,statistics",
                 # forUsername=name
                 forHandle=name
-            )
-
-            response = request.execute()
+            ))
 
             # saving data as json to ./data/{youtuber name}
             ytbr_data = parse_channel_info(response, name)
             youtubers.append(ytbr_data)
 
+        self.scheduler.print_report()
         print(f"got channels info. saving at {YOUTUBERS_PATH}")
         save_data_to_json(youtubers, YOUTUBERS_PATH)
 
-    def build_youtubers_videos_list(self):
+    def build_youtubers_videos_list(self, use_search=False, published_after=None,
+                                    published_before=None, max_videos=None):
         """
         builds youtubers_videos_list json dataset
         with latest videos_data for each youtuber specified
+
+        params:
+        - use_search: use search().list (100 quota units, 50 latest videos only) instead
+          of paging through the channel's uploads playlist (1 unit per 50 videos)
+        - published_after, published_before: ISO 8601 dates, i.e. "2024-01-01",
+          only videos published in [published_after, published_before) are kept
+        - max_videos: maximum number of videos per channel, newest first
         """
         if not os.path.exists(YOUTUBERS_PATH):
             self.build_channels_list()
@@ -70,22 +133,86 @@ class Crawling:
             print(
                 f"Crawling info from : {channel['channel_title']}, @{channel['youtuber']} ...")
 
+            _path = CRAWLER_PATH+channel['youtuber']
+            os.makedirs(_path, exist_ok=True)
+
+            if not use_search:
+                videos = self._get_uploaded_videos(channel["uploaded_videos_id"],
+                                                   published_after, published_before,
+                                                   max_videos)
+                print(f"    {len(videos)} videos found")
+                save_videos_list(videos, channel, _path)
+                continue
+
             # get only videos by channel id
-            request = self.youtube.search().list(
+            response = self._execute("search.list", lambda yt: yt.search().list(
                 part="snippet",
                 channelId=channel["channel_id"],
                 order="date",  # viewcount
                 type="video",
                 maxResults=50,
-            )
-
-            response = request.execute()
+            ))
 
-            _path = CRAWLER_PATH+channel['youtuber']
-            os.makedirs(_path, exist_ok=True)
             parse_search_videos(response, channel, _path)
+        self.scheduler.print_report()
+
+    def _get_uploaded_videos(self, playlist_id, published_after=None,
+                             published_before=None, max_videos=None) -> list:
+        """
+        pages through a channel's uploads playlist and adds each video's statistics,
+        looked up 50 ids per videos().list request
+        """
+        videos = []
+        page_token = None
+        while True:
+            response = self._execute("playlistItems.list", lambda yt: yt.playlistItems().list(
+                part="snippet,contentDetails",
+                playlistId=playlist_id,
+                maxResults=50,
+                pageToken=page_token,
+            ))
+            page = parse_playlist_items(response)
+
+            for v in page:
+                if published_after and v["date_published"] < published_after:
+                    continue
+                if published_before and v["date_published"] >= published_before:
+                    continue
+                videos.append(v)
+
+            page_token = response.get("nextPageToken")
+            if not page_token or (max_videos and len(videos) >= max_videos):
+                break
+            # uploads are listed newest first, older pages are out of range
+            if published_after and page and \
+                    min(v["date_published"] for v in page) < published_after:
+                break
+
+        if max_videos:
+            videos = videos[:max_videos]
+
+        for i in range(0, len(videos), 50):
+            batch = videos[i:i + 50]
+            response = self._execute("videos.list", lambda yt: yt.videos().list(
+                part="statistics",
+                id=",".join(v["video_id"] for v in batch),
+                maxResults=50,
+            ))
+            stats = parse_videos_statistics(response)
+            for v in batch:
+                v.update(stats.get(v["video_id"], {}))
+
+        return videos
 
-    def build_videos_comments_df(self):
+    def build_videos_comments_df(self, checkpoint=True, resume=True):
+        """
+        crawls comments of every youtuber's videos_list.json
+        - checkpoint: keeps the crawl state in {path}crawl_state.sqlite, so a restarted
+          crawl resumes from the last fetched page. The state is removed once the
+          crawl is saved
+        - resume: if False, the state of an interrupted crawl is discarded and the
+          crawl starts fresh
+        """
         datasets = self._get_youtuber_datasets_path()
 
         # get each youtuber's videos dataset
@@ -98,10 +225,97 @@ class Crawling:
             manual = ["cadresplayer"]
             if video_data['youtuber'] in manual:
                 print(f"crawling comments from @{video_data['youtuber']}'s videos")
-                self._get_comments_from_video_ids(video_data["videos"],
-                                                  path)
+                with stage("crawl_comments", videos=len(video_data["videos"])):
+                    if checkpoint:
+                        self._get_comments_from_video_ids_checkpointed(video_data["videos"],
+                                                                       path, resume)
+                    elif self.max_workers > 1:
+                        self._get_comments_from_video_ids_concurrent(video_data["videos"],
+                                                                     path)
+                    else:
+                        self._get_comments_from_video_ids(video_data["videos"],
+                                                          path)
                 input(">")
 
+    def update_videos_comments_df(self):
+        """
+        incremental re-crawl of every youtuber dataset: adds videos uploaded since
+        the newest known one, fetches only comments newer than the ones already in
+        {path}_comments.csv and merges them into it (deduplicated on comment_id).
+        The new rows are also kept in {path}_comments_delta.csv
+        - replies added to already crawled threads are not fetched
+        """
+        channels = {}
+        if os.path.exists(YOUTUBERS_PATH):
+            with open(YOUTUBERS_PATH) as f:
+                channels = {c["youtuber"]: c for c in json.load(f)}
+
+        for path in self._get_youtuber_datasets_path():
+            if not os.path.exists(path+"videos_list.json"):
+                continue
+            with open(path+"videos_list.json") as f:
+                video_data = json.load(f)
+
+            print(f"updating comments from @{video_data['youtuber']}'s videos")
+            with stage("update_comments", videos=len(video_data["videos"])):
+                self._update_youtuber_comments(video_data, channels.get(video_data["youtuber"]),
+                                               path)
+
+    def _update_youtuber_comments(self, video_data, channel, path):
+        dataset_path = f"{path}_comments.csv"
+        delta_path = f"{path}_comments_delta.csv"
+        watermarks = load_watermarks(path, dataset_path, video_data["videos"])
+
+        # new uploads since the newest video crawled
+        if channel is not None:
+            known = {v["video_id"] for v in video_data["videos"]}
+            new_videos = [v for v in self._get_uploaded_videos(channel["uploaded_videos_id"],
+                                                               watermarks["newest_video"])
+                          if v["video_id"] not in known]
+            print(f"    {len(new_videos)} new videos")
+            video_data["videos"] = new_videos + video_data["videos"]
+            save_videos_list(video_data["videos"], channel, path)
+
+        sink = self._new_sink(path)
+        for v in video_data["videos"]:
+            watermark = watermarks["videos"].get(v["video_id"])
+            page_token = None
+            while True:
+                response = self._list_comment_threads(v["video_id"], page_token, order="time")
+                if not response:
+                    break
+                response, reached = new_comment_threads(response, watermark)
+
+                _d, comments_many_replies_ids = parse_comment_threads(
+                    response,
+                    v["video_id"],
+                    v["video_title"],
+                    path
+                )
+                sink.push(_d)
+                if comments_many_replies_ids != []:
+                    self._get_replies_from_parent_ids(
+                        comments_many_replies_ids,
+                        v["video_id"],
+                        v["video_title"],
+                        sink,
+                    )
+
+                page_token = response.get("nextPageToken")
+                if reached or not page_token:
+                    break
+
+        print(f"    {sink.num_rows} new rows, merging...")
+        sink.to_csv(delta_path)
+        added = merge_comments(dataset_path, delta_path, dataset_path)
+        print(f"    {added} comments added to {dataset_path}")
+        if self.comments_dataset is not None:
+            write_comments_dataset(dataset_path, self.comments_dataset,
+                                   os.path.basename(os.path.normpath(path)))
+
+        save_watermarks(build_watermarks(dataset_path, video_data["videos"]), path)
+        self.scheduler.print_report()
+
     def _get_youtuber_datasets_path(self):
         """
         returns all youtuber datasets path as a list
@@ -115,32 +329,19 @@ class Crawling:
                 data.append(_item_path+"/")
         return data
 
-    def _get_replies_from_parent_ids(self, parent_ids, video_id, video_title) -> pd.DataFrame:
+    def _get_replies_from_parent_ids(self, parent_ids, video_id, video_title, sink):
         """
-        gets replies from comments with more than 5 replies 
+        gets replies from comments with more than 5 replies and pushes them to sink
         - commentThread endpoint only returns 5 replies per comment! 
         """
         page_token = None
         _count = 0
-        df = pd.DataFrame()
 
         for id in parent_ids:
             while True:
                 _count += 1
                 # gets replies from current parent id
-                request = self.youtube.comments().list(
-                    part="snippet,id",
-                    maxResults=100,
-                    pageToken=page_token,
-                    parentId=id,
-                )
-
-                response = {}
-                try:
-                    response = request.execute()
-                except googleapiclient.errors.HttpError as e:
-                    if e.error_details[0]["reason"] == "commentNotFound":
-                        print(f"skipping current comment: {e.error_details[0]['message']}")
+                response = self._list_replies(id, page_token)
 
                 if response:
                     print(f"    parsing comment replies ... {_count}")
@@ -151,14 +352,12 @@ class Crawling:
                         video_title,
                         many=True,
                     )
-                    df = pd.concat([df, pd.DataFrame(_d)], ignore_index=True)
+                    sink.push(_d)
                 page_token = response.get("nextPageToken")
                 if not page_token:  # if next comment page doesnt exist, break
                     break
                 _count += 1
 
-        return df
-
     def _get_comments_from_video_ids(self, videos, path):
         """
         iterates through each video, gets its comments and saves dataset.
@@ -166,7 +365,7 @@ class Crawling:
         - videos: videos list, with video_id, date, video_title
         - path: current youtuber path, i.e ./data/{youtuber}/
         """
-        df = pd.DataFrame()
+        sink = self._new_sink(path)
         page_token = None # video's comment section has many pages
         for v in videos:
             _count = 0
@@ -174,43 +373,264 @@ class Crawling:
             while True:  # to get next pages if nextPageToken != None
                 _count += 1
                 # gets comment from current video v
-                request = self.youtube.commentThreads().list(
-                    part="snippet,replies,id",
-                    videoId=v["video_id"],
-                    maxResults=100,
-                    pageToken=page_token,
-                    order="relevance",
-                )
-
-                response = {}
-                try:
-                    response = request.execute()
-                except googleapiclient.errors.HttpError as e:
-                    if e.error_details[0]["reason"] == "commentsDisabled":
-                        print(
-                            f"skipping current video: {e.error_details[0]['message']}")
+                response = self._list_comment_threads(v["video_id"], page_token)
 
                 # parses response, with selected params
                 if response:
-                    print( f"    parsing comments and appending to dataframe, page {_count}")
+                    print( f"    parsing comments and appending to sink, page {_count}")
                     _d, comments_many_replies_ids = parse_comment_threads(
                         response,
                         v["video_id"],
                         v["video_title"],
                         path
                     )
-                    df = pd.concat([df, pd.DataFrame(_d)], ignore_index=True)
+                    sink.push(_d)
                     if comments_many_replies_ids != []: 
-                        repl_df = self._get_replies_from_parent_ids(
+                        self._get_replies_from_parent_ids(
                             comments_many_replies_ids,
                             v["video_id"],
                             v["video_title"],
+                            sink,
                         )
-                        df = pd.concat([df, repl_df], ignore_index=True)
 
                 page_token = response.get("nextPageToken")
                 if not page_token:  # if next comment page doesnt exist, break
                     break
 
+        self.scheduler.print_report()
+        print(f"saving...")
+        self._save_comments(sink, path)
+
+    def _list_comment_threads(self, video_id, page_token=None, order="relevance") -> dict:
+        """
+        requests one page of a video's comment threads, returns {} if comments are disabled,
+        other errors (left after the scheduler's retries) are raised
+        - order: "relevance" or "time" (newest first)
+        """
+        response = {}
+        try:
+            response = self._execute("commentThreads.list", lambda yt: yt.commentThreads().list(
+                part="snippet,replies,id",
+                videoId=video_id,
+                maxResults=100,
+                pageToken=page_token,
+                order=order,
+            ))
+        except googleapiclient.errors.HttpError as e:
+            if error_reason(e) != "commentsDisabled":
+                raise
+            print(f"skipping current video: {e.reason}")
+        return response
+
+    def _list_replies(self, parent_id, page_token=None) -> dict:
+        """
+        requests one page of a comment's replies, returns {} if the comment was not found,
+        other errors are raised
+        """
+        response = {}
+        try:
+            response = self._execute("comments.list", lambda yt: yt.comments().list(
+                part="snippet,id",
+                maxResults=100,
+                pageToken=page_token,
+                parentId=parent_id,
+            ))
+        except googleapiclient.errors.HttpError as e:
+            if error_reason(e) != "commentNotFound":
+                raise
+            print(f"skipping current comment: {e.reason}")
+        return response
+
+    def _fetch_video_comment_pages(self, v, path) -> list:
+        """
+        worker task: pages through all comment threads of video v
+        returns a list with (rows, comments_many_replies_ids) per page
+        """
+        pages = []
+        page_token = None
+        while True:
+            response = self._list_comment_threads(v["video_id"], page_token)
+            if response:
+                pages.append(parse_comment_threads(
+                    response,
+                    v["video_id"],
+                    v["video_title"],
+                    path
+                ))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        return pages
+
+    def _fetch_replies(self, parent_id, video_id, video_title) -> list:
+        """
+        worker task: pages through all replies of parent_id, returns the parsed rows
+        """
+        rows = []
+        page_token = None
+        while True:
+            response = self._list_replies(parent_id, page_token)
+            if response:
+                rows += parse_replies(response, parent_id, video_id, video_title, many=True)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        return rows
+
+    def _crawl_comments_concurrent(self, videos, path, sink):
+        """
+        crawls videos and their reply threads with a pool of self.max_workers threads.
+        Pages of one video are sequential (each needs the previous nextPageToken),
+        different videos and reply threads run concurrently.
+        Rows are pushed to sink in the same order as the serial crawl, a video
+        as soon as it and every video before it are complete
+        """
+        video_pages = {}  # video idx -> [(rows, many_replies_ids), ...]
+        replies = {}  # (video idx, page idx, parent idx) -> rows
+        pending = {}  # video idx -> reply threads not finished
+        next_video = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(self._fetch_video_comment_pages, v, path): ("video", i)
+                for i, v in enumerate(videos)
+            }
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = futures.pop(future)
+                    if key[0] == "replies":
+                        replies[key[1:]] = future.result()
+                        pending[key[1]] -= 1
+                        continue
+
+                    i = key[1]
+                    v = videos[i]
+                    video_pages[i] = future.result()
+                    pending[i] = 0
+                    print(f"    comments from {v['video_title']}: {len(video_pages[i])} pages")
+                    for p, (_, parent_ids) in enumerate(video_pages[i]):
+                        for j, parent_id in enumerate(parent_ids):
+                            f = pool.submit(self._fetch_replies, parent_id,
+                                            v["video_id"], v["video_title"])
+                            futures[f] = ("replies", i, p, j)
+                            pending[i] += 1
+
+                while pending.get(next_video) == 0:
+                    for p, (page_rows, parent_ids) in enumerate(video_pages.pop(next_video)):
+                        sink.push(page_rows)
+                        for j in range(len(parent_ids)):
+                            sink.push(replies.pop((next_video, p, j)))
+                    del pending[next_video]
+                    next_video += 1
+
+    def _get_comments_from_video_ids_concurrent(self, videos, path):
+        """
+        concurrent version of _get_comments_from_video_ids, same rows and output file
+        Params:
+        - videos: videos list, with video_id, date, video_title
+        - path: current youtuber path, i.e ./data/{youtuber}/
+        """
+        sink = self._new_sink(path)
+        self._crawl_comments_concurrent(videos, path, sink)
+
+        self.scheduler.print_report()
+        print(f"saving...")
+        self._save_comments(sink, path)
+
+    def _fetch_video_comment_pages_checkpointed(self, v, path, checkpoint):
+        """
+        worker task: pages through the comment threads of video v starting from
+        its checkpointed page, committing each page with its rows. A failed request
+        raises before its page is committed, so it is requested again on resume
+        """
+        _, _, page_token, done = checkpoint.video_state(v["video_id"])
+        while not done:
+            response = self._list_comment_threads(v["video_id"], page_token)
+            rows, comments_many_replies_ids = [], []
+            if response:
+                rows, comments_many_replies_ids = parse_comment_threads(
+                    response,
+                    v["video_id"],
+                    v["video_title"],
+                    path
+                )
+            page_token = response.get("nextPageToken")
+            checkpoint.commit_video_page(v["video_id"], rows, comments_many_replies_ids, page_token)
+            done = not page_token
+
+    def _fetch_replies_checkpointed(self, parent_id, video_id, video_title, checkpoint):
+        """
+        worker task: pages through the replies of parent_id starting from its checkpointed page
+        """
+        _, _, _, _, page_token, done = checkpoint.reply_state(parent_id)
+        while not done:
+            response = self._list_replies(parent_id, page_token)
+            rows = []
+            if response:
+                rows = parse_replies(response, parent_id, video_id, video_title, many=True)
+            page_token = response.get("nextPageToken")
+            checkpoint.commit_reply_page(parent_id, rows, page_token)
+            done = not page_token
+
+    def _get_comments_from_video_ids_checkpointed(self, videos, path, resume=True):
+        """
+        resumable version of _get_comments_from_video_ids, with self.max_workers threads.
+        Finished pages are never requested again, pending reply threads of an
+        interrupted run are crawled first
+        Params:
+        - videos: videos list, with video_id, date, video_title
+        - path: current youtuber path, i.e ./data/{youtuber}/
+        - resume: if False, discards the state left by an interrupted crawl
+        """
+        state_path = f"{path}crawl_state.sqlite"
+        if not resume and os.path.exists(state_path):
+            print(f"    discarding crawl state {state_path}")
+            os.remove(state_path)
+        checkpoint = CrawlCheckpoint(state_path)
+        checkpoint.register_videos(videos)
+        print(f"    crawl state: {checkpoint.progress()}")
+
+        submitted = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+
+            def submit_pending_replies():
+                for parent_id, video_id, video_title in checkpoint.pending_replies():
+                    if parent_id not in submitted:
+                        submitted.add(parent_id)
+                        f = pool.submit(self._fetch_replies_checkpointed, parent_id,
+                                        video_id, video_title, checkpoint)
+                        futures[f] = None
+
+            submit_pending_replies()
+            for v in checkpoint.pending_videos():
+                f = pool.submit(self._fetch_video_comment_pages_checkpointed, v, path, checkpoint)
+                futures[f] = v
+
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        v = futures.pop(future)
+                        future.result()
+                        if v is not None:
+                            print(f"    comments from {v['video_title']}")
+                            submit_pending_replies()
+            except BaseException:
+                # state is saved, drop queued work so the error surfaces right away
+                for f in futures:
+                    f.cancel()
+                print(f"    crawl stopped, state saved: {checkpoint.progress()}")
+                raise
+
+        sink = self._new_sink(path)
+        for rows in checkpoint.iter_rows():
+            sink.push(rows)
+        checkpoint.close()
+
+        self.scheduler.print_report()
         print(f"saving...")
-        df.to_csv(f'{path}_comments.csv')
+        self._save_comments(sink, path)
+        # the crawl is complete, the next one starts fresh
+        os.remove(state_path)
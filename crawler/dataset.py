@@ -0,0 +1,154 @@
+import os
+import shutil
+import pandas as pd
+
+from .sink import COMMENT_COLUMNS
+
+"""
+columnar comment dataset: the rows of parse_comment_threads / parse_replies as
+typed parquet, hive partitioned by youtuber:
+
+    {root}youtuber=<name>/part-00000.parquet, ...
+
+ids, titles and author names are dictionary encoded (video_id and
+comment_author_channel_id load as categoricals), dates are utc timestamps,
+counts are integers, is_reply a boolean and parent_comment_id is null for top
+level comments. Reads are memory mapped and push column selection and filters
+down to the parquet files, so loading one channel's author / video columns
+skips every other partition and column.
+
+pyarrow is only needed by this module
+"""
+
+DICTIONARY_COLUMNS = ["video_id", "video_title", "comment_author_name",
+                      "comment_author_channel_id"]
+PARTITION_PREFIX = "youtuber="
+
+
+def comment_schema():
+    """
+    arrow schema of the dataset files (the youtuber partition column excluded)
+    """
+    import pyarrow as pa
+
+    dict_string = pa.dictionary(pa.int32(), pa.string())
+    types = {
+        "comment_id": pa.string(),
+        "comment_text": pa.string(),
+        "comment_like_count": pa.int64(),
+        # parquet has no second unit
+        "comment_publish_date": pa.timestamp("ms", tz="UTC"),
+        "comment_reply_count": pa.int64(),
+        "is_reply": pa.bool_(),
+        "parent_comment_id": pa.string(),
+        **{c: dict_string for c in DICTIONARY_COLUMNS},
+    }
+    return pa.schema([(c, types[c]) for c in COMMENT_COLUMNS])
+
+
+def comments_to_table(df: pd.DataFrame):
+    """
+    comment rows (parsed dicts, or read from the csv as strings) as a typed arrow table
+    """
+    import pyarrow as pa
+
+    df = df[COMMENT_COLUMNS].copy()
+    for c in ["comment_like_count", "comment_reply_count"]:
+        df[c] = pd.to_numeric(df[c]).astype("int64")
+    df["comment_publish_date"] = pd.to_datetime(df["comment_publish_date"], utc=True,
+                                                format="ISO8601")
+    # csv booleans are the strings "True" / "False"
+    df["is_reply"] = df["is_reply"].astype(str) == "True"
+    # top level comments have parent 0
+    parent = df["parent_comment_id"].astype(str)
+    df["parent_comment_id"] = parent.where(parent != "0")
+    return pa.Table.from_pandas(df, schema=comment_schema(), preserve_index=False)
+
+
+def partition_path(root: str, youtuber: str) -> str:
+    return os.path.join(root, f"{PARTITION_PREFIX}{youtuber}")
+
+
+def partition_mtime(path: str) -> float:
+    """
+    time the partition directory path was last written, its newest part file
+    """
+    return max((os.path.getmtime(os.path.join(path, f)) for f in os.listdir(path)),
+               default=os.path.getmtime(path))
+
+
+def _csv_chunks(path: str, chunksize: int):
+    # ids and texts as written, "" is not NaN
+    yield from pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize)
+
+
+def write_comments_dataset(source, root: str, youtuber: str, chunksize: int = 500000) -> str:
+    """
+    (re)writes the youtuber partition of the dataset
+
+    params:
+    - source: comments dataframe, path of a comments csv (CommentSink.to_csv format),
+      or an iterable of dataframes, written one part file per chunk
+    - root: dataset root, i.e COMMENTS_DATASET_PATH
+    - chunksize: rows per part when reading a csv
+
+    returns:
+    - the partition directory
+    """
+    import pyarrow.parquet as pq
+
+    if isinstance(source, str):
+        source = _csv_chunks(source, chunksize)
+    elif isinstance(source, pd.DataFrame):
+        source = [source]
+
+    out_dir = partition_path(root, youtuber)
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    rows = 0
+    for n, df in enumerate(source):
+        if df.empty:
+            continue
+        pq.write_table(comments_to_table(df), os.path.join(tmp_dir, f"part-{n:05d}.parquet"))
+        rows += len(df)
+    # readers never see a half written partition
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    print(f"{rows} comments of {youtuber} saved at {out_dir}")
+    return out_dir
+
+
+def open_comments_dataset(path: str):
+    """
+    memory mapped pyarrow dataset of the dataset root, a partition directory or a
+    parquet file, the youtuber column comes from the partition directories
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    return ds.dataset(os.path.abspath(path), format="parquet",
+                      partitioning=ds.HivePartitioning.discover(infer_dictionary=True),
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def read_comments(root: str, youtuber=None, columns=None, filter=None) -> pd.DataFrame:
+    """
+    loads comments with column and predicate pushdown
+
+    params:
+    - youtuber: name or list of names, only their partitions are read
+    - columns: columns to load, None for all
+    - filter: pyarrow.dataset expression, i.e ds.field("is_reply") == False
+
+    returns:
+    - dataframe, dictionary encoded columns as categoricals
+    """
+    import pyarrow.dataset as ds
+
+    if isinstance(youtuber, str):
+        youtuber = [youtuber]
+    if youtuber is not None:
+        by_youtuber = ds.field("youtuber").isin(youtuber)
+        filter = by_youtuber if filter is None else filter & by_youtuber
+    return open_comments_dataset(root).to_table(columns=columns, filter=filter).to_pandas()
@@ -0,0 +1,243 @@
+import json
+import threading
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+"""
+local fake of the YouTube Data API v3, serving canned commentThreads / comments
+responses so the crawler can be run without spending quota:
+
+    api = FakeYouTubeAPI(build_canned_comments(n_videos=20))
+    url = api.start()
+    Crawling(max_workers=8, api_endpoint=url)
+    ...
+    api.stop()
+"""
+
+
+def _comment(comment_id, author, published_at):
+    return {
+        "id": comment_id,
+        "snippet": {
+            "textDisplay": f"text of {comment_id}",
+            "authorDisplayName": f"@{author}",
+            "authorChannelId": {"value": author},
+            "likeCount": 0,
+            "publishedAt": published_at,
+        },
+    }
+
+
+def build_canned_comments(n_videos=10, pages_per_video=3, threads_per_page=20,
+                          replies_per_thread=(0, 3, 12), page_size=5, n_authors=50):
+    """
+    builds canned API data for n_videos videos
+
+    params:
+    - pages_per_video: commentThreads pages per video
+    - threads_per_page: top level comments per page
+    - replies_per_thread: reply counts cycled through the threads, counts above 5
+      are only served by the comments endpoint, as in the real API
+    - page_size: replies per comments page
+    - n_authors: number of distinct commenters
+
+    returns:
+    - {"commentThreads": {video_id: [page, ...]}, "comments": {parent_id: [page, ...]},
+       "disabled": set of video ids with comments disabled}
+    """
+    data = {"commentThreads": {}, "comments": {}, "disabled": set()}
+    _n = 0
+
+    for v in range(n_videos):
+        video_id = f"video{v:04d}"
+        pages = []
+        for p in range(pages_per_video):
+            items = []
+            for t in range(threads_per_page):
+                _n += 1
+                thread_id = f"{video_id}_c{p}_{t}"
+                n_replies = replies_per_thread[_n % len(replies_per_thread)]
+                replies = [
+                    _comment(f"{thread_id}.r{r}", f"UCauthor{(_n + r) % n_authors:04d}",
+                             f"2024-01-01T00:{r % 60:02d}:00Z")
+                    for r in range(n_replies)
+                ]
+
+                thread = {
+                    "id": thread_id,
+                    "snippet": {
+                        "topLevelComment": _comment(thread_id, f"UCauthor{_n % n_authors:04d}",
+                                                    f"2024-01-01T{t % 24:02d}:00:00Z"),
+                        "totalReplyCount": n_replies,
+                    },
+                    "replies": {"comments": replies[:5]},
+                }
+                items.append(thread)
+
+                if n_replies > 5:
+                    data["comments"][thread_id] = [
+                        {"items": replies[i:i + page_size]}
+                        for i in range(0, n_replies, page_size)
+                    ]
+            pages.append({"items": items})
+        data["commentThreads"][video_id] = pages
+
+    return data
+
+
+def add_canned_uploads(data, playlist_id="UUfake", page_size=50):
+    """
+    adds an uploads playlist with every video of data, newest first, one video
+    per day from 2024-01-01, and their videos().list statistics
+    """
+    video_ids = sorted(data["commentThreads"], reverse=True)
+    items, data["videos"] = [], {}
+    for n, video_id in enumerate(video_ids):
+        day = len(video_ids) - 1 - n
+        published_at = f"{2024 + day // 365}-01-01T00:00:00Z" if day >= 365 else \
+            f"2024-{1 + day // 28:02d}-{1 + day % 28:02d}T00:00:00Z"
+        items.append({
+            "snippet": {"publishedAt": published_at, "title": f"title of {video_id}",
+                        "description": ""},
+            "contentDetails": {"videoId": video_id, "videoPublishedAt": published_at},
+        })
+        n_comments = sum(len(p["items"]) for p in data["commentThreads"][video_id])
+        data["videos"][video_id] = {
+            "id": video_id,
+            "statistics": {"viewCount": "1000", "likeCount": "10",
+                           "commentCount": str(n_comments)},
+        }
+
+    data["playlistItems"] = {playlist_id: [
+        {"items": items[i:i + page_size]} for i in range(0, len(items), page_size)
+    ]}
+    return data
+
+
+class FakeYouTubeAPI:
+    """
+    threaded http server answering commentThreads().list, comments().list,
+    playlistItems().list and videos().list from canned data.
+    pageToken is the index of the requested page
+
+    params:
+    - data: canned data, see build_canned_comments
+    - quota: requests allowed per API key before answering 403 quotaExceeded, None for no limit
+    - failures: http statuses (i.e. 503, 429) answered to the first requests, in order
+    """
+
+    def __init__(self, data, host="127.0.0.1", port=0, quota=None, failures=()):
+        self.data = data
+        self.quota = quota
+        self.failures = list(failures)
+        self.used = defaultdict(int)
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, endpoint, params):
+        """
+        returns (status, body) for a request, quota and injected failures are checked first
+        """
+        with self._lock:
+            api_key = params.get("key")
+            if self.quota is not None and self.used[api_key] >= self.quota:
+                return 403, _error(403, "quotaExceeded",
+                                   "The request cannot be completed because you have exceeded your quota.")
+            self.used[api_key] += 1
+            if self.failures:
+                status = self.failures.pop(0)
+                reason = "rateLimitExceeded" if status == 429 else "backendError"
+                return status, _error(status, reason, f"fake {status}")
+
+        if endpoint == "commentThreads":
+            key = params.get("videoId")
+            if key in self.data.get("disabled", ()):
+                return 403, _error(403, "commentsDisabled",
+                                   f"The video {key} has disabled comments.")
+        elif endpoint == "comments":
+            key = params.get("parentId")
+        elif endpoint == "playlistItems":
+            key = params.get("playlistId")
+        elif endpoint == "videos":
+            videos = self.data.get("videos", {})
+            ids = params.get("id", "").split(",")
+            return 200, {"items": [videos[i] for i in ids if i in videos]}
+        else:
+            return 404, _error(404, "notFound", f"{endpoint} is not faked")
+
+        pages = self.data.get(endpoint, {}).get(key)
+        if pages is None:
+            reason = {"commentThreads": "videoNotFound", "comments": "commentNotFound",
+                      "playlistItems": "playlistNotFound"}[endpoint]
+            return 404, _error(404, reason, f"{key} not found")
+
+        if endpoint == "commentThreads" and params.get("order") == "time":
+            pages = _pages_by_time(pages)
+
+        page = int(params.get("pageToken") or 0)
+        body = dict(pages[page])
+        if page + 1 < len(pages):
+            body["nextPageToken"] = str(page + 1)
+        return 200, body
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = url.path.rstrip("/").split("/")[-1]
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                with api._lock:
+                    api.requests.append((endpoint, params))
+
+                status, body = api.respond(endpoint, params)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _pages_by_time(pages):
+    """
+    commentThreads pages re-paginated newest first, as served with order=time
+    """
+    size = max(len(p["items"]) for p in pages) or 1
+    items = sorted((i for p in pages for i in p["items"]),
+                   key=lambda i: i["snippet"]["topLevelComment"]["snippet"]["publishedAt"],
+                   reverse=True)
+    return [{"items": items[i:i + size]} for i in range(0, len(items), size)] or [{"items": []}]
+
+
+def _error(code, reason, message):
+    return {
+        "error": {
+            "code": code,
+            "message": message,
+            "errors": [{"reason": reason, "message": message}],
+        }
+    }
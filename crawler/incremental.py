@@ -0,0 +1,107 @@
+import os
+import json
+import pandas as pd
+
+"""
+watermarks for incremental re-crawls: the newest video per channel and the
+newest top level comments per video already in a youtuber's dataset
+"""
+
+WATERMARKS_FILE = "crawl_watermarks.json"
+
+
+def build_watermarks(dataset_path: str, videos: list) -> dict:
+    """
+    computes watermarks from a comments dataset and its videos list
+
+    returns:
+    - {"newest_video": date, "videos": {video_id: {"newest_comment_date": date,
+       "newest_comment_ids": ids of the top level comments published at that date}}}
+    """
+    watermarks = {
+        "newest_video": max((v["date_published"] for v in videos), default=None),
+        "videos": {},
+    }
+    if not os.path.exists(dataset_path):
+        return watermarks
+
+    df = pd.read_csv(dataset_path, dtype=str,
+                     usecols=["video_id", "comment_id", "comment_publish_date", "is_reply"])
+    df = df[df["is_reply"] == "False"]
+
+    newest = df.groupby("video_id")["comment_publish_date"].transform("max")
+    df = df[df["comment_publish_date"] == newest]
+    for video_id, _df in df.groupby("video_id"):
+        watermarks["videos"][video_id] = {
+            "newest_comment_date": _df["comment_publish_date"].iloc[0],
+            "newest_comment_ids": _df["comment_id"].tolist(),
+        }
+    return watermarks
+
+
+def load_watermarks(path: str, dataset_path: str, videos: list) -> dict:
+    """
+    loads {path}crawl_watermarks.json, building it from the dataset if missing
+    """
+    _path = f"{path}{WATERMARKS_FILE}"
+    if os.path.exists(_path):
+        with open(_path) as f:
+            return json.load(f)
+    return build_watermarks(dataset_path, videos)
+
+
+def save_watermarks(watermarks: dict, path: str):
+    with open(f"{path}{WATERMARKS_FILE}", "w") as f:
+        json.dump(watermarks, f, indent=4)
+
+
+def new_comment_threads(response: dict, watermark: dict):
+    """
+    keeps the comment threads of a commentThreads page (ordered by time) that are
+    newer than the watermark
+
+    returns:
+    - response with only the new items
+    - reached: True if the page got to already crawled comments, no need for more pages
+    """
+    if not watermark:
+        return response, False
+
+    newest_date = watermark["newest_comment_date"]
+    seen_ids = set(watermark["newest_comment_ids"])
+
+    items = []
+    reached = False
+    for i in response["items"]:
+        tlc = i["snippet"]["topLevelComment"]
+        published_at = tlc["snippet"]["publishedAt"]
+        if published_at < newest_date:
+            reached = True
+            break
+        if tlc["id"] in seen_ids:
+            reached = True
+            continue
+        items.append(i)
+
+    return {**response, "items": items}, reached
+
+
+def merge_comments(dataset_path: str, delta_path: str, out_path: str) -> int:
+    """
+    appends the delta rows to the dataset, dropping comments already in it (by comment_id).
+    delta_path is rewritten with only the rows that were added, so it can be
+    applied to the networks built from the dataset (update_co_commenter_net)
+    returns the number of new rows
+    """
+    delta = pd.read_csv(delta_path, index_col=0, dtype=str, keep_default_na=False)
+    delta = delta.drop_duplicates("comment_id")
+
+    df = pd.DataFrame(columns=delta.columns)
+    if os.path.exists(dataset_path):
+        df = pd.read_csv(dataset_path, index_col=0, dtype=str, keep_default_na=False)
+    delta = delta[~delta["comment_id"].isin(df["comment_id"])].reset_index(drop=True)
+    delta.to_csv(delta_path)
+
+    df = pd.concat([df, delta], ignore_index=True)
+    df.to_csv(out_path)
+    return len(delta)
@@ -91,6 +91,54 @@ def parse_search_videos(response, channel, path):
     save_data_to_json(videos_data, _path)
 
 
+def parse_playlist_items(response):
+    """
+    parses a playlistItems page of a channel's uploads playlist into video infos
+    """
+    videos = []
+    for i in response["items"]:
+        _snippets = i["snippet"]
+        _video_info = {}
+        _video_info["video_id"] = i["contentDetails"]["videoId"]
+        _video_info["date_published"] = i["contentDetails"].get("videoPublishedAt",
+                                                                _snippets["publishedAt"])
+        _video_info["video_title"] = _snippets["title"]
+        _video_info["video_desc"] = _snippets["description"]
+        videos.append(_video_info)
+    return videos
+
+
+def parse_videos_statistics(response):
+    """
+    parses a videos().list response into video_id -> statistics
+    counts are missing when hidden by the channel (i.e. comments disabled)
+    """
+    stats = {}
+    for i in response["items"]:
+        _statistics = i.get("statistics", {})
+        stats[i["id"]] = {
+            "view_count": int(_statistics.get("viewCount", 0)),
+            "like_count": int(_statistics.get("likeCount", 0)),
+            "comment_count": int(_statistics.get("commentCount", 0)),
+        }
+    return stats
+
+
+def save_videos_list(videos, channel, path, next_page_token=None):
+    """
+    saves videos in the same videos_list.json format as parse_search_videos
+    """
+    videos_data = {}
+    videos_data["channel_title"] = channel["channel_title"]
+    videos_data["channel_id"] = channel["channel_id"]
+    videos_data["youtuber"] = channel["youtuber"]
+    videos_data["nextPageToken"] = next_page_token
+    videos_data["videos"] = videos
+
+    _path = f"{path}/videos_list.json"
+    save_data_to_json(videos_data, _path)
+
+
 def parse_channel_info(response, name):
     # get response specific infos
     items = response["items"][0]
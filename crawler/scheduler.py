@@ -0,0 +1,197 @@
+import time
+import random
+import threading
+from collections import defaultdict
+
+import googleapiclient.errors
+
+"""
+quota aware scheduling of YouTube Data API requests
+https://developers.google.com/youtube/v3/determine_quota_cost
+"""
+
+# quota units per request, by endpoint
+QUOTA_COSTS = {
+    "search.list": 100,
+    "channels.list": 1,
+    "videos.list": 1,
+    "playlistItems.list": 1,
+    "commentThreads.list": 1,
+    "comments.list": 1,
+}
+
+QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class QuotaExhaustedError(Exception):
+    """
+    raised when every API key has run out of quota
+    """
+
+
+def error_reason(e: googleapiclient.errors.HttpError) -> str:
+    details = getattr(e, "error_details", None)
+    if isinstance(details, list) and details and isinstance(details[0], dict):
+        return details[0].get("reason", "")
+    return ""
+
+
+class RequestScheduler:
+    """
+    executes API requests for Crawling:
+    - accounts quota units per endpoint and per key
+    - rate limits to requests_per_second
+    - retries rate limit errors, 429 and 5xx with exponential backoff
+    - switches to the next key when one returns quotaExceeded
+
+    thread safe, each thread gets its own client per key
+    """
+
+    def __init__(self, api_keys, build_client, requests_per_second=None,
+                 daily_quota=10000, max_retries=5, backoff_base=1.0):
+        """
+        params:
+        - api_keys: list of developer keys, used round robin
+        - build_client: function key -> youtube client
+        - requests_per_second: target request rate, None for no limit
+        - daily_quota: quota units per key
+        - max_retries: retries of a request before raising its error
+        - backoff_base: first backoff wait in seconds, doubled at each retry
+        """
+        if not api_keys:
+            raise ValueError("at least one API key is needed")
+
+        self.api_keys = list(api_keys)
+        self.daily_quota = daily_quota
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._build_client = build_client
+        self._interval = 1 / requests_per_second if requests_per_second else 0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_key = 0
+        self._next_slot = 0.
+        self._exhausted = set()
+
+        self._start = time.time()
+        self.requests = 0
+        self.retries = 0
+        self.errors = defaultdict(int)
+        self.units_per_endpoint = defaultdict(int)
+        self.units_per_key = defaultdict(int)
+
+    def execute(self, endpoint: str, build_request):
+        """
+        executes a request, retrying and switching keys as needed
+
+        params:
+        - endpoint: resource.method, i.e. "commentThreads.list", for quota accounting
+        - build_request: function youtube client -> googleapiclient request
+        """
+        cost = QUOTA_COSTS.get(endpoint, 1)
+        attempt = 0
+        while True:
+            key = self._pick_key(cost)
+            self._throttle()
+
+            try:
+                response = build_request(self._client(key)).execute()
+                self._account(endpoint, key, cost)
+                return response
+            except googleapiclient.errors.HttpError as e:
+                status = e.resp.status
+                reason = error_reason(e)
+                with self._lock:
+                    self.errors[reason or str(status)] += 1
+
+                if status == 403 and reason in QUOTA_REASONS:
+                    print(f"key ...{key[-4:]} ran out of quota, switching keys")
+                    with self._lock:
+                        self._exhausted.add(key)
+                    continue
+
+                # the request reached the API, it still costs quota
+                self._account(endpoint, key, cost)
+                retryable = status == 429 or status >= 500 or \
+                    (status == 403 and reason in RATE_LIMIT_REASONS)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+
+                wait = self.backoff_base * 2 ** attempt
+                wait += random.uniform(0, wait / 2)
+                print(f"    {endpoint} failed with {status} {reason}, retrying in {wait:.2f} sec")
+                with self._lock:
+                    self.retries += 1
+                attempt += 1
+                time.sleep(wait)
+
+    def remaining_quota(self) -> int:
+        return sum(max(self.daily_quota - self.units_per_key[k], 0)
+                   for k in self.api_keys if k not in self._exhausted)
+
+    def report(self) -> dict:
+        """
+        running quota and throughput report
+        """
+        with self._lock:
+            elapsed = time.time() - self._start
+            return {
+                "elapsed_sec": elapsed,
+                "requests": self.requests,
+                "requests_per_second": self.requests / elapsed if elapsed else 0,
+                "retries": self.retries,
+                "errors": dict(self.errors),
+                "quota_units": sum(self.units_per_endpoint.values()),
+                "remaining_quota": self.remaining_quota(),
+                "units_per_endpoint": dict(self.units_per_endpoint),
+                "units_per_key": {f"...{k[-4:]}": u for k, u in self.units_per_key.items()},
+                "exhausted_keys": len(self._exhausted),
+            }
+
+    def print_report(self):
+        r = self.report()
+        print(f"    {r['requests']} requests in {r['elapsed_sec']:.1f} sec "
+              f"({r['requests_per_second']:.2f} req/s), {r['retries']} retries")
+        print(f"    quota used: {r['quota_units']} units, remaining: {r['remaining_quota']}")
+        for endpoint, units in r["units_per_endpoint"].items():
+            print(f"        {endpoint}: {units}")
+
+    def _pick_key(self, cost) -> str:
+        with self._lock:
+            for _ in range(len(self.api_keys)):
+                key = self.api_keys[self._next_key]
+                self._next_key = (self._next_key + 1) % len(self.api_keys)
+                if key in self._exhausted:
+                    continue
+                if self.units_per_key[key] + cost > self.daily_quota:
+                    self._exhausted.add(key)
+                    continue
+                return key
+        raise QuotaExhaustedError(
+            f"all {len(self.api_keys)} API keys are out of quota")
+
+    def _throttle(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _account(self, endpoint, key, cost):
+        with self._lock:
+            self.requests += 1
+            self.units_per_endpoint[endpoint] += cost
+            self.units_per_key[key] += cost
+
+    def _client(self, key):
+        clients = getattr(self._local, "clients", None)
+        if clients is None:
+            clients = self._local.clients = {}
+        if key not in clients:
+            clients[key] = self._build_client(key)
+        return clients[key]
@@ -0,0 +1,183 @@
+import os
+import shutil
+from abc import ABC, abstractmethod
+import pandas as pd
+
+"""
+append-only sinks for crawled comment rows. Rows are buffered up to chunk_rows
+and flushed as part files, so memory stays bounded however long the crawl is.
+to_csv streams the parts into the single comments csv read by build_networks,
+to_dataset into the typed parquet dataset (crawler.dataset)
+"""
+
+# columns emitted by parse_comment_threads / parse_replies, in order
+COMMENT_COLUMNS = [
+    "video_id",
+    "video_title",
+    "comment_id",
+    "comment_text",
+    "comment_author_name",
+    "comment_author_channel_id",
+    "comment_like_count",
+    "comment_publish_date",
+    "comment_reply_count",
+    "is_reply",
+    "parent_comment_id",
+]
+
+
+class CommentSink(ABC):
+    """
+    base sink, subclasses write and read the part files
+    """
+
+    def __init__(self, out_dir: str, chunk_rows: int = 50000):
+        """
+        params:
+        - out_dir: directory for the part files, emptied on creation
+        - chunk_rows: rows buffered before a part is written
+        """
+        self.out_dir = out_dir
+        self.chunk_rows = chunk_rows
+        self.num_rows = 0
+        self._buffer = []
+        self._parts = []
+        self._n_flushes = 0
+
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+
+    def push(self, rows: list):
+        """
+        appends a batch of row dicts
+        """
+        self._buffer += rows
+        self.num_rows += len(rows)
+        if len(self._buffer) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        df = pd.DataFrame(self._buffer, columns=COMMENT_COLUMNS)
+        self._buffer = []
+        self._parts += self._write_part(df, self._n_flushes)
+        self._n_flushes += 1
+
+    def to_csv(self, path: str):
+        """
+        writes every row, in push order, to a single csv with a running index
+        like DataFrame.to_csv
+        """
+        self.flush()
+        offset = 0
+        header = True
+        with open(path, "w", newline="") as f:
+            for df in self._read_parts():
+                df.index = pd.RangeIndex(offset, offset + len(df))
+                df.to_csv(f, header=header)
+                offset += len(df)
+                header = False
+            if header:
+                pd.DataFrame(columns=COMMENT_COLUMNS).to_csv(f)
+
+    def to_dataset(self, root: str, youtuber: str) -> str:
+        """
+        writes every row to the youtuber partition of the typed comment dataset
+        (crawler.dataset), one file per part
+        """
+        from .dataset import write_comments_dataset
+
+        self.flush()
+        return write_comments_dataset(self._read_parts(), root, youtuber)
+
+    @abstractmethod
+    def _write_part(self, df: pd.DataFrame, n: int) -> list:
+        """
+        writes df as part n, returns the written [(file, partition value)]
+        """
+
+    @abstractmethod
+    def _read_parts(self):
+        """
+        yields the written parts as dataframes, in write order
+        """
+
+
+class CSVCommentSink(CommentSink):
+    """
+    chunked csv parts, out_dir/part-00000.csv, ...
+    """
+
+    def _write_part(self, df, n):
+        part = os.path.join(self.out_dir, f"part-{n:05d}.csv")
+        df.to_csv(part, index=False)
+        return [(part, None)]
+
+    def _read_parts(self):
+        for part, _ in self._parts:
+            # keep ids and texts as written
+            yield pd.read_csv(part, dtype=str, keep_default_na=False)
+
+
+class ParquetCommentSink(CommentSink):
+    """
+    parquet parts partitioned by youtuber and video, hive style:
+    out_dir/youtuber=<name>/video_id=<id>/part-00000.parquet
+    """
+
+    def __init__(self, out_dir: str, youtuber: str, chunk_rows: int = 50000,
+                 partition_by_video: bool = True):
+        super().__init__(out_dir, chunk_rows)
+        self.youtuber = youtuber
+        self.partition_by_video = partition_by_video
+
+    def _write_part(self, df, n):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # replies have the parent id, top level comments 0
+        df["parent_comment_id"] = df["parent_comment_id"].astype(str)
+        base = os.path.join(self.out_dir, f"youtuber={self.youtuber}")
+
+        groups = [(None, df)]
+        if self.partition_by_video:
+            groups = df.groupby("video_id", sort=False)
+
+        parts = []
+        for video_id, _df in groups:
+            _dir = base
+            if video_id is not None:
+                # the partition directory holds the video id
+                _dir = os.path.join(base, f"video_id={video_id}")
+                _df = _df.drop(columns="video_id")
+            os.makedirs(_dir, exist_ok=True)
+            part = os.path.join(_dir, f"part-{n:05d}.parquet")
+            pq.write_table(pa.Table.from_pandas(_df, preserve_index=False), part)
+            parts.append((part, video_id))
+        return parts
+
+    def _read_parts(self):
+        import pyarrow.parquet as pq
+
+        for part, video_id in self._parts:
+            df = pq.read_table(part).to_pandas()
+            if video_id is not None:
+                df["video_id"] = video_id
+            yield df[COMMENT_COLUMNS]
+
+
+def make_comment_sink(path: str, youtuber: str, fmt: str = "csv", chunk_rows: int = 50000) -> CommentSink:
+    """
+    sink for a youtuber's crawl, parts are written under {path}comments_parts/
+
+    params:
+    - path: current youtuber path, i.e ./data/{youtuber}/
+    - fmt: "csv" or "parquet"
+    """
+    out_dir = f"{path}comments_parts/"
+    if fmt == "csv":
+        return CSVCommentSink(out_dir, chunk_rows)
+    elif fmt == "parquet":
+        return ParquetCommentSink(out_dir, youtuber, chunk_rows)
+    raise ValueError(f"unknown comment sink format {fmt}")
@@ -1,48 +1,69 @@
-import pickle
+import os
 import networkx as nx
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from tqdm import tqdm
 from itertools import combinations
 
-from typing import Optional
+from typing import Iterator, Optional, Tuple, Union
 from constants import CURR_YTBR, CURR_PATH
+from graphs.graph_store import save_graph_csr, save_matrix_csr, load_graph_csr
+from profiling import timed
 
 
-def build_video_commenter_net(df: pd.DataFrame, G: Optional[nx.Graph] = None, weighted=True) -> nx.Graph:
+@timed()
+def build_video_commenter_net(df: Union[pd.DataFrame, str], G: Optional[nx.Graph] = None,
+                              weighted=True, path: str = CURR_PATH) -> nx.Graph:
     """
     params:
-    - df: youtube dataframe
-    - G: optional graph param, if None, dumps the graph to current path. If not none, builds and returns G
+    - df: youtube dataframe, or the path of a comments .csv / .parquet file,
+      streamed in chunks (incidence_matrix_from_path)
+    - G: optional graph param, if None, dumps the graph to path. If not none, builds and returns G
     - weighted: to consider graph weights or not
+    - path: youtuber path the graph is saved to, i.e ./data/{youtuber}/
     """
     graph_is_none = G is None
     if graph_is_none:
         G = nx.Graph()
 
-    for _, row in tqdm(df.iterrows(), desc="building video-commenter network ...", total=len(df)):
-        video = row["video_id"]
-        commenter = row["comment_author_channel_id"]
+    print(f"building video-commenter network ...")
+    # (video, commenter) -> number of comments
+    if isinstance(df, str):
+        B, video_nodes, commenter_nodes = build_incidence_matrix(df)
+        B = B.tocoo()
+        videos, commenters, counts = video_nodes[B.row], commenter_nodes[B.col], B.data
+        del B
+    else:
+        counts = df.groupby(["video_id", "comment_author_channel_id"], sort=False).size()
+        videos = counts.index.get_level_values(0)
+        commenters = counts.index.get_level_values(1)
+        video_nodes, commenter_nodes = videos.unique(), commenters.unique()
+        counts = counts.to_numpy()
 
-        # set Node types 
-        if not G.has_node(video):
-            G.add_node(video, type="video")
-        if not G.has_node(commenter):
-            G.add_node(commenter, type="commenter")
-
-        has_edge = G.has_edge(video, commenter)
-        if has_edge and weighted:
-            G[video][commenter]['weight'] += 1
-        elif not has_edge:
-            G.add_edge(video, commenter, weight=1)
+    # set Node types, keeping the type of nodes already in G
+    G.add_nodes_from((v for v in video_nodes if v not in G), type="video")
+    G.add_nodes_from((c for c in commenter_nodes if c not in G), type="commenter")
 
+    weights = counts if weighted else np.ones(len(counts), dtype=np.int64)
+    edges = zip(videos.tolist(), commenters.tolist(), weights.tolist())
+    if G.number_of_edges() == 0:
+        G.add_weighted_edges_from(edges)
+    else:
+        for video, commenter, w in edges:
+            if not G.has_edge(video, commenter):
+                G.add_edge(video, commenter, weight=w)
+            elif weighted:
+                G[video][commenter]['weight'] += w
 
     if graph_is_none:
         print(f"saving...")
         print(f"graph has {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
-        pickle.dump(G, open(f'{CURR_PATH}/video_commenter_network.pickle', 'wb'))
+        save_graph_csr(G, f'{path}/video_commenter_network.csr')
     return G
 
 
+@timed()
 def build_co_commenter_net(df: pd.DataFrame, G: Optional[nx.Graph] = None) -> nx.Graph:
     graph_is_none = G is None
     if graph_is_none:
@@ -73,7 +94,7 @@ def build_co_commenter_net(df: pd.DataFrame, G: Optional[nx.Graph] = None) -> nx
     if graph_is_none:
         print(f"saving...")
         print(f"graph has {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
-        pickle.dump(G, open(f'{CURR_PATH}/co_commenter_network.pickle', 'wb'))
+        save_graph_csr(G, f'{CURR_PATH}/co_commenter_network.csr')
         # if save_as_edgelist:
         #     with open(f'{CURR_PATH}/co_commenter_network_edgelist.txt', 'w') as f:
         #         for u, v in G.edges():
@@ -87,9 +108,319 @@ def build_vid_co_commenter_net(df: pd.DataFrame):
     G = build_video_commenter_net(df,G, weighted=False)
     G = build_co_commenter_net(df,G)
 
-    pickle.dump(G, open(f'{CURR_PATH}/video_co_commenter_network.pickle', 'wb'))
+    save_graph_csr(G, f'{CURR_PATH}/video_co_commenter_network.csr')
     print(f"video_co_commenter_network of youtuber {CURR_YTBR} saved at {CURR_PATH}")
     print(f"graph has {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
 
 
+INCIDENCE_COLUMNS = ["video_id", "comment_author_channel_id"]
+
+
+def encode_comments(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    encodes videos and commenters as integer codes, rows without video or
+    author are dropped (as incidence_matrix_from_path does)
+
+    returns:
+    - video_codes, commenter_codes: one code per kept comment row
+    - videos, commenters: code -> original id
+    """
+    # NaN ids would get code -1
+    df = df.dropna(subset=INCIDENCE_COLUMNS)
+    video_codes, videos = pd.factorize(df["video_id"])
+    commenter_codes, commenters = pd.factorize(df["comment_author_channel_id"])
+    return video_codes, commenter_codes, np.asarray(videos), np.asarray(commenters)
+
+
+def read_comment_chunks(path: str, chunksize: int = 1_000_000) -> Iterator[pd.DataFrame]:
+    """
+    yields the video_id / comment_author_channel_id columns of a comments .csv,
+    .parquet file or parquet directory (crawler.dataset partition) in chunks of
+    chunksize rows, as categoricals, other columns (comment_text) are never loaded
+    """
+    if path.endswith(".parquet") or os.path.isdir(path):
+        # i.e. a youtuber partition of the comment dataset, only the two columns are read
+        from crawler.dataset import open_comments_dataset
+        dataset = open_comments_dataset(path)
+        for batch in dataset.to_batches(columns=INCIDENCE_COLUMNS, batch_size=chunksize):
+            yield batch.to_pandas().astype("category")
+    else:
+        yield from pd.read_csv(path, usecols=INCIDENCE_COLUMNS, chunksize=chunksize,
+                               dtype="category")
+
+
+def _global_codes(values: pd.Index, ids: dict) -> np.ndarray:
+    """
+    codes of a chunk's unique values in ids (value -> code), new values get the next codes
+    """
+    codes = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values.tolist()):
+        codes[i] = ids.setdefault(value, len(ids))
+    return codes
+
+
+def _merge_pairs(keys: list, counts: list) -> Tuple[np.ndarray, np.ndarray]:
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    return keys, np.bincount(inverse, np.concatenate(counts)).astype(np.int64)
+
+
+@timed()
+def incidence_matrix_from_path(path: str, chunksize: int = 1_000_000
+                               ) -> Tuple[sp.csr_matrix, np.ndarray, np.ndarray]:
+    """
+    build_incidence_matrix streaming a comments .csv / .parquet file in chunks.
+    Every chunk is reduced to its distinct (video, commenter) pairs with counts,
+    merged into the running pairs, so memory is bounded by the incidence matrix
+    (the graph), not by the number of comment rows or their text
+
+    returns:
+    - B, videos, commenters: as build_incidence_matrix, ids in order of first appearance
+    """
+    video_ids, commenter_ids = {}, {}
+    keys, counts = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)]
+    merged = 0
+    rows = 0
+    for chunk in read_comment_chunks(path, chunksize):
+        rows += len(chunk)
+        # rows without video or author would add empty rows / columns
+        chunk = chunk.dropna()
+        video_codes, videos = pd.factorize(chunk["video_id"])
+        commenter_codes, commenters = pd.factorize(chunk["comment_author_channel_id"])
+        video_codes = _global_codes(videos, video_ids)[video_codes]
+        commenter_codes = _global_codes(commenters, commenter_ids)[commenter_codes]
+
+        chunk_keys, chunk_counts = np.unique((video_codes << 32) | commenter_codes,
+                                             return_counts=True)
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+        # merged when the new pairs outgrow the merged ones, amortised linear
+        if sum(len(k) for k in keys[1:]) > merged:
+            merged_keys, merged_counts = _merge_pairs(keys, counts)
+            keys, counts = [merged_keys], [merged_counts]
+            merged = len(merged_keys)
+    keys, counts = _merge_pairs(keys, counts)
+    print(f"    {rows} comments, {len(keys)} (video, commenter) pairs")
+
+    videos = np.array(list(video_ids), dtype=object)
+    commenters = np.array(list(commenter_ids), dtype=object)
+    B = sp.coo_matrix((counts, (keys >> 32, keys & 0xFFFFFFFF)),
+                      shape=(len(videos), len(commenters))).tocsr()
+    return B, videos, commenters
+
+
+@timed()
+def build_incidence_matrix(df: Union[pd.DataFrame, str]
+                           ) -> Tuple[sp.csr_matrix, np.ndarray, np.ndarray]:
+    """
+    builds the video x commenter incidence matrix B, where B[v, c] is the
+    number of comments of commenter c on video v
+
+    params:
+    - df: comments dataframe, or the path of a comments .csv / .parquet file,
+      streamed by incidence_matrix_from_path
+
+    returns:
+    - B: sparse incidence matrix
+    - videos, commenters: row / column index -> original id
+    """
+    if isinstance(df, str):
+        return incidence_matrix_from_path(df)
+    video_codes, commenter_codes, videos, commenters = encode_comments(df)
+    data = np.ones(len(video_codes), dtype=np.int64)
+    # duplicated (video, commenter) entries are summed on conversion
+    B = sp.coo_matrix((data, (video_codes, commenter_codes)),
+                      shape=(len(videos), len(commenters))).tocsr()
+    return B, videos, commenters
+
+
+@timed()
+def co_commenter_matrix(B: sp.csr_matrix, min_weight: int = 1, chunk_size: int = 5000) -> sp.csr_matrix:
+    """
+    computes co-commenter weights as B^T B, in chunks of commenters, keeping
+    only the upper triangle (with self loops on the diagonal)
+
+    weights match build_co_commenter_net, where every pair of comments of a
+    video counts once:
+    - u != v: sum over videos of B[:, u] * B[:, v]
+    - u == v: sum over videos of C(B[:, u], 2)
+
+    params:
+    - B: video x commenter incidence matrix
+    - min_weight: edges with weight below it are pruned chunk by chunk,
+      so the full product is never held in memory
+    - chunk_size: number of commenter rows multiplied at once
+    """
+    Bt = B.T.tocsr()
+    B = B.tocsc()
+    n = Bt.shape[0]
+    # number of comments per commenter, used to turn the diagonal into C(c, 2)
+    n_comments = np.asarray(Bt.sum(axis=1)).ravel()
+
+    empty = np.array([], dtype=np.int64)
+    rows, cols, weights = [empty], [empty], [empty]
+    for start in tqdm(range(0, n, chunk_size), desc="building co-commenter matrix...",
+                      total=-(-n // chunk_size)):
+        stop = min(start + chunk_size, n)
+        chunk = (Bt[start:stop] @ B).tocoo()
+
+        r = chunk.row + start
+        upper = chunk.col >= r
+        r, c, w = r[upper], chunk.col[upper], chunk.data[upper]
+
+        diag = r == c
+        w[diag] = (w[diag] - n_comments[r[diag]]) // 2
+
+        keep = (w >= min_weight) & (w > 0)
+        rows.append(r[keep])
+        cols.append(c[keep])
+        weights.append(w[keep])
+
+    W = sp.coo_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+                      shape=(n, n)).tocsr()
+    return W
+
+
+def matrix_to_graph(W: sp.csr_matrix, commenters: np.ndarray, G: Optional[nx.Graph] = None) -> nx.Graph:
+    """
+    materialises an upper triangular co-commenter matrix as a networkx graph,
+    adding its weights to G's edges if G is given
+    """
+    if G is None:
+        G = nx.Graph()
+
+    W = W.tocoo()
+    nodes = np.unique(np.concatenate([W.row, W.col]))
+    G.add_nodes_from(commenters[nodes].tolist(), type="commenter")
+
+    us = commenters[W.row].tolist()
+    vs = commenters[W.col].tolist()
+    ws = W.data.tolist()
+    if G.number_of_edges() == 0:
+        G.add_weighted_edges_from(zip(us, vs, ws))
+    else:
+        for u, v, w in zip(us, vs, ws):
+            if G.has_edge(u, v):
+                G[u][v]["weight"] += w
+            else:
+                G.add_edge(u, v, weight=w)
+    return G
+
+
+@timed()
+def build_co_commenter_net_sparse(df: Union[pd.DataFrame, str], G: Optional[nx.Graph] = None,
+                                  min_weight: int = 1, as_graph: bool = True,
+                                  path: str = CURR_PATH):
+    """
+    sparse matrix version of build_co_commenter_net, same edge weights
+
+    params:
+    - df: youtube dataframe, or the path of a comments .csv / .parquet file,
+      streamed in chunks (incidence_matrix_from_path)
+    - G: optional graph param, if None, saves the graph to path. If not none, adds the edges to G
+    - min_weight: minimum co-commenter weight for an edge to be kept
+    - as_graph: if False, returns (W, commenters) without building a networkx graph
+    - path: youtuber path the graph is saved to, i.e ./data/{youtuber}/
+    """
+    B, _, commenters = build_incidence_matrix(df)
+    W = co_commenter_matrix(B, min_weight=min_weight)
+    del B, df
+
+    if G is None:
+        # saved straight from the matrix, without building the networkx graph
+        print(f"saving...")
+        print(f"graph has {W.nnz} edges")
+        save_matrix_csr(W, commenters, f'{path}/co_commenter_network.csr')
+
+    if not as_graph:
+        return W, commenters
+    return matrix_to_graph(W, commenters, G)
+
+
+def co_commenter_delta(df: pd.DataFrame, delta: pd.DataFrame) -> Tuple[sp.csr_matrix, np.ndarray]:
+    """
+    weight increments of the co-commenter network when the delta comments are
+    added to df. Only videos with new comments are used, the increment is
+    W(old + new comments) - W(old comments) over those videos
+
+    params:
+    - df: comments already in the network
+    - delta: new comments
+
+    returns:
+    - dW: upper triangular weight increments, self loops on the diagonal
+    - commenters: matrix index -> commenter id
+    """
+    # dropped here so the first n_old encoded rows are the old comments
+    delta = delta.dropna(subset=INCIDENCE_COLUMNS)
+    videos = delta["video_id"].unique()
+    old = df[df["video_id"].isin(videos)].dropna(subset=INCIDENCE_COLUMNS)
+
+    both = pd.concat([old, delta], ignore_index=True)
+    video_codes, commenter_codes, videos, commenters = encode_comments(both)
+    shape = (len(videos), len(commenters))
+
+    n_old = len(old)
+    ones = np.ones(len(both), dtype=np.int64)
+    B_old = sp.coo_matrix((ones[:n_old], (video_codes[:n_old], commenter_codes[:n_old])),
+                          shape=shape).tocsr()
+    B_new = sp.coo_matrix((ones, (video_codes, commenter_codes)), shape=shape).tocsr()
+
+    dW = (co_commenter_matrix(B_new) - co_commenter_matrix(B_old)).tocsr()
+    dW.eliminate_zeros()
+    return dW, commenters
+
+
+def _reindex_upper(W: sp.spmatrix, index: np.ndarray, n: int) -> sp.csr_matrix:
+    """
+    moves an upper triangular matrix to another node index, keeping it upper triangular
+    """
+    W = W.tocoo()
+    r, c = index[W.row], index[W.col]
+    return sp.coo_matrix((W.data, (np.minimum(r, c), np.maximum(r, c))), shape=(n, n)).tocsr()
+
+
+@timed(sizes=lambda df, delta, *a, **k: {"rows": len(df), "delta_rows": len(delta)})
+def update_co_commenter_net(df: pd.DataFrame, delta: pd.DataFrame, path: str,
+                            filtered_path: Optional[str] = None, min_edge_weight: int = 10):
+    """
+    applies new comments to a stored co-commenter network instead of rebuilding it.
+    Only pairs of commenters of videos with new comments change, the result is
+    the same as build_co_commenter_net_sparse on df + delta
+
+    params:
+    - df: comments the stored network was built from
+    - delta: new comments
+    - path: stored co-commenter network (.csr), updated in place
+    - filtered_path: optional filtered, without self loops, network of path
+      (filter_and_save_graph) to patch as well
+    - min_edge_weight: min_edge_weight used for the filtered network
+    """
+    print(f"updating co-commenter network with {len(delta)} new comments ...")
+    dW, delta_commenters = co_commenter_delta(df, delta)
+
+    csr = load_graph_csr(path, mmap=False)
+    nodes = pd.Index(csr.nodes)
+    new_nodes = pd.Index(delta_commenters).difference(nodes)
+    nodes = nodes.append(new_nodes)
+    n = len(nodes)
+
+    W = _reindex_upper(csr.upper_matrix(), np.arange(csr.number_of_nodes()), n)
+    dW = _reindex_upper(dW, nodes.get_indexer(delta_commenters), n)
+    W = W + dW
+    print(f"    {dW.nnz} edges changed, {len(new_nodes)} new commenters")
+    save_matrix_csr(W, nodes.to_numpy(), path)
+
+    if filtered_path is None:
+        return
 
+    # weights only grow: edges not touched by the delta keep their filtered state,
+    # touched ones are kept if they now reach min_edge_weight
+    fcsr = load_graph_csr(filtered_path, mmap=False)
+    F = _reindex_upper(fcsr.upper_matrix(), nodes.get_indexer(fcsr.nodes), n)
+    touched = (dW > 0).astype(W.dtype)
+    W_touched = sp.triu(W.multiply(touched), k=1).tocsr()
+    W_touched.data[W_touched.data < min_edge_weight] = 0
+    F = F - F.multiply(touched) + W_touched
+    F.eliminate_zeros()
+    save_matrix_csr(F, nodes.to_numpy(), filtered_path)
+    print(f"    filtered network patched")
@@ -0,0 +1,246 @@
+import time
+import heapq
+import numpy as np
+import networkx as nx
+from collections import Counter
+from multiprocessing import Value
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+streaming statistics of maximal cliques with at least min_size members.
+Cliques are consumed one at a time, only counts, a size histogram and the set
+of clique members are kept.
+
+Nodes with core number < min_size - 1 cannot be in such a clique, so
+enumeration runs on the (min_size - 1)-core. The maximal cliques of size
+>= min_size are the same there as in the full graph.
+
+Nodes are numbered in degeneracy order and every maximal clique is enumerated
+from its earliest node (its root), so the enumeration order, and the index of
+the largest clique, only depend on the graph, not on how roots are split
+across processes
+"""
+
+_adj = None
+_counter = None
+
+
+def _adjacency(G: nx.Graph):
+    """
+    nodes of G and their neighbour sets as node indexes, self loops left out
+    """
+    nodes = list(G)
+    index = {u: i for i, u in enumerate(nodes)}
+    return nodes, [{index[v] for v in G[u] if v != u} for u in nodes]
+
+
+def _degeneracy(adj: list):
+    """
+    smallest-last ordering of an index adjacency: nodes are removed one at a
+    time, each with the fewest neighbours left, ties broken by index.
+
+    returns:
+    - order: node indexes in removal order, every node has at most
+      degeneracy neighbours later in it
+    - core: core number per node index, non decreasing along order
+    """
+    degree = [len(a) for a in adj]
+    heap = [(d, i) for i, d in enumerate(degree)]
+    heapq.heapify(heap)
+    removed = [False] * len(adj)
+    order, core = [], [0] * len(adj)
+    k = 0
+    while heap:
+        d, i = heapq.heappop(heap)
+        # stale heap entry
+        if removed[i] or d != degree[i]:
+            continue
+        removed[i] = True
+        k = max(k, d)
+        core[i] = k
+        order.append(i)
+        for j in adj[i]:
+            if not removed[j]:
+                degree[j] -= 1
+                heapq.heappush(heap, (degree[j], j))
+    return order, core
+
+
+def degeneracy_order(G: nx.Graph) -> list:
+    """
+    nodes of G in smallest-last (degeneracy) order, ties broken by position in G.nodes()
+    """
+    nodes, adj = _adjacency(G)
+    return [nodes[i] for i in _degeneracy(adj)[0]]
+
+
+class CliqueStats:
+    """
+    running statistics of the maximal cliques seen, cliques are lists whose
+    first node is their root
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sizes = Counter()
+        self.max_size = 0
+        # (root, index among the root's cliques) of the first largest clique
+        self.max_at = None
+        self.root_counts = Counter()
+        self.members = set()
+        self.complete = True
+
+    @property
+    def max_idx(self) -> int:
+        """
+        index of the first largest clique in root order, -1 without cliques
+        """
+        if self.max_at is None:
+            return -1
+        root, i = self.max_at
+        return sum(n for r, n in self.root_counts.items() if r < root) + i
+
+    def add(self, clique):
+        size = len(clique)
+        root = clique[0]
+        if size > self.max_size:
+            self.max_size = size
+            self.max_at = (root, self.root_counts[root])
+        self.root_counts[root] += 1
+        self.count += 1
+        self.sizes[size] += 1
+        self.members.update(clique)
+
+    def merge(self, other: "CliqueStats"):
+        """
+        adds the cliques of other, enumerated from other roots
+        """
+        if other.max_size > self.max_size or \
+                (other.max_size == self.max_size and other.max_at is not None and
+                 other.max_at < self.max_at):
+            self.max_size = other.max_size
+            self.max_at = other.max_at
+        self.count += other.count
+        self.sizes.update(other.sizes)
+        self.root_counts.update(other.root_counts)
+        self.members |= other.members
+        self.complete &= other.complete
+
+    def mean(self) -> float:
+        return sum(s * n for s, n in self.sizes.items()) / self.count
+
+    def median(self) -> float:
+        """
+        exact median from the size histogram, as np.median of every size
+        """
+        sizes = sorted(self.sizes)
+        counts = np.cumsum([self.sizes[s] for s in sizes])
+        lo = sizes[np.searchsorted(counts, (self.count - 1) // 2, side="right")]
+        hi = sizes[np.searchsorted(counts, self.count // 2, side="right")]
+        return (lo + hi) / 2
+
+
+def _bron_kerbosch(R, P, X, adj):
+    """
+    maximal cliques extending R, with Tomita pivoting
+    """
+    if not P and not X:
+        yield R
+        return
+    pivot = max(P | X, key=lambda u: len(P & adj[u]))
+    for v in list(P - adj[pivot]):
+        yield from _bron_kerbosch(R + [v], P & adj[v], X & adj[v], adj)
+        P.remove(v)
+        X.add(v)
+
+
+def _root_cliques(root, adj):
+    """
+    maximal cliques whose earliest node is root, nodes numbered in order,
+    every maximal clique is found from exactly one root
+    """
+    later = {u for u in adj[root] if u > root}
+    earlier = adj[root] - later
+    yield from _bron_kerbosch([root], later, earlier, adj)
+
+
+def _take(stats: CliqueStats, max_cliques, counter) -> bool:
+    """
+    True if one more clique fits in max_cliques, counted across processes with counter
+    """
+    if counter is None:
+        return stats.count < max_cliques
+    with counter.get_lock():
+        if counter.value >= max_cliques:
+            return False
+        counter.value += 1
+        return True
+
+
+def _enumerate(cliques, min_size, deadline, max_cliques, counter=None) -> CliqueStats:
+    stats = CliqueStats()
+    for c in cliques:
+        # checked on every clique, small ones can be most of the enumeration
+        if deadline and time.time() > deadline:
+            stats.complete = False
+            break
+        if len(c) < min_size:
+            continue
+        if max_cliques and not _take(stats, max_cliques, counter):
+            stats.complete = False
+            break
+        stats.add(c)
+    return stats
+
+
+def _init_worker(adj, counter):
+    global _adj, _counter
+    _adj, _counter = adj, counter
+
+
+def _roots_worker(args):
+    roots, min_size, deadline, max_cliques = args
+    cliques = (c for r in roots for c in _root_cliques(r, _adj))
+    return _enumerate(cliques, min_size, deadline, max_cliques, _counter)
+
+
+def stream_clique_stats(G: nx.Graph, min_size: int = 5, time_budget=None,
+                        max_cliques=None, processes: int = 1) -> CliqueStats:
+    """
+    statistics of the maximal cliques of G with at least min_size members
+
+    params:
+    - time_budget: seconds of enumeration before stopping, None for no limit
+    - max_cliques: cliques counted before stopping, over every process, None for no limit
+    - processes: >1 splits the enumeration by root node across processes, roots
+      dealt round robin in degeneracy order so every process gets a share of the
+      dense part. Complete results (and max_idx) are the same for any processes
+    - stats.complete is False if a budget stopped the enumeration
+    """
+    nodes, adj = _adjacency(G)
+    order, core = _degeneracy(adj)
+    # core numbers never decrease along the ordering, the (min_size - 1)-core is
+    # a suffix of it, in its own degeneracy order
+    order = [i for i in order if core[i] >= min_size - 1]
+    print(f"    {len(order)} of {G.number_of_nodes()} nodes in the {min_size - 1}-core")
+    deadline = time.time() + time_budget if time_budget else None
+
+    # nodes renumbered by position in the ordering
+    index = {u: i for i, u in enumerate(order)}
+    adj = [{index[v] for v in adj[u] if v in index} for u in order]
+    order = [nodes[i] for i in order]
+    n = len(order)
+
+    if processes == 1:
+        cliques = (c for r in range(n) for c in _root_cliques(r, adj))
+        stats = _enumerate(cliques, min_size, deadline, max_cliques)
+    else:
+        counter = Value("q", 0)
+        stats = CliqueStats()
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(adj, counter)) as pool:
+            for s in pool.map(_roots_worker, [(range(i, n, processes), min_size, deadline,
+                                               max_cliques) for i in range(processes)]):
+                stats.merge(s)
+    stats.members = {order[i] for i in stats.members}
+    return stats
@@ -0,0 +1,100 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from concurrent.futures import ProcessPoolExecutor
+
+from graphs.graph_store import CSRGraph, graph_to_csr
+
+"""
+weighted clustering coefficient over CSR adjacency, same definition as
+nx.clustering(G, weight="weight"):
+
+    c_i = 1 / (d_i (d_i - 1)) * sum_{j, k} (w_ij w_jk w_ki) ^ (1/3)
+
+with weights divided by the graph's max weight and self loops ignored.
+With C = (W / max_w) ^ (1/3), the sum is (C^3)_ii, computed chunk by chunk of
+rows as rowsum((C[rows] @ C) * C[rows]) so only the wedges of a chunk are in memory
+"""
+
+_C = None
+
+
+def clustering_matrix(A: sp.spmatrix) -> sp.csr_matrix:
+    """
+    C = cube root of the max normalised weights, without self loops
+    """
+    A = sp.csr_matrix(A, dtype=np.float64)
+    max_weight = A.data.max() if A.nnz else 1.
+    C = A - sp.diags(A.diagonal())
+    C = sp.csr_matrix(C)
+    C.eliminate_zeros()
+    C.data = np.cbrt(C.data / max_weight)
+    C.sort_indices()
+    return C
+
+
+def _chunks(C: sp.csr_matrix, max_wedges: int) -> list:
+    """
+    row ranges of C with about max_wedges wedges (paths j - i - k) each
+    """
+    degree = np.diff(C.indptr)
+    wedges = (C != 0).astype(np.int64) @ degree
+    bounds = np.searchsorted(np.cumsum(wedges), np.arange(max_wedges, wedges.sum(), max_wedges))
+    bounds = np.unique(np.concatenate([[0], bounds + 1, [C.shape[0]]]))
+    bounds = np.minimum(bounds, C.shape[0])
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _closed_wedges(C, start, stop) -> np.ndarray:
+    R = C[start:stop]
+    return np.asarray((R @ C).multiply(R).sum(axis=1)).ravel()
+
+
+def _init_worker(C):
+    global _C
+    _C = C
+
+
+def _closed_wedges_worker(bounds):
+    return _closed_wedges(_C, *bounds)
+
+
+def weighted_clustering(A: sp.spmatrix, processes: int = 1, max_wedges: int = 20_000_000) -> np.ndarray:
+    """
+    weighted clustering coefficient of every node of a symmetric adjacency matrix
+
+    params:
+    - A: symmetric weighted adjacency
+    - processes: number of processes splitting the node ranges, 1 runs in this process
+    - max_wedges: wedges per chunk, bounds the memory of each sparse product
+    """
+    C = clustering_matrix(A)
+    chunks = _chunks(C, max_wedges)
+
+    if processes == 1:
+        closed = [_closed_wedges(C, a, b) for a, b in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(C,)) as pool:
+            closed = list(pool.map(_closed_wedges_worker, chunks))
+    closed = np.concatenate(closed) if closed else np.zeros(0)
+
+    degree = np.diff(C.indptr)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        clustering = np.where(degree > 1, closed / (degree * (degree - 1)), 0.)
+    return clustering
+
+
+def average_weighted_clustering(G, processes: int = 1, max_wedges: int = 20_000_000) -> float:
+    """
+    nx.average_clustering(G, weight="weight", count_zeros=True) on CSR adjacency
+
+    params:
+    - G: networkx graph, CSRGraph or sparse adjacency matrix
+    """
+    if isinstance(G, nx.Graph):
+        G = graph_to_csr(G)
+    A = G.adjacency() if isinstance(G, CSRGraph) else G
+    if A.shape[0] == 0:
+        raise ZeroDivisionError("average clustering of an empty graph")
+    return float(weighted_clustering(A, processes, max_wedges).mean())
@@ -0,0 +1,97 @@
+import os
+import json
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+
+from graphs.graph_store import CSRGraph, graph_to_csr
+from graphs.metrics_commenter_nets import community_to_dict_mapping
+from profiling import timed
+
+"""
+community summary graph: the co-commenter graph collapsed to one node per community.
+
+with P the (num_nodes x k) community indicator matrix and A the upper triangular
+weights (each edge once, self loops on the diagonal), S = P^T A P holds in
+S[c, d] + S[d, c] the weight between communities c and d and in S[c, c] the weight
+inside c, so the whole summary is one sparse product.
+
+summary nodes have "size" (members) and "intra_weight", summary edges "weight";
+the intra weight is also kept as a self loop
+"""
+
+EXPORT_FORMATS = ("gexf", "graphml", "json")
+
+
+def summary_matrix(csr: CSRGraph, labels: np.ndarray, k: int):
+    """
+    params:
+    - labels: node index -> community id, -1 for nodes left out
+
+    returns:
+    - sizes: members per community
+    - S: k x k upper triangular weights between communities, intra weights on the diagonal
+    """
+    member = np.flatnonzero(labels >= 0)
+    P = sp.csr_matrix((np.ones(len(member)), (member, labels[member])),
+                      shape=(csr.number_of_nodes(), k))
+    S = (P.T @ csr.upper_matrix() @ P).tocsr()
+    S = sp.triu(S + S.T - sp.diags(S.diagonal())).tocsr()
+    return np.bincount(labels[member], minlength=k), S
+
+
+@timed()
+def community_summary_graph(G, communities) -> nx.Graph:
+    """
+    weighted community graph of G
+
+    params:
+    - G: networkx graph or CSRGraph
+    - communities: list of node sets, nodes of G without community are left out
+
+    returns:
+    - nx.Graph with nodes 0..k-1 (community index), "size" and "intra_weight" node
+      attributes and "weight" edges, intra weights as self loops
+    """
+    csr = G if isinstance(G, CSRGraph) else graph_to_csr(G)
+    communities = list(communities)
+    # csr node ids are strings
+    comm_map = {str(node): c for node, c in community_to_dict_mapping(G, communities).items()}
+    labels = np.fromiter((comm_map.get(node, -1) for node in csr.nodes.tolist()),
+                         dtype=np.int64, count=csr.number_of_nodes())
+
+    k = len(communities)
+    sizes, S = summary_matrix(csr, labels, k)
+    S = S.tocoo()
+    intra = np.zeros(k)
+    loops = S.row == S.col
+    intra[S.row[loops]] = S.data[loops]
+
+    H = nx.Graph()
+    H.add_nodes_from((c, {"size": int(sizes[c]), "intra_weight": float(intra[c])})
+                     for c in range(k))
+    H.add_weighted_edges_from(zip(S.row.tolist(), S.col.tolist(), S.data.tolist()))
+    return H
+
+
+def export_summary_graph(H: nx.Graph, path: str, formats=EXPORT_FORMATS) -> list:
+    """
+    saves the summary graph as {path}.gexf, {path}.graphml and / or {path}.json
+    (node-link data), returns the written files
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    written = []
+    for fmt in formats:
+        out = f"{path}.{fmt}"
+        if fmt == "gexf":
+            nx.write_gexf(H, out)
+        elif fmt == "graphml":
+            nx.write_graphml(H, out)
+        elif fmt == "json":
+            with open(out, "w") as f:
+                json.dump(nx.node_link_data(H), f, indent=4)
+        else:
+            raise ValueError(f"format must be one of {EXPORT_FORMATS}, got {fmt!r}")
+        written.append(out)
+    print(f"community graph saved as {', '.join(written)}")
+    return written
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import networkx as nx
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.metrics import normalized_mutual_info_score, adjusted_rand_score
+
+from graphs.metrics_commenter_nets import calc_louvain_communities, calc_label_prop_communities
+from graphs.partition_quality import partition_labels, prepare_detection_runs
+from profiling import timed
+
+"""
+consensus of seeded community detection runs (Lancichinetti & Fortunato's
+consensus clustering). Every run is kept as an int32 node -> community label
+vector, the co-assignment of the runs is only counted over existing edges.
+Edges whose endpoints share a community in at least threshold of the runs form
+the agreement graph, weighted by that fraction, and the consensus communities
+are found by louvain on it: a single bridging edge above the threshold does not
+merge two stable communities, as it would with connected components
+"""
+
+_shared = None
+
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+
+
+def _run(task) -> np.ndarray:
+    alg, resolution, seed = task
+    if alg == "louvain":
+        communities = calc_louvain_communities(_shared["G"], resolution, seed=seed)
+    elif alg == "label_propagation":
+        communities = calc_label_prop_communities(_shared["G"], seed=seed)
+    else:
+        raise ValueError(f"unknown community detection algorithm {alg}")
+    return partition_labels(_shared["csr"], communities).astype(np.int32)
+
+
+def consensus_labels(u, v, co_assigned, runs, num_nodes, threshold=0.5,
+                     resolution=1., seed=None) -> np.ndarray:
+    """
+    louvain communities of the agreement graph: edges co-assigned in at least
+    threshold of the runs, weighted by the fraction of runs. Nodes without kept
+    edges are singletons. Numbered by decreasing size
+    """
+    keep = co_assigned >= threshold * runs
+    A = nx.Graph()
+    A.add_nodes_from(range(num_nodes))
+    A.add_weighted_edges_from(zip(u[keep].tolist(), v[keep].tolist(),
+                                  (co_assigned[keep] / runs).tolist()))
+    labels = np.empty(num_nodes, dtype=np.int64)
+    for idx, comm in enumerate(calc_louvain_communities(A, resolution, seed=seed)):
+        labels[list(comm)] = idx
+
+    # ids independent of the node order, largest community first
+    sizes = np.bincount(labels)
+    order = np.argsort(-sizes, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[labels]
+
+
+def labels_to_communities(labels: np.ndarray, nodes) -> list:
+    """
+    label vector -> list of node sets, as returned by nx community detection
+    """
+    nodes = np.asarray(nodes)
+    order = np.argsort(labels, kind="stable")
+    bounds = np.cumsum(np.bincount(labels))[:-1]
+    return [set(c.tolist()) for c in np.split(nodes[order], bounds)]
+
+
+def run_agreement(labels_list: list, consensus: np.ndarray = None) -> pd.DataFrame:
+    """
+    pairwise NMI and ARI between runs, and between every run and the consensus
+    """
+    rows = []
+    pairs = list(combinations(range(len(labels_list)), 2))
+    if consensus is not None:
+        pairs += [(i, "consensus") for i in range(len(labels_list))]
+    for a, b in pairs:
+        la = labels_list[a]
+        lb = consensus if b == "consensus" else labels_list[b]
+        rows.append({
+            "run_a": a,
+            "run_b": b,
+            "nmi": normalized_mutual_info_score(la, lb),
+            "ari": adjusted_rand_score(la, lb),
+        })
+    return pd.DataFrame(rows)
+
+
+@timed()
+def consensus_communities(G, runs=10, resolution=1., seed=0, threshold=0.5,
+                          alg="louvain", processes=None):
+    """
+    stable communities from runs seeded community detection runs
+
+    params:
+    - G: networkx graph or CSRGraph
+    - runs: number of runs, seeded seed, seed + 1, ...
+    - resolution: louvain resolution of the runs and of the agreement graph
+    - threshold: fraction of runs an edge's endpoints must share a community in
+    - alg: "louvain" or "label_propagation"
+    - processes: pool size, None for os.cpu_count(), 1 runs in this process
+
+    returns:
+    - communities: list of node sets, largest first
+    - agreement: pairwise nmi / ari between runs and with the consensus
+    """
+    shared = prepare_detection_runs(G)
+    u, v = shared["u"], shared["v"]
+    tasks = [(alg, resolution, seed + i) for i in range(runs)]
+    print(f"    {runs} {alg} runs for consensus")
+
+    co_assigned = np.zeros(len(u), dtype=np.int32)
+    labels_list = []
+
+    def _add(labels):
+        co_assigned[labels[u] == labels[v]] += 1
+        labels_list.append(labels)
+
+    if processes == 1:
+        _init_worker(shared)
+        for labels in map(_run, tasks):
+            _add(labels)
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(shared,)) as pool:
+            for labels in pool.map(_run, tasks):
+                _add(labels)
+
+    labels = consensus_labels(u, v, co_assigned, runs, shared["num_nodes"], threshold,
+                              resolution, seed)
+    agreement = run_agreement(labels_list, labels)
+    print(f"    {labels.max() + 1} consensus communities, "
+          f"mean pairwise nmi {agreement[agreement.run_b != 'consensus'].nmi.mean():.3f}")
+
+    # node index order of the prepared graph
+    nodes = list(shared["G"].nodes())
+    return labels_to_communities(labels, nodes), agreement
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+from graphs.graph_store import CSRGraph
+from profiling import timed
+
+"""
+graph filtering on edge arrays, same result as filter_graph did edge by edge:
+nodes with degree >= min_degree (the first top_n_nodes of them), edges between
+them without self loops and with weight >= min_edge_weight, isolated nodes dropped.
+
+The node and degree masks do not depend on the weight threshold, so a sweep of
+thresholds computes them once and only re-cuts the sorted weights
+"""
+
+
+def candidate_edges(csr: CSRGraph, min_degree=1, top_n_nodes=0):
+    """
+    edge arrays (u, v, w) left after the node filters and self loop removal
+    """
+    keep = csr.degree() >= min_degree
+    if top_n_nodes:
+        keep[np.flatnonzero(keep)[top_n_nodes:]] = False
+    u, v, w = csr.edge_arrays()
+    mask = (u != v) & keep[u] & keep[v]
+    return u[mask], v[mask], w[mask]
+
+
+def subgraph_from_edges(csr: CSRGraph, u, v, w) -> CSRGraph:
+    """
+    in-memory CSRGraph with only the given edges and their endpoints, in node index order
+    """
+    kept = np.unique(np.concatenate([u, v]))
+    index = np.full(csr.number_of_nodes(), -1, dtype=np.int64)
+    index[kept] = np.arange(len(kept))
+
+    n = len(kept)
+    A = sp.coo_matrix((w, (index[u], index[v])), shape=(n, n)).tocsr()
+    A = (A + A.T).tocsr()
+    A.sort_indices()
+    return CSRGraph(A.indptr.astype(np.int64), A.indices.astype(np.int64), A.data,
+                    np.asarray(csr.nodes)[kept], np.asarray(csr.node_types)[kept],
+                    csr.type_names)
+
+
+def filter_edges(csr: CSRGraph, min_degree=1, top_n_nodes=0, min_edge_weight=1):
+    """
+    edge arrays (u, v, w) of the filtered graph, in the node index of csr
+    """
+    u, v, w = candidate_edges(csr, min_degree, top_n_nodes)
+    mask = w >= min_edge_weight
+    return u[mask], v[mask], w[mask]
+
+
+def filter_csr(csr: CSRGraph, min_degree=1, top_n_nodes=0, min_edge_weight=1) -> CSRGraph:
+    return subgraph_from_edges(csr, *filter_edges(csr, min_degree, top_n_nodes, min_edge_weight))
+
+
+@timed()
+def threshold_sweep(csr: CSRGraph, thresholds, min_degree=1, top_n_nodes=0) -> pd.DataFrame:
+    """
+    size of the filtered graph for every min_edge_weight in thresholds
+
+    returns:
+    - one row per threshold: min_edge_weight, nodes, edges, components, largest_component
+    """
+    u, v, w = candidate_edges(csr, min_degree, top_n_nodes)
+    n = csr.number_of_nodes()
+
+    # a node is kept while its heaviest edge reaches the threshold
+    node_max = np.zeros(n, dtype=np.float64)
+    np.maximum.at(node_max, u, w)
+    np.maximum.at(node_max, v, w)
+    node_max = np.sort(node_max[node_max > 0])
+    edge_w = np.sort(w)
+
+    rows = []
+    for t in sorted(thresholds):
+        mask = w >= t
+        A = sp.coo_matrix((np.ones(mask.sum()), (u[mask], v[mask])), shape=(n, n))
+        _, labels = connected_components(A, directed=False)
+        sizes = np.bincount(labels)
+        rows.append({
+            "min_edge_weight": t,
+            "nodes": len(node_max) - np.searchsorted(node_max, t),
+            "edges": len(edge_w) - np.searchsorted(edge_w, t),
+            # isolated nodes are dropped by the filter
+            "components": int(np.count_nonzero(sizes > 1)),
+            "largest_component": int(sizes.max()) if (sizes > 1).any() else 0,
+        })
+    return pd.DataFrame(rows)
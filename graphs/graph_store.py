@@ -0,0 +1,197 @@
+import os
+import json
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+
+from typing import Tuple
+
+"""
+compact on-disk format for commenter networks
+
+a graph is saved as a directory (by convention ending in .csr) with:
+- indptr.npy, indices.npy, weights.npy: symmetric CSR adjacency, sorted by column,
+  self loops stored once on the diagonal
+- nodes.npy: node index -> node id
+- node_types.npy: node index -> code in meta.json "node_types"
+- meta.json: number of nodes/edges and type names
+
+arrays are loaded with memory mapping, so opening a graph does not read it
+"""
+
+CSR_EXT = ".csr"
+FORMAT_VERSION = 1
+
+
+class CSRGraph:
+    """
+    undirected weighted graph held as CSR arrays, with node ids and types
+    """
+
+    def __init__(self, indptr, indices, weights, nodes, node_types, type_names):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.nodes = nodes
+        self.node_types = node_types
+        self.type_names = list(type_names)
+        self._G = None
+
+    def number_of_nodes(self) -> int:
+        return len(self.nodes)
+
+    def number_of_edges(self) -> int:
+        u, v, _ = self.edge_arrays()
+        return len(u)
+
+    def degree(self) -> np.ndarray:
+        """
+        number of neighbors per node index, a self loop counts twice as in networkx
+        """
+        deg = np.diff(self.indptr).astype(np.int64)
+        rows = self._rows()
+        np.add.at(deg, rows[rows == self.indices], 1)
+        return deg
+
+    def adjacency(self) -> sp.csr_matrix:
+        n = self.number_of_nodes()
+        return sp.csr_matrix((self.weights, self.indices, self.indptr), shape=(n, n))
+
+    def edge_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        returns (u, v, weight) node index arrays with each edge once (u <= v)
+        """
+        rows = self._rows()
+        upper = self.indices >= rows
+        return rows[upper], np.asarray(self.indices[upper]), np.asarray(self.weights[upper])
+
+    def upper_matrix(self) -> sp.csr_matrix:
+        """
+        upper triangular weights, self loops on the diagonal, as built by co_commenter_matrix
+        """
+        u, v, w = self.edge_arrays()
+        n = self.number_of_nodes()
+        return sp.coo_matrix((w, (u, v)), shape=(n, n)).tocsr()
+
+    def to_networkx(self) -> nx.Graph:
+        """
+        builds (once) and returns the equivalent networkx graph
+        """
+        if self._G is None:
+            G = nx.Graph()
+            nodes = self.nodes.tolist()
+            types = np.asarray(self.type_names, dtype=object)[self.node_types]
+            G.add_nodes_from((n, {"type": t}) for n, t in zip(nodes, types.tolist()))
+
+            u, v, w = self.edge_arrays()
+            ids = np.asarray(self.nodes)
+            G.add_weighted_edges_from(zip(ids[u].tolist(), ids[v].tolist(), w.tolist()))
+            self._G = G
+        return self._G
+
+    def _rows(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.nodes), dtype=np.int64), np.diff(self.indptr))
+
+
+def save_csr_arrays(path: str, A: sp.spmatrix, nodes, node_types, type_names):
+    """
+    writes a symmetric adjacency matrix A and its node table to path
+    """
+    A = sp.csr_matrix(A)
+    A.sort_indices()
+    os.makedirs(path, exist_ok=True)
+
+    np.save(os.path.join(path, "indptr.npy"), A.indptr.astype(np.int64))
+    np.save(os.path.join(path, "indices.npy"), A.indices.astype(np.int64))
+    np.save(os.path.join(path, "weights.npy"), A.data)
+    np.save(os.path.join(path, "nodes.npy"), np.asarray(nodes, dtype=str))
+    np.save(os.path.join(path, "node_types.npy"), np.asarray(node_types, dtype=np.int8))
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "num_nodes": A.shape[0],
+        "num_edges": (A.nnz + int(np.count_nonzero(A.diagonal()))) // 2,
+        "node_types": list(type_names),
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=4)
+
+
+def save_graph_csr(G, path: str):
+    """
+    saves a networkx graph or CSRGraph in CSR format
+
+    params:
+    - G: graph, nodes should have a "type" attribute
+    - path: output directory, i.e. ./data/{youtuber}/co_commenter_network.csr
+    """
+    csr = G if isinstance(G, CSRGraph) else graph_to_csr(G)
+    save_csr_arrays(path, csr.adjacency(), csr.nodes, csr.node_types, csr.type_names)
+
+
+def save_matrix_csr(W: sp.spmatrix, nodes: np.ndarray, path: str, node_type: str = "commenter"):
+    """
+    saves an upper triangular weight matrix, as returned by co_commenter_matrix,
+    in CSR format without going through networkx. Nodes without edges are dropped
+
+    params:
+    - W: upper triangular weights, self loops on the diagonal
+    - nodes: matrix index -> node id
+    - path: output directory
+    - node_type: type of every node
+    """
+    W = sp.csr_matrix(W)
+    A = (W + W.T - sp.diags(W.diagonal(), dtype=W.dtype)).tocsr()
+    A.eliminate_zeros()
+
+    keep = np.flatnonzero(np.diff(A.indptr))
+    A = A[keep][:, keep]
+    save_csr_arrays(path, A, np.asarray(nodes)[keep], np.zeros(len(keep)), [node_type])
+
+
+def load_graph_csr(path: str, mmap: bool = True) -> CSRGraph:
+    """
+    loads a graph saved in CSR format
+
+    params:
+    - path: graph directory
+    - mmap: memory map the arrays instead of reading them
+    """
+    mode = "r" if mmap else None
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    def _load(name):
+        return np.load(os.path.join(path, name), mmap_mode=mode)
+
+    return CSRGraph(_load("indptr.npy"), _load("indices.npy"), _load("weights.npy"),
+                    _load("nodes.npy"), _load("node_types.npy"), meta["node_types"])
+
+
+def is_csr_graph(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "meta.json"))
+
+
+def graph_name(path: str) -> str:
+    """
+    graph name without directory and extension, for .csr and .pickle paths
+    """
+    return os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+
+
+def graph_to_csr(G: nx.Graph) -> CSRGraph:
+    """
+    in-memory CSRGraph of a networkx graph, i.e. for legacy pickles
+    """
+    nodes = list(G.nodes())
+    types = [d.get("type", "commenter") for _, d in G.nodes(data=True)]
+    type_names = sorted(set(types)) or ["commenter"]
+
+    A = nx.to_scipy_sparse_array(G, nodelist=nodes, weight="weight", format="csr")
+    A.sort_indices()
+    csr = CSRGraph(A.indptr.astype(np.int64), A.indices.astype(np.int64), A.data,
+                   np.asarray(nodes, dtype=str),
+                   np.asarray([type_names.index(t) for t in types], dtype=np.int8),
+                   type_names)
+    csr._G = G
+    return csr
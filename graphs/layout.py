@@ -0,0 +1,225 @@
+import os
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import eigsh
+from concurrent.futures import ProcessPoolExecutor
+
+from graphs.graph_store import CSRGraph
+from profiling import timed
+
+"""
+community layout on arrays: communities are placed by a force layout of the
+community graph (inter-community edge counts, one sparse matrix), nodes by a
+force layout of their community, in worker processes. Positions are a
+(num_nodes, 2) array in node index order.
+
+force_layout is the Fruchterman-Reingold update of nx.spring_layout on edge
+arrays. Repulsion is exact up to exact_max nodes; above it every node is pushed
+by the mass centres of a grid x grid binning of the nodes (a one level
+Barnes-Hut approximation), so an iteration costs O(n * grid^2), grid^2 <= 1024,
+instead of O(n^2). Layouts start from a spectral embedding of the graph
+"""
+
+EXACT_MAX = 1000
+
+
+def between_community_weights(u, v, labels: np.ndarray, k: int) -> sp.csr_matrix:
+    """
+    symmetric k x k matrix with the number of edges between every two communities
+    """
+    cu, cv = labels[u], labels[v]
+    cut = cu != cv
+    C = sp.coo_matrix((np.ones(cut.sum()), (cu[cut], cv[cut])), shape=(k, k)).tocsr()
+    return (C + C.T).tocsr()
+
+
+def spectral_init(n, u, v, w, rng) -> np.ndarray:
+    """
+    2d spectral embedding (second and third eigenvectors of the normalised adjacency),
+    random positions if it can not be computed
+    """
+    if n < 3 or len(u) == 0:
+        return rng.random((n, 2))
+    A = sp.coo_matrix((w, (u, v)), shape=(n, n)).tocsr()
+    A = A + A.T
+    deg = np.asarray(A.sum(axis=1)).ravel()
+    deg[deg == 0] = 1
+    d = sp.diags(1 / np.sqrt(deg))
+    M = d @ A @ d
+    try:
+        if n <= 500:
+            _, vecs = np.linalg.eigh(M.toarray())
+            pos = vecs[:, -3:-1]
+        else:
+            _, vecs = eigsh(M, k=3, which="LA", tol=1e-3, maxiter=n * 10)
+            pos = vecs[:, :2]
+    except Exception:
+        return rng.random((n, 2))
+    # jitter, nodes with the same neighbours get the same embedding
+    return pos + rng.normal(scale=1e-3 * (np.ptp(pos) or 1), size=pos.shape)
+
+
+def _repulsion(pos: np.ndarray, k: float, exact_max: int, grid: int, chunk: int = 2048) -> np.ndarray:
+    """
+    sum of k^2 / d repulsive forces on every node
+    """
+    n = len(pos)
+    if n <= exact_max:
+        sources, mass = pos, np.ones(n)
+    else:
+        lo, hi = pos.min(axis=0), pos.max(axis=0)
+        cell = np.minimum(((pos - lo) / ((hi - lo) / grid + 1e-12)).astype(np.int64), grid - 1)
+        cell = cell[:, 0] * grid + cell[:, 1]
+        mass = np.bincount(cell, minlength=grid * grid).astype(np.float64)
+        filled = mass > 0
+        sources = np.column_stack([np.bincount(cell, pos[:, 0], minlength=grid * grid),
+                                   np.bincount(cell, pos[:, 1], minlength=grid * grid)])
+        sources = sources[filled] / mass[filled, None]
+        mass = mass[filled]
+
+    force = np.zeros_like(pos)
+    for start in range(0, n, chunk):
+        delta = pos[start:start + chunk, None, :] - sources[None, :, :]
+        d2 = np.maximum((delta ** 2).sum(axis=2), 1e-4)
+        force[start:start + chunk] = ((mass * k * k / d2)[:, :, None] * delta).sum(axis=1)
+    return force
+
+
+def force_layout(n, u, v, w, pos=None, iterations=50, seed=42, exact_max=EXACT_MAX,
+                 grid=None) -> np.ndarray:
+    """
+    Fruchterman-Reingold layout of a graph given by edge arrays (u != v), as nx.spring_layout
+
+    params:
+    - pos: initial positions, spectral_init if None
+    - exact_max: above this many nodes repulsion uses grid mass centres
+    - grid: cells per side of the grid, None for about 16 nodes per cell (at most 32)
+    """
+    rng = np.random.default_rng(seed)
+    if n == 1:
+        return np.zeros((1, 2))
+    if grid is None:
+        grid = int(np.clip(np.sqrt(n / 16), 4, 32))
+    w = np.asarray(w, dtype=np.float64)
+    w = w / w.max() if len(w) else w
+    pos = spectral_init(n, u, v, w, rng) if pos is None else pos.astype(np.float64)
+    pos = (pos - pos.min(axis=0)) / (np.ptp(pos, axis=0) + 1e-12)
+
+    k = np.sqrt(1.0 / n)
+    t = 0.1
+    dt = t / (iterations + 1)
+    for _ in range(iterations):
+        disp = _repulsion(pos, k, exact_max, grid)
+        delta = pos[u] - pos[v]
+        dist = np.maximum(np.sqrt((delta ** 2).sum(axis=1)), 0.01)
+        attraction = (w * dist / k)[:, None] * delta
+        for axis in range(2):
+            disp[:, axis] -= np.bincount(u, attraction[:, axis], minlength=n)
+            disp[:, axis] += np.bincount(v, attraction[:, axis], minlength=n)
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 0.01)
+        pos += disp * (t / length)[:, None]
+        t -= dt
+    return pos
+
+
+def rescale(pos: np.ndarray, scale: float = 1.) -> np.ndarray:
+    """
+    centers pos and scales it into [-scale, scale], as nx.rescale_layout
+    """
+    pos = pos - pos.mean(axis=0)
+    lim = np.abs(pos).max()
+    return pos * (scale / lim) if lim > 0 else pos
+
+
+def _layout_task(args):
+    n, u, v, w, iterations, seed = args
+    return rescale(force_layout(n, u, v, w, iterations=iterations, seed=seed))
+
+
+def _community_edges(u, v, w, labels: np.ndarray):
+    """
+    per community (local node ids, internal edge arrays), like calc_per_community_metrics_parallel
+    """
+    keep = (labels[u] == labels[v]) & (u != v)
+    u, v, w = u[keep], v[keep], w[keep]
+    k = labels.max() + 1
+
+    sizes = np.bincount(labels, minlength=k)
+    members = np.argsort(labels, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    local = np.empty(len(labels), dtype=np.int64)
+    local[members] = np.arange(len(labels)) - starts[labels[members]]
+
+    order = np.argsort(labels[u], kind="stable")
+    u, v, w = u[order], v[order], w[order]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(labels[u], minlength=k))])
+    return sizes, members, starts, [
+        (local[u[bounds[c]:bounds[c + 1]]], local[v[bounds[c]:bounds[c + 1]]],
+         w[bounds[c]:bounds[c + 1]]) for c in range(k)
+    ]
+
+
+def layout_key(csr: CSRGraph, labels: np.ndarray, params: dict) -> str:
+    """
+    hash of the graph arrays, the partition and the layout parameters
+    """
+    h = hashlib.sha256()
+    for a in (csr.indptr, csr.indices, csr.weights, labels):
+        h.update(np.ascontiguousarray(a).tobytes())
+    h.update(repr(sorted(params.items())).encode())
+    return h.hexdigest()
+
+
+@timed(sizes=lambda csr, labels, *a, **k: {"nodes": len(labels),
+                                            "communities": int(labels.max()) + 1})
+def community_positions(csr: CSRGraph, labels: np.ndarray, iterations: int = 50, seed=42,
+                        community_scale: float = 10., processes=None, cache_dir=None) -> np.ndarray:
+    """
+    positions of the nodes grouped by community
+
+    params:
+    - csr: graph
+    - labels: node index -> community id, every node labelled
+    - community_scale: communities are placed in [-community_scale, community_scale],
+      nodes in [-1, 1] around their community
+    - processes: pool size laying out communities, None for os.cpu_count(), 1 in this process
+    - cache_dir: positions are saved as {cache_dir}{key}.npy and reused for the same
+      graph, partition and parameters
+
+    returns:
+    - (num_nodes, 2) array, in node index order
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    params = {"iterations": iterations, "seed": seed, "community_scale": community_scale}
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"{layout_key(csr, labels, params)}.npy")
+        if os.path.exists(cache_path):
+            print(f"    layout loaded from {cache_path}")
+            return np.load(cache_path)
+
+    k = labels.max() + 1
+    u, v, w = csr.edge_arrays()
+    C = sp.triu(between_community_weights(u, v, labels, k), k=1).tocoo()
+    pos_communities = rescale(force_layout(k, C.row, C.col, C.data, iterations=iterations,
+                                           seed=seed), community_scale)
+
+    sizes, members, starts, edges = _community_edges(u, v, w, labels)
+    tasks = [(int(sizes[c]), *edges[c], iterations, seed) for c in range(k)]
+    # largest communities first, so they do not end up last in a worker
+    order = np.argsort(-sizes, kind="stable")
+    if processes == 1:
+        results = [_layout_task(tasks[c]) for c in order]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_layout_task, [tasks[c] for c in order]))
+
+    pos = np.empty((len(labels), 2))
+    for c, pos_nodes in zip(order, results):
+        pos[members[starts[c]:starts[c + 1]]] = pos_communities[c] + pos_nodes
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_path, pos)
+    return pos
@@ -1,19 +1,31 @@
 import pandas as pd
 import networkx as nx
 import numpy as np
+import scipy.sparse as sp
 
 import matplotlib.pyplot as plt
 
 from cdlib import algorithms, evaluation, viz
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
+from graphs.graph_store import CSRGraph, graph_to_csr
+from graphs.clustering import average_weighted_clustering
+from graphs.cliques import stream_clique_stats
+from graphs.partition_quality import partition_quality, partition_labels
+from profiling import timed
 
+
+@timed()
 def compute_graph_metrics(G: nx.Graph, communities: list, resolution: int = 1):
     metrics = { }
 
-    mod = calc_modularity(G, communities, resolution)
-    cov, per = calc_coverage_performance(G, communities)
+    # weighted modularity at the given resolution. Before, resolution went into
+    # the weight argument of nx.community.modularity, which scored unweighted
+    # modularity at resolution 1, so older metric files are not comparable
+    quality = partition_quality(G, communities, resolution)
+    mod, cov, per = quality["modularity"], quality["coverage"], quality["performance"]
 
     metrics["num_nodes"] = G.number_of_nodes()
     metrics["num_edges"] = G.number_of_edges()
@@ -29,6 +41,7 @@ def compute_graph_metrics(G: nx.Graph, communities: list, resolution: int = 1):
     return metrics
 
 
+@timed()
 def calc_per_community_metrics(G: nx.Graph, communities: list):
 
     metrics_list = []
@@ -56,7 +69,100 @@ def calc_per_community_metrics(G: nx.Graph, communities: list):
     return metrics_list
 
 
-def compute_clique_metrics(G: nx.Graph):
+def _community_clustering(args):
+    """
+    process pool task: average weighted clustering of one community, from its internal edges
+    """
+    n_nodes, u, v, w = args
+    A = sp.coo_matrix((w, (u, v)), shape=(n_nodes, n_nodes)).tocsr()
+    A = A + A.T - sp.diags(A.diagonal())
+    return calc_avg_clustering_coef(A)
+
+
+@timed()
+def calc_per_community_metrics_parallel(G, communities: list, processes=None):
+    """
+    same metrics as calc_per_community_metrics. Sizes, internal/boundary edges, density,
+    conductance and degrees come from one pass over the edge arrays with a
+    node -> community label vector, clustering is computed per community in a process pool
+
+    params:
+    - G: networkx graph or CSRGraph (load_graph(path, as_arrays=True))
+    - communities: list of node sets
+    - processes: pool size, None for os.cpu_count(), 1 computes clustering in this process
+    """
+    csr = G if isinstance(G, CSRGraph) else graph_to_csr(G)
+    # -1 for nodes without community
+    labels = partition_labels(csr, communities, allow_missing=True)
+    k = len(communities)
+
+    u, v, w = csr.edge_arrays()
+    cu, cv = labels[u], labels[v]
+
+    sizes = np.bincount(labels[labels >= 0], minlength=k)
+    internal = (cu == cv) & (cu >= 0)
+    edges = np.bincount(cu[internal], minlength=k)
+    # edges with one endpoint in the community, counted for each side
+    cut = cu != cv
+    boundary = np.bincount(cu[cut & (cu >= 0)], minlength=k) + \
+        np.bincount(cv[cut & (cv >= 0)], minlength=k)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        density = np.where(sizes > 1, 2 * edges / (sizes * (sizes - 1)), 0.)
+        avg_degree = 2 * edges / sizes
+        conductance = np.where(2 * edges + boundary > 0,
+                               boundary / (2 * edges + boundary), 0.)
+    # nx.degree_centrality is 1 for single node graphs, density otherwise
+    avg_degree_centrality = np.where(sizes > 1, density, 1.)
+
+    # internal edges grouped by community, with community local node ids
+    order = np.argsort(cu[internal], kind="stable")
+    iu, iv, iw = u[internal][order], v[internal][order], w[internal][order]
+    bounds = np.concatenate([[0], np.cumsum(edges)])
+    local = np.zeros(csr.number_of_nodes(), dtype=np.int64)
+    members = np.flatnonzero(labels >= 0)
+    members = members[np.argsort(labels[members], kind="stable")]
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    local[members] = np.arange(len(members)) - starts[labels[members]]
+
+    tasks = (
+        (int(sizes[idx]), local[iu[bounds[idx]:bounds[idx + 1]]],
+         local[iv[bounds[idx]:bounds[idx + 1]]], iw[bounds[idx]:bounds[idx + 1]])
+        for idx in range(k)
+    )
+    if processes == 1:
+        clustering = list(map(_community_clustering, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            clustering = list(pool.map(_community_clustering, tasks, chunksize=8))
+
+    metrics_list = []
+    for idx in range(k):
+        metrics_list.append({
+            "id": idx,
+            "nodes": int(sizes[idx]),
+            "edges": int(edges[idx]),
+            "density": float(density[idx]),
+            "avg_degree": float(avg_degree[idx]),
+            "avg_clustering_coef": clustering[idx],
+            "conductance": float(conductance[idx]),
+            "avg_degree_centrality": float(avg_degree_centrality[idx]),
+        })
+
+    return metrics_list
+
+
+@timed()
+def compute_clique_metrics(G: nx.Graph, min_size=5, time_budget=None, max_cliques=None, processes=1):
+    """
+    maximal clique metrics, counting only cliques that have at least min_size members.
+    Cliques are streamed (graphs.cliques), never held in memory
+
+    params:
+    - time_budget: seconds of enumeration before stopping
+    - max_cliques: cliques counted before stopping
+    - processes: processes splitting the enumeration by root node
+    """
     metrics = {
         "num_max_cliques": 0,
         "max_clique_size": 0,
@@ -67,19 +173,19 @@ def compute_clique_metrics(G: nx.Graph):
         "max_clique_idx": -1,
     }
 
-    cliques = nx.find_cliques(G)
-    # count only cliques that have at least 5 members
-    cliques = [c for c in cliques if len(c) >= 5]
+    stats = stream_clique_stats(G, min_size, time_budget, max_cliques, processes)
+    if not stats.complete:
+        print(f"    clique enumeration stopped by budget after {stats.count} cliques")
+    if stats.count == 0:
+        return metrics
 
-    clique_sizes = [len(c) for c in cliques]
-    metrics["num_max_cliques"] = np.sum([1 for c in cliques])
-    metrics["max_clique_size"] = max(clique_sizes)
-    metrics["avg_clique_size"] = np.mean(clique_sizes)
-    metrics["median_clique_size"] = np.median(clique_sizes)
-    metrics["max_clique_idx"] = clique_sizes.index(max(clique_sizes))
+    metrics["num_max_cliques"] = stats.count
+    metrics["max_clique_size"] = stats.max_size
+    metrics["avg_clique_size"] = stats.mean()
+    metrics["median_clique_size"] = stats.median()
+    metrics["max_clique_idx"] = stats.max_idx
 
-    clique_members = set([node for c in cliques for node in c])
-    subG = G.subgraph(list(clique_members))
+    subG = G.subgraph(list(stats.members))
     del G
     metrics["avg_degree_clique"] = calc_avg_degree(subG)
     metrics["avg_clustering_coef_clique"] = calc_avg_clustering_coef(
@@ -87,16 +193,19 @@ def compute_clique_metrics(G: nx.Graph):
     return metrics
 
 
-def calc_avg_clustering_coef(G: nx.Graph):
+@timed()
+def calc_avg_clustering_coef(G, processes=1):
     """
-    Calculates clustering coeficcient of a given graph 
-    and saves values to a .csv
+    Calculates weighted average clustering coeficcient of a given graph,
+    same as nx.average_clustering(G, weight="weight", count_zeros=True)
+    computed on CSR adjacency (graphs.clustering)
 
     Params:
-    - G: graph 
+    - G: graph, CSRGraph or sparse adjacency matrix
+    - processes: processes splitting the node ranges
     """
 
-    avg_clustering_coef = nx.average_clustering(G, weight="weight", count_zeros=True)
+    avg_clustering_coef = average_weighted_clustering(G, processes=processes)
     return avg_clustering_coef
 
 
@@ -111,9 +220,12 @@ def calc_modularity(G: nx.Graph, communities: list, resolution=1):
     It measures how well a network can be divided into distinct communities  where:
     - Nodes within the same community have many connections to each other
     - Nodes in different communities have fewer connections between them
+
+    computed from edge arrays (graphs.partition_quality), same as
+    nx.community.modularity(G, communities, weight="weight", resolution=resolution)
     """
 
-    modularity = nx.community.modularity(G, communities, resolution)
+    modularity = partition_quality(G, communities, resolution)["modularity"]
     return modularity
 
 
@@ -123,9 +235,12 @@ def calc_coverage_performance(G: nx.Graph, communities: list):
     in the graph.
     - performance : number of intra-community edges plus inter-community non-edges divided by the 
     total number of potential edges
+
+    computed from edge arrays (graphs.partition_quality), same as nx.community.partition_quality
     """
 
-    coverage, performance = nx.community.partition_quality(G, communities)
+    quality = partition_quality(G, communities)
+    coverage, performance = quality["coverage"], quality["performance"]
     return coverage, performance
 
 
@@ -150,6 +265,7 @@ def calc_conductance(G:nx.Graph , subG: nx.Graph):
 
     return ratio 
 
+@timed()
 def calc_k_cliques_communities(G: nx.Graph, k=5):
     print(f"calculating communities with k_cliques_method, k={k} ...")
 
@@ -159,30 +275,35 @@ def calc_k_cliques_communities(G: nx.Graph, k=5):
     return communities
 
 
-def calc_label_prop_communities(G: nx.Graph):
+@timed()
+def calc_label_prop_communities(G: nx.Graph, seed=None):
     """
     The algorithm is probabilistic and the found communities may vary on different executions.
-    - define seed param
+    - seed: random seed, fixes the communities found
     """
 
     communities = nx.community.asyn_lpa_communities(G,
-                                                    weight="weight")
+                                                    weight="weight",
+                                                    seed=seed)
     return list(communities)
 
 
-def calc_louvain_communities(G: nx.Graph, resolution=1):
+@timed()
+def calc_louvain_communities(G: nx.Graph, resolution=1, seed=None):
     """
     If resolution is less than 1, the algorithm favors larger communities. 
     Greater than 1 favors smaller communities
+    - seed: random seed, fixes the communities found
     """
     communities = nx.community.louvain_communities(G,
                                                    weight='weight',
                                                    resolution=resolution,
-                                                   # seed=42,
+                                                   seed=seed,
                                                    )
     return communities
 
 
+@timed()
 def calc_greedy_modularity_communities(G: nx.Graph, resolution=1):
     communities = nx.community.greedy_modularity_communities(G,
                                                              weight="weight",
@@ -208,6 +329,7 @@ def community_to_dict_mapping(G: nx.Graph, communities):
     return comm_map
 
 
+@timed()
 def cdlib_calc_communities(G: nx.Graph, resolution=1., alg="louvain"):
     communities = []
     if alg == "louvain":
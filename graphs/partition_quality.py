@@ -0,0 +1,115 @@
+import numpy as np
+import networkx as nx
+
+from graphs.graph_store import CSRGraph, graph_to_csr
+from profiling import timed
+
+"""
+partition quality from edge arrays (u <= v, each edge once) and a node -> community
+label vector, same values as nx.community.modularity and
+nx.community.partition_quality.
+
+performance counts inter-community non-edges as
+    (n^2 - sum_c size_c^2) / 2 - inter-community edges
+so non-edges are never enumerated
+"""
+
+
+def node_strength(u: np.ndarray, v: np.ndarray, w: np.ndarray, num_nodes: int) -> np.ndarray:
+    """
+    weighted degree, a self loop counts twice as in G.degree(weight="weight")
+    """
+    w = np.asarray(w, dtype=np.float64)
+    return np.bincount(u, w, minlength=num_nodes) + np.bincount(v, w, minlength=num_nodes)
+
+
+def partition_labels(csr: CSRGraph, communities, allow_missing: bool = False) -> np.ndarray:
+    """
+    node index -> community id of a partition given as node sets
+
+    params:
+    - allow_missing: nodes without community get -1, otherwise they raise NetworkXError
+    """
+    index = {node: i for i, node in enumerate(csr.nodes.tolist())}
+    labels = np.full(csr.number_of_nodes(), -1, dtype=np.int64)
+    for idx, comm in enumerate(communities):
+        labels[[index[str(node)] for node in comm]] = idx
+    if not allow_missing and (labels < 0).any():
+        raise nx.NetworkXError("communities is not a partition of the graph nodes")
+    return labels
+
+
+def prepare_detection_runs(G) -> dict:
+    """
+    graph and the totals every partition is scored against, prepared once and
+    shared with the community detection runs of resolution_sweep and consensus
+
+    returns:
+    - {"G": networkx graph, "csr", "u", "v", "w": edge arrays, "strength", "num_nodes"}
+    """
+    csr = G if isinstance(G, CSRGraph) else graph_to_csr(G)
+    u, v, w = csr.edge_arrays()
+    n = csr.number_of_nodes()
+    w = np.asarray(w, dtype=np.float64)
+    return {
+        "G": csr.to_networkx(),
+        "csr": csr,
+        "u": u,
+        "v": v,
+        "w": w,
+        "strength": node_strength(u, v, w, n),
+        "num_nodes": n,
+    }
+
+
+def modularity(u, v, w, labels: np.ndarray, resolution: float = 1., strength=None) -> float:
+    """
+    params:
+    - u, v, w: edge arrays
+    - labels: node index -> community id
+    - strength: node_strength, computed if None (pass it when scoring many partitions)
+    """
+    w = np.asarray(w, dtype=np.float64)
+    if strength is None:
+        strength = node_strength(u, v, w, len(labels))
+    k = labels.max() + 1
+    internal = labels[u] == labels[v]
+
+    m = w.sum()
+    intra_weight = w[internal].sum()
+    comm_strength = np.bincount(labels, strength, minlength=k)
+    return float(intra_weight / m - resolution * (comm_strength ** 2).sum() / (2 * m) ** 2)
+
+
+def coverage_performance(u, v, labels: np.ndarray):
+    """
+    coverage: fraction of edges inside communities
+    performance: intra-community edges plus inter-community non-edges over all node pairs
+    """
+    n = len(labels)
+    intra_edges = int(np.count_nonzero(labels[u] == labels[v]))
+    sizes = np.bincount(labels).astype(np.int64)
+    inter_non_edges = (n * n - int((sizes ** 2).sum())) // 2 - (len(u) - intra_edges)
+    return intra_edges / len(u), (intra_edges + inter_non_edges) / (n * (n - 1) // 2)
+
+
+@timed()
+def partition_quality(G, communities, resolution: float = 1.) -> dict:
+    """
+    modularity, coverage and performance of a partition in one pass
+
+    params:
+    - G: networkx graph or CSRGraph
+    - communities: list of node sets, or a label vector in node index order
+    """
+    csr = G if isinstance(G, CSRGraph) else graph_to_csr(G)
+    labels = communities if isinstance(communities, np.ndarray) else \
+        partition_labels(csr, communities)
+    u, v, w = csr.edge_arrays()
+
+    coverage, performance = coverage_performance(u, v, labels)
+    return {
+        "modularity": modularity(u, v, w, labels, resolution),
+        "coverage": coverage,
+        "performance": performance,
+    }
@@ -0,0 +1,217 @@
+import os
+import time
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from constants import CRAWLER_PATH, YTBRS_LIST, CACHE_MAX_BYTES
+from profiling import start_trace, stop_trace, stage as trace_stage
+from graphs.build_commenter_networks import build_co_commenter_net_sparse
+from graphs.graph_filter import filter_csr
+from graphs.graph_store import load_graph_csr, save_graph_csr
+from graphs.stage_cache import StageCache
+from graphs.metrics_commenter_nets import (calc_louvain_communities, compute_graph_metrics,
+                                           calc_per_community_metrics_parallel,
+                                           compute_clique_metrics)
+
+"""
+build -> filter -> communities -> metrics for many youtubers, one worker process
+per youtuber with its paths passed explicitly (nothing read from CURR_PATH).
+
+a stage is skipped when the content of its inputs and its parameters match a
+cached run: its outputs are restored from the youtuber's stage cache
+({path}cache/, graphs.stage_cache), the same cache main.py uses
+"""
+
+CO_COMMENTER_NET = "co_commenter_network.csr"
+FILTERED_NET = "co_commenter_network_filtered_noselfloop.csr"
+COMMUNITIES_FILE = "metrics/communities.csv"
+NETWORK_METRICS_FILE = "metrics/commenter_network_metrics.csv"
+COMMUNITY_METRICS_FILE = "metrics/commenter_network_community_metrics.csv"
+CLIQUE_METRICS_FILE = "metrics/commenter_network_clique_metrics.csv"
+
+# merged tables, as written by merge_channel_dfs
+MERGED_FILES = {
+    "network": f"{CRAWLER_PATH}youtubers_networks_metrics.csv",
+    "clique": f"{CRAWLER_PATH}youtubers_networs_clique_metrics.csv",
+    "community": f"{CRAWLER_PATH}youtubers_networks_community_metrics.csv",
+}
+
+
+def youtuber_path(youtuber: str) -> str:
+    return f"{CRAWLER_PATH}{youtuber}/"
+
+
+def stage_key(cache: StageCache, path: str, stage: str, inputs: list, params: dict) -> str:
+    """
+    cache key of a pipeline stage, from the content of its inputs and its params
+    """
+    missing = [i for i in inputs if not os.path.exists(f"{path}{i}")]
+    if missing:
+        raise FileNotFoundError(f"{stage} input missing: {', '.join(f'{path}{i}' for i in missing)}")
+    # prefixed, main.py caches the same stages with other outputs
+    return cache.key(f"pipeline.{stage}", [f"{path}{i}" for i in inputs], params)
+
+
+def build_stage(path: str):
+    build_co_commenter_net_sparse(f"{path}comments.csv", as_graph=False, path=path)
+
+
+def filter_stage(path: str, min_edge_weight: int):
+    csr = load_graph_csr(f"{path}{CO_COMMENTER_NET}")
+    save_graph_csr(filter_csr(csr, min_edge_weight=min_edge_weight), f"{path}{FILTERED_NET}")
+
+
+def communities_stage(path: str, G, resolution: float, seed) -> list:
+    communities = calc_louvain_communities(G, resolution, seed=seed)
+    rows = [{"commenter": node, "community": i}
+            for i, c in enumerate(communities) for node in c]
+    os.makedirs(f"{path}metrics/", exist_ok=True)
+    pd.DataFrame(rows, columns=["commenter", "community"]).to_csv(
+        f"{path}{COMMUNITIES_FILE}", index=False)
+    return communities
+
+
+def load_communities(csv_path: str) -> list:
+    """
+    communities saved as (commenter, community) rows, as a list of node sets
+    """
+    df = pd.read_csv(csv_path, dtype={"commenter": str})
+    return [set(c) for _, c in df.groupby("community", sort=True)["commenter"]]
+
+
+def metrics_stage(path: str, G, communities: list, resolution: float, processes: int = 1) -> dict:
+    """
+    network, community and clique metrics of a youtuber, saved and returned as dataframes
+    - processes: pool size of the per community clustering and the clique enumeration
+    """
+    tables = {
+        "network": pd.DataFrame([compute_graph_metrics(G, communities, resolution)]),
+        "community": pd.DataFrame(
+            calc_per_community_metrics_parallel(G, communities, processes=processes)),
+        "clique": pd.DataFrame([compute_clique_metrics(G, processes=processes)]),
+    }
+    os.makedirs(f"{path}metrics/", exist_ok=True)
+    tables["network"].to_csv(f"{path}{NETWORK_METRICS_FILE}")
+    tables["community"].to_csv(f"{path}{COMMUNITY_METRICS_FILE}")
+    tables["clique"].to_csv(f"{path}{CLIQUE_METRICS_FILE}")
+    return tables
+
+
+def run_youtuber(youtuber: str, min_edge_weight: int = 10, resolution: float = 0.8,
+                 seed=42, force: bool = False, trace: bool = True, processes: int = 1) -> dict:
+    """
+    runs the stale stages of a youtuber's pipeline
+    - trace: records a timing trace of the run in {path}traces/ (profiling)
+    - processes: worker processes of the metrics stage
+
+    returns:
+    - {"network", "community", "clique"} metric dataframes with a youtuber column
+    """
+    path = youtuber_path(youtuber)
+    print(f"[{youtuber}] pipeline at {path}")
+    # before the trace and the stage cache create directories under path
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"no data for {youtuber} at {path}")
+    if trace:
+        start_trace(f"{youtuber}-{time.strftime('%Y%m%d-%H%M%S')}")
+    try:
+        return _run_stages(youtuber, path, min_edge_weight, resolution, seed, force, processes)
+    finally:
+        if trace:
+            stop_trace(f"{path}traces/")
+
+
+def _run_stages(youtuber, path, min_edge_weight, resolution, seed, force, processes) -> dict:
+
+    stages = [
+        ("build", ["comments.csv"], [CO_COMMENTER_NET], {}),
+        ("filter", [CO_COMMENTER_NET], [FILTERED_NET], {"min_edge_weight": min_edge_weight}),
+        ("communities", [FILTERED_NET], [COMMUNITIES_FILE],
+         {"resolution": resolution, "seed": seed}),
+        ("metrics", [FILTERED_NET, COMMUNITIES_FILE],
+         [NETWORK_METRICS_FILE, COMMUNITY_METRICS_FILE, CLIQUE_METRICS_FILE],
+         {"resolution": resolution}),
+    ]
+
+    cache = StageCache(f"{path}cache/", CACHE_MAX_BYTES)
+    G = None
+    communities = None
+    tables = None
+    for stage, inputs, outputs, params in stages:
+        key = stage_key(cache, path, stage, inputs, params)
+        outputs = {os.path.basename(o): f"{path}{o}" for o in outputs}
+        if not force and cache.get(key, outputs):
+            print(f"[{youtuber}] {stage} up to date")
+            continue
+        print(f"[{youtuber}] {stage} ...")
+        if stage in ("communities", "metrics") and G is None:
+            G = load_graph_csr(f"{path}{FILTERED_NET}").to_networkx()
+
+        with trace_stage(f"pipeline.{stage}"):
+            if stage == "build":
+                build_stage(path)
+            elif stage == "filter":
+                filter_stage(path, min_edge_weight)
+            elif stage == "communities":
+                communities = communities_stage(path, G, resolution, seed)
+            else:
+                if communities is None:
+                    communities = load_communities(f"{path}{COMMUNITIES_FILE}")
+                tables = metrics_stage(path, G, communities, resolution, processes)
+        cache.put(key, f"pipeline.{stage}", outputs)
+
+    if tables is None:
+        tables = {
+            "network": pd.read_csv(f"{path}{NETWORK_METRICS_FILE}", index_col=0),
+            "community": pd.read_csv(f"{path}{COMMUNITY_METRICS_FILE}", index_col=0),
+            "clique": pd.read_csv(f"{path}{CLIQUE_METRICS_FILE}", index_col=0),
+        }
+    for df in tables.values():
+        df["youtuber"] = youtuber
+    return tables
+
+
+def run_pipeline(youtubers: list = YTBRS_LIST, processes=None, min_edge_weight: int = 10,
+                 resolution: float = 0.8, seed=42, force: bool = False) -> dict:
+    """
+    runs every youtuber's pipeline in a process pool and writes the merged
+    youtubers_networks_* tables
+
+    params:
+    - youtubers: youtuber names, data read from ./data/{youtuber}/
+    - processes: pool size, None for os.cpu_count(), 1 runs in this process.
+      The cpus left over by the pool go to each youtuber's metrics stage
+    - force: run every stage, even if up to date
+
+    returns:
+    - merged {"network", "community", "clique"} dataframes, youtubers that failed are left out
+    """
+    workers = min(processes or os.cpu_count(), max(len(youtubers), 1))
+    kwargs = dict(min_edge_weight=min_edge_weight, resolution=resolution, seed=seed, force=force,
+                  processes=max(1, os.cpu_count() // workers))
+    results = {}
+    if processes == 1:
+        for y in youtubers:
+            try:
+                results[y] = run_youtuber(y, **kwargs)
+            except Exception as e:
+                print(f"[{y}] pipeline failed: {e!r}")
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(run_youtuber, y, **kwargs): y for y in youtubers}
+            for future in as_completed(futures):
+                y = futures[future]
+                try:
+                    results[y] = future.result()
+                except Exception as e:
+                    print(f"[{y}] pipeline failed: {e!r}")
+
+    # youtubers in the given order
+    done = [y for y in youtubers if y in results]
+    merged = {}
+    for name, out in MERGED_FILES.items():
+        merged[name] = pd.concat([results[y][name] for y in done], ignore_index=True) \
+            if done else pd.DataFrame()
+        merged[name].to_csv(out)
+    print(f"merged metrics of {len(done)} of {len(youtubers)} youtubers")
+    return merged
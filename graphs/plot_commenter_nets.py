@@ -1,29 +1,64 @@
 import pickle
 import matplotlib.pyplot as plt
 import networkx as nx
-import time
+import numpy as np
 import os
 
 from constants import CURR_PATH, CURR_YTBR
+from graphs.graph_store import CSRGraph, is_csr_graph, load_graph_csr, graph_to_csr
+from graphs.graph_filter import filter_csr, filter_edges
+from graphs.layout import force_layout, rescale
+from graphs.render import draw_edges, draw_nodes, positions_array, EDGE_WIDTH_SCALE, EDGE_ALPHA
+from profiling import timed, stage
 
 
+def spring_positions(G, render: str = "networkx"):
+    """
+    nx.spring_layout for render "networkx", otherwise the same Fruchterman-Reingold
+    layout on edge arrays (graphs.layout)
+
+    returns:
+    - (pos, u, v, w): (num_nodes, 2) positions and edge arrays, in G.nodes() order
+    """
+    csr = graph_to_csr(G)
+    u, v, w = csr.edge_arrays()
+    if render == "networkx":
+        pos = positions_array(G, nx.spring_layout(G))
+    else:
+        loops = u == v
+        pos = rescale(force_layout(G.number_of_nodes(), u[~loops], v[~loops], w[~loops]))
+    return pos, u, v, w
+
+
+@timed()
 def plot_graph(G: nx.Graph, name: str, save: bool = True,
-               edge_weight: float = 0.001, title: str = "Commenter Network",
-               alpha=0.6):
+               edge_weight: float = EDGE_WIDTH_SCALE, title: str = "Commenter Network",
+               alpha=0.6, render: str = "networkx", max_edges=None):
+    """
+    params:
+    - render: "networkx" (nx.draw_networkx_*), "lines" or "density" (graphs.render)
+    - max_edges: edges drawn at most, sampled by weight, render "lines" / "density" only
+    """
     print('plotting ...')
     plt.figure(figsize=(20, 20))
 
     colors = get_node_type_colors(G)
 
-    pos = nx.spring_layout(G)
+    pos, u, v, w = spring_positions(G, render)
 
-    nx.draw_networkx_nodes(G, pos, node_size=20,
-                           node_color=colors, alpha=alpha)
-    print('Nodes desenhados ...')
+    if render == "networkx":
+        pos = dict(zip(G.nodes(), pos))
+        nx.draw_networkx_nodes(G, pos, node_size=20,
+                               node_color=colors, alpha=alpha)
+        print('Nodes desenhados ...')
 
-    edges = G.edges(data=True)
-    nx.draw_networkx_edges(G, pos,
-                           width=[edge_weight * edge[2]['weight'] for edge in edges])
+        edges = G.edges(data=True)
+        nx.draw_networkx_edges(G, pos,
+                               width=[edge_weight * edge[2]['weight'] for edge in edges])
+    else:
+        draw_nodes(plt.gca(), pos, colors, node_size=20, alpha=alpha)
+        print('Nodes desenhados ...')
+        draw_edges(pos, u, v, w, mode=render, max_edges=max_edges, width_scale=edge_weight)
     print('edges desenhados ...')
 
     plt.title(title)
@@ -35,10 +70,16 @@ def plot_graph(G: nx.Graph, name: str, save: bool = True,
         plt.show()
 
 
+@timed()
 def plot_community_graph(G, communities, figsize=(20, 16),
-                         title="Network Communities", res=1, path=""):
+                         title="Network Communities", res=1, path="",
+                         render: str = "networkx", max_edges=None):
     """
     plot the graph with communities in different colors.
+
+    params:
+    - render: "networkx" (nx.draw_networkx_*), "lines" or "density" (graphs.render)
+    - max_edges: edges drawn at most, sampled by weight, render "lines" / "density" only
     """
     print(f"plotting...")
     plt.figure(figsize=figsize)
@@ -58,22 +99,28 @@ def plot_community_graph(G, communities, figsize=(20, 16),
     node_colors = [color_map[node]
                    for node in G.nodes() if color_map.get(node) != None]
 
-    start = time.time()  # Start timer
-    pos = nx.spring_layout(G)
-    end = time.time()
+    with stage("plot_community_graph.layout", nodes=G.number_of_nodes()) as rec:
+        pos, u, v, w = spring_positions(G, render)
 
-    print(f"    layout defined... {end - start:.3f} seconds")
+    print(f"    layout defined... {rec.get('wall_s', 0):.3f} seconds")
 
-    nx.draw_networkx_nodes(G, pos, node_color=node_colors,
-                           node_size=20, alpha=0.6)
-    print(f"    nodes drawn ... {end - start:.3f} seconds")
-
-    start = time.time()
-    edges = G.edges(data=True)
-    nx.draw_networkx_edges(G, pos, alpha=0.6,
-                           width=[0.001 * edge[2]['weight'] for edge in edges])
-    end = time.time()
-    print(f"    edges drawn ... {end - start:.3f} seconds")
+    with stage("plot_community_graph.nodes", nodes=G.number_of_nodes()) as rec:
+        if render == "networkx":
+            pos = dict(zip(G.nodes(), pos))
+            nx.draw_networkx_nodes(G, pos, node_color=node_colors,
+                                   node_size=20, alpha=0.6)
+        else:
+            draw_nodes(plt.gca(), pos, node_colors, node_size=20, alpha=0.6)
+    print(f"    nodes drawn ... {rec.get('wall_s', 0):.3f} seconds")
+
+    with stage("plot_community_graph.edges", edges=G.number_of_edges()) as rec:
+        if render == "networkx":
+            edges = G.edges(data=True)
+            nx.draw_networkx_edges(G, pos, alpha=EDGE_ALPHA,
+                                   width=[EDGE_WIDTH_SCALE * edge[2]['weight'] for edge in edges])
+        else:
+            draw_edges(pos, u, v, w, mode=render, max_edges=max_edges)
+    print(f"    edges drawn ... {rec.get('wall_s', 0):.3f} seconds")
 
     plt.title(title)
     os.makedirs(f"{CURR_PATH}imgs/", exist_ok=True)
@@ -128,33 +175,30 @@ def generate_distinct_colors(n):
     return colors
 
 
-def filter_graph(G: nx.Graph, min_degree=1, top_n_nodes=0, min_edge_weight=1) -> nx.Graph:
+@timed()
+def filter_graph(G, min_degree=1, top_n_nodes=0, min_edge_weight=1):
     """
     Filter a large graph for visualization.
     Params:
-    - G: networkx Graph object
+    - G: networkx Graph object or CSRGraph
     - min_degree: minimum degree for a node to be included
-    - top_n_nodes: number of top nodes by degree to include
+    - top_n_nodes: number of nodes, in node order, passing min_degree to include
     - min_edge_weight: minimum weight for an edge to be included
     Return:
-    - filtered_G: filtered networkx Graph object
+    - filtered_G: filtered graph, of the same kind as G
     """
     print(f"filtering graph ...")
-    if top_n_nodes == 0:
-        top_n_nodes = G.number_of_nodes()
-    # filter nodes by degree
-    node_degrees = dict(G.degree())
-    high_degree_nodes = [node for node,
-                         degree in node_degrees.items() if degree >= min_degree]
-
-    subgraph = G.subgraph(high_degree_nodes[:top_n_nodes])
-    # filter edges by weight
-    filtered_G = nx.Graph()
-    for u, v, data in subgraph.edges(data=True):
-        if u != v and data['weight'] >= min_edge_weight:  # u!=v removes self loops
-            # print(f"{G.nodes[u].get('type')},{G.nodes[v].get('type')}")
-            filtered_G.add_edge(u, v, **data)
-    filtered_G.remove_nodes_from(list(nx.isolates(filtered_G)))
+    # self loops removed, isolated nodes dropped (graphs.graph_filter)
+    if isinstance(G, CSRGraph):
+        filtered_G = filter_csr(G, min_degree, top_n_nodes, min_edge_weight)
+    else:
+        u, v, w = filter_edges(graph_to_csr(G), min_degree, top_n_nodes, min_edge_weight)
+        nodes = list(G.nodes())
+        filtered_G = nx.Graph()
+        filtered_G.add_nodes_from((nodes[i], G.nodes[nodes[i]])
+                                  for i in np.unique(np.concatenate([u, v])))
+        filtered_G.add_weighted_edges_from(
+            (nodes[a], nodes[b], c) for a, b, c in zip(u.tolist(), v.tolist(), w.tolist()))
     print(
         f"    original graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
     print(
@@ -162,18 +206,27 @@ def filter_graph(G: nx.Graph, min_degree=1, top_n_nodes=0, min_edge_weight=1) ->
     return filtered_G
 
 
-def load_graph(path: str) -> nx.Graph:
+@timed(sizes=lambda path, *a, **k: {})
+def load_graph(path: str, as_arrays: bool = False):
     """
-    Loads graph saved in pickle format
+    Loads graph saved in CSR format (graph_store) or as a legacy pickle
 
     Params:
     - path: Path where graph was saved
+    - as_arrays: return the CSRGraph instead of a networkx graph
 
     Return:
     - G: graph 
     """
     print(f"loading graph ...")
-    G = pickle.load(open(path, 'rb'))
+    if is_csr_graph(path):
+        G = load_graph_csr(path)
+        if not as_arrays:
+            G = G.to_networkx()
+    else:
+        G = pickle.load(open(path, 'rb'))
+        if as_arrays:
+            G = graph_to_csr(G)
     print(f"    graph nodes: {G.number_of_nodes()}")
     print(f"    graph edges: {G.number_of_edges()}")
     return G
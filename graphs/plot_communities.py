@@ -1,4 +1,3 @@
-from time import time
 import numpy as np
 import matplotlib.pyplot as plt
 import networkx as nx
@@ -7,10 +6,15 @@ from matplotlib.lines import Line2D
 
 from constants import CURR_PATH
 from graphs.metrics_commenter_nets import community_to_dict_mapping
+from graphs.graph_store import graph_to_csr
+from graphs.layout import community_positions, force_layout, rescale
+from graphs.render import draw_edges, draw_nodes, EDGE_WIDTH_SCALE, EDGE_ALPHA
+from graphs.community_graph import community_summary_graph
+from profiling import timed, stage
 
 
 
-def community_layout(g, partition):
+def community_layout(g, partition, cache_dir=None, processes=None):
     """
     Compute the layout for a modular graph.
 
@@ -23,6 +27,10 @@ def community_layout(g, partition):
     partition -- dict mapping int node -> int community
         graph partitions
 
+    cache_dir -- directory where positions are cached per (graph, partition)
+
+    processes -- processes laying out communities (graphs.layout)
+
 
     Returns:
     --------
@@ -31,78 +39,26 @@ def community_layout(g, partition):
 
     """
 
-    pos_communities = _position_communities(g, partition)
-
-    pos_nodes = _position_nodes(g, partition)
-
-    # combine positions
-    pos = dict()
-    for node in g.nodes():
-        pos[node] = pos_communities[node] + pos_nodes[node]
-
-    return pos
-
-
-def _position_communities(g, partition):
-
-    # create a weighted graph, in which each node corresponds to a community,
-    # and each edge weight to the number of edges between communities
-    between_community_edges = _find_between_community_edges(g, partition)
-
-    communities = set(partition.values())
-    hypergraph = nx.DiGraph()
-    hypergraph.add_nodes_from(communities)
-    for (ci, cj), edges in between_community_edges.items():
-        hypergraph.add_edge(ci, cj, weight=len(edges))
-
-    # find layout for communities
-    # pos_communities = nx.circular_layout(hypergraph)
-    pos_communities = nx.spring_layout(hypergraph,k=5,scale=10, seed=42)
-
-    # set node positions to position of community
-    pos = dict()
-    for node, community in partition.items():
-        pos[node] = pos_communities[community]
-
-    return pos
-
-
-def _find_between_community_edges(g, partition):
-
-    edges = dict()
-
-    for (ni, nj) in g.edges():
-        ci = partition[ni]
-        cj = partition[nj]
+    pos, _ = community_layout_arrays(g, partition, cache_dir, processes)
 
-        if ci != cj:
-            try:
-                edges[(ci, cj)] += [(ni, nj)]
-            except KeyError:
-                edges[(ci, cj)] = [(ni, nj)]
+    return dict(zip(g.nodes(), pos))
 
-    return edges
 
-
-def _position_nodes(g, partition, **kwargs):
-    """
-    Positions nodes within communities.
+def community_layout_arrays(g, partition, cache_dir=None, processes=None):
     """
+    community_layout as arrays in g.nodes() order
 
-    communities = dict()
-    for node, community in partition.items():
-        try:
-            communities[community] += [node]
-        except KeyError:
-            communities[community] = [node]
-
-    pos = dict()
-    for ci, nodes in communities.items():
-        subgraph = g.subgraph(nodes)
-        pos_subgraph = nx.spring_layout(subgraph)
-        pos.update(pos_subgraph)
+    returns:
+    - pos: (num_nodes, 2) positions
+    - csr: g as a CSRGraph, for its edge arrays
+    """
+    csr = graph_to_csr(g)
+    labels = np.fromiter((partition[node] for node in g.nodes()), dtype=np.int64,
+                         count=g.number_of_nodes())
+    # community ids 0..k-1
+    _, labels = np.unique(labels, return_inverse=True)
 
-    return pos
+    return community_positions(csr, labels, processes=processes, cache_dir=cache_dir), csr
 
 
 def generate_random_colors(n: int):
@@ -134,7 +90,49 @@ def generate_random_colors(n: int):
     return colors
 
 
-def plot_communities(G, communities):
+@timed()
+def plot_community_summary(H: nx.Graph, name="testeplotcommunitiessummary", max_node_size=3000):
+    """
+    plot of the community summary graph (graphs.community_graph), node area by
+    members and edge width by inter-community weight, saved as imgs/{name}.png
+    """
+    print(f"plotting community summary ...")
+    plt.figure(figsize=(20, 16))
+    k = H.number_of_nodes()
+    colors = generate_random_colors(k)
+
+    edges = np.array([(a, b, d) for a, b, d in H.edges(data="weight") if a != b],
+                     dtype=np.float64).reshape(-1, 3)
+    u, v, w = edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64), edges[:, 2]
+    pos = rescale(force_layout(k, u, v, w))
+    sizes = np.array([H.nodes[c]["size"] for c in range(k)], dtype=np.float64)
+
+    draw_nodes(plt.gca(), pos, [colors[c % len(colors)] for c in range(k)],
+               node_size=max_node_size * sizes / sizes.max(), alpha=0.8)
+    if len(w):
+        draw_edges(pos, u, v, w, width_scale=10 / w.max(), alpha=0.4)
+    for c in range(k):
+        plt.text(pos[c, 0], pos[c, 1], f"{c}", fontsize=12, ha="center", va="center")
+
+    os.makedirs(f"{CURR_PATH}imgs/", exist_ok=True)
+    plt.savefig(f"{CURR_PATH}imgs/{name}.png")
+    print(f"{CURR_PATH}imgs/{name}.png")
+
+
+@timed()
+def plot_communities(G, communities, render="networkx", max_edges=None, level="nodes"):
+    """
+    plot the graph laid out by community, saved as imgs/testeplotcommunitiesfinal.png
+
+    params:
+    - render: "networkx" (nx.draw_networkx_*), "lines" or "density" (graphs.render)
+    - max_edges: edges drawn at most, sampled by weight, render "lines" / "density" only
+    - level: "nodes" plots every node, "communities" the community summary graph
+      (plot_community_summary)
+    """
+    if level == "communities":
+        return plot_community_summary(community_summary_graph(G, communities))
+
 
     print(f"plotting")
     plt.figure(figsize=(20, 16))
@@ -154,27 +152,33 @@ def plot_communities(G, communities):
     node_colors = [color_map[node] for node in G.nodes() if color_map.get(node) is not None]
 
     # get positions oriented by communities
-    start = time()
-    comm_map = community_to_dict_mapping(G, communities)
-    pos = community_layout(G, comm_map)
-    del comm_map
-    end = time()
-    print(f"defined community layout...{end - start:.4f} sec")
+    with stage("plot_communities.layout", nodes=G.number_of_nodes()) as rec:
+        comm_map = community_to_dict_mapping(G, communities)
+        pos_array, csr = community_layout_arrays(G, comm_map,
+                                                 cache_dir=f"{CURR_PATH}cache/layouts/")
+        pos = dict(zip(G.nodes(), pos_array))
+        del comm_map
+    print(f"defined community layout...{rec.get('wall_s', 0):.4f} sec")
 
     # plotting ...
-    start = time()
-    nx.draw_networkx_nodes(G, pos, node_size=20, node_color=node_colors,
-                           alpha=0.6)
-    end = time()
-
-    print(f"nodes drawn in {end - start: .4f} seconds")
-
-    start = time()
-    edges = G.edges(data=True)
-    nx.draw_networkx_edges(G, pos, alpha=0.6,
-                           width=[0.001 * edge[2]['weight'] for edge in edges])
-    end = time()
-    print(f"edges drawn in {end - start: .4f} seconds")
+    with stage("plot_communities.nodes", nodes=G.number_of_nodes()) as rec:
+        if render == "networkx":
+            nx.draw_networkx_nodes(G, pos, node_size=20, node_color=node_colors,
+                                   alpha=0.6)
+        else:
+            draw_nodes(plt.gca(), pos_array, node_colors, node_size=20, alpha=0.6)
+
+    print(f"nodes drawn in {rec.get('wall_s', 0): .4f} seconds")
+
+    with stage("plot_communities.edges", edges=G.number_of_edges()) as rec:
+        if render == "networkx":
+            edges = G.edges(data=True)
+            nx.draw_networkx_edges(G, pos, alpha=EDGE_ALPHA,
+                                   width=[EDGE_WIDTH_SCALE * edge[2]['weight'] for edge in edges])
+        else:
+            u, v, w = csr.edge_arrays()
+            draw_edges(pos_array, u, v, w, mode=render, max_edges=max_edges)
+    print(f"edges drawn in {rec.get('wall_s', 0): .4f} seconds")
 
 
     # add community labels
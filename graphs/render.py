@@ -0,0 +1,136 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm
+
+from profiling import timed
+
+"""
+batched drawing of large graphs from position / edge arrays.
+
+nx.draw_networkx_edges builds one python object per edge; here all edges are a
+single LineCollection ("lines"), or are rasterised into a 2d histogram of points
+along the edge segments ("density"), drawn as one image. nx.draw_networkx_edges
+also ends in a LineCollection, so "lines" mostly saves the per edge python
+work; most of the time of a large plot is matplotlib rendering the lines, which
+"density" and edge sampling avoid. Edges can be sampled, with probability
+proportional to their weight, before drawing
+"""
+
+RENDER_MODES = ("networkx", "lines", "density")
+# edge width per unit of weight and edge alpha of the network plots, in every mode
+EDGE_WIDTH_SCALE = 0.001
+EDGE_ALPHA = 0.6
+
+
+def sample_edges(u, v, w, max_edges: int, seed=42):
+    """
+    keeps max_edges edges, drawn without replacement with probability proportional to weight
+    """
+    if max_edges is None or len(u) <= max_edges:
+        return u, v, w
+    rng = np.random.default_rng(seed)
+    w = np.asarray(w, dtype=np.float64)
+    # Efraimidis-Spirakis keys, the max_edges largest are a weighted sample
+    keys = np.log(rng.random(len(w))) / np.maximum(w, 1e-12)
+    keep = np.sort(np.argpartition(-keys, max_edges - 1)[:max_edges])
+    return u[keep], v[keep], w[keep]
+
+
+def draw_nodes(ax, pos: np.ndarray, node_color, node_size=20, alpha=0.6):
+    """
+    nodes as one scatter, as nx.draw_networkx_nodes
+    """
+    nodes = ax.scatter(pos[:, 0], pos[:, 1], s=node_size, c=node_color, alpha=alpha,
+                       edgecolors="face", zorder=2)
+    ax.tick_params(axis="both", which="both", bottom=False, left=False,
+                   labelbottom=False, labelleft=False)
+    return nodes
+
+
+def draw_lines(ax, pos: np.ndarray, u, v, w, width_scale=EDGE_WIDTH_SCALE, color="k",
+               alpha=EDGE_ALPHA):
+    """
+    every edge in one LineCollection, width width_scale * weight
+    """
+    segments = np.stack([pos[u], pos[v]], axis=1)
+    lines = LineCollection(segments, linewidths=width_scale * np.asarray(w, dtype=np.float64),
+                           colors=color, alpha=alpha, zorder=1)
+    ax.add_collection(lines)
+    ax.update_datalim(pos)
+    ax.autoscale_view()
+    return lines
+
+
+def _rasterise(a, d, counts, w, bins: int) -> np.ndarray:
+    """
+    adds w[i] at counts[i] evenly spaced points from a[i] to a[i] + d[i], in cell units
+    """
+    edge = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+    first = np.cumsum(counts) - counts
+    t = np.arange(counts.sum(), dtype=np.float32)
+    t -= first[edge]
+    t /= np.maximum(counts - 1, 1).astype(np.float32)[edge]
+    cell = np.zeros(len(edge), dtype=np.int64)
+    for axis, stride in ((0, bins), (1, 1)):
+        x = d[edge, axis] * t
+        x += a[edge, axis]
+        cell += np.minimum(x.astype(np.int64), bins - 1) * stride
+    return np.bincount(cell, w[edge], minlength=bins * bins)
+
+
+def draw_density(ax, pos: np.ndarray, u, v, w, bins=1000, cmap="Greys", alpha=EDGE_ALPHA,
+                 chunk_points=1 << 22):
+    """
+    edges rasterised into a bins x bins histogram: every edge adds its weight at
+    about one point per cell it crosses, drawn on a log scale
+    """
+    lo, hi = pos.min(axis=0), pos.max(axis=0)
+    pad = (hi - lo) * 0.02 + 1e-12
+    lo, hi = lo - pad, hi + pad
+    w = np.asarray(w, dtype=np.float64)
+
+    # node positions in cell units, points per edge from its length in cells
+    cells = ((pos - lo) / (hi - lo) * bins).astype(np.float32)
+    a, d = cells[u], cells[v] - cells[u]
+    counts = np.ceil(np.abs(d).max(axis=1)).astype(np.int64) + 1
+    hist = np.zeros(bins * bins)
+    bounds = np.searchsorted(np.cumsum(counts), np.arange(chunk_points, counts.sum(), chunk_points))
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(u)]):
+        if end > start:
+            hist += _rasterise(a[start:end], d[start:end], counts[start:end], w[start:end], bins)
+    hist = hist.reshape(bins, bins)
+    if not hist.any():
+        return None
+    return ax.imshow(np.ma.masked_equal(hist.T, 0), origin="lower", cmap=cmap, alpha=alpha,
+                     extent=(lo[0], hi[0], lo[1], hi[1]), aspect="auto",
+                     norm=LogNorm(vmin=hist[hist > 0].min(), vmax=hist.max()),
+                     interpolation="nearest", zorder=1)
+
+
+@timed(sizes=lambda pos, u, *a, **k: {"nodes": len(pos), "edges": len(u)})
+def draw_edges(pos: np.ndarray, u, v, w, mode="lines", max_edges=None,
+               width_scale=EDGE_WIDTH_SCALE, alpha=EDGE_ALPHA, seed=42, ax=None, **kwargs):
+    """
+    draws the edges (u, v, w) of a graph laid out at pos
+
+    params:
+    - pos: (num_nodes, 2) positions, in node index order
+    - mode: "lines" (LineCollection) or "density" (2d histogram of the edge segments)
+    - max_edges: edges drawn at most, sampled by weight (sample_edges), None for all
+    - kwargs: passed to draw_lines / draw_density
+    """
+    ax = ax or plt.gca()
+    u, v, w = sample_edges(u, v, w, max_edges, seed)
+    if mode == "lines":
+        return draw_lines(ax, pos, u, v, w, width_scale=width_scale, alpha=alpha, **kwargs)
+    if mode == "density":
+        return draw_density(ax, pos, u, v, w, alpha=alpha, **kwargs)
+    raise ValueError(f"mode must be one of {RENDER_MODES[1:]}, got {mode!r}")
+
+
+def positions_array(G, pos: dict) -> np.ndarray:
+    """
+    {node: position} dict as a (num_nodes, 2) array in G.nodes() order
+    """
+    return np.array([pos[node] for node in G.nodes()], dtype=np.float64).reshape(-1, 2)
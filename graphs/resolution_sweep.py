@@ -0,0 +1,101 @@
+import time
+import numpy as np
+import pandas as pd
+import networkx as nx
+from concurrent.futures import ProcessPoolExecutor
+
+from graphs.metrics_commenter_nets import cdlib_calc_communities
+from graphs.partition_quality import modularity, coverage_performance, partition_labels, \
+    prepare_detection_runs
+from profiling import timed
+
+"""
+community detection over a grid of resolutions and seeds. The graph, its edge
+arrays and node strengths are prepared once and shared with the worker
+processes (inherited through the pool initializer), every run only detects
+communities and scores them against the shared totals
+"""
+
+_shared = None
+
+
+def _score(shared: dict, labels: np.ndarray, resolution: float) -> dict:
+    u, v, w = shared["u"], shared["v"], shared["w"]
+    coverage, performance = coverage_performance(u, v, labels)
+    sizes = np.bincount(labels)
+    return {
+        "modularity": modularity(u, v, w, labels, resolution, shared["strength"]),
+        "coverage": coverage,
+        "performance": performance,
+        "number_of_communities": len(sizes),
+        "largest_community": int(sizes.max()),
+    }
+
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+
+
+def _run(task) -> dict:
+    alg, resolution, seed = task
+    start = time.time()
+    G = _shared["G"]
+    if alg == "louvain":
+        communities = nx.community.louvain_communities(G, weight="weight",
+                                                       resolution=resolution, seed=seed)
+    else:
+        communities = cdlib_calc_communities(G, resolution, alg=alg)
+    elapsed = time.time() - start
+
+    labels = partition_labels(_shared["csr"], communities)
+    # modularity of leiden partitions at the default resolution
+    row = {"alg": alg, "resolution": resolution, "seed": seed}
+    row.update(_score(_shared, labels, resolution if resolution is not None else 1.))
+    row["time"] = elapsed
+    return row
+
+
+def sweep_tasks(resolutions, seeds, algs=("louvain",)) -> list:
+    """
+    (alg, resolution, seed) runs of a sweep. cdlib's leiden takes neither resolution
+    nor seed, so it runs once
+    """
+    tasks = []
+    for alg in algs:
+        if alg == "leiden":
+            tasks.append((alg, None, None))
+        else:
+            tasks += [(alg, r, s) for r in resolutions for s in seeds]
+    return tasks
+
+
+@timed()
+def resolution_sweep(G, resolutions=(0.6, 0.8, 1., 1.2), seeds=(42,), algs=("louvain",),
+                     processes=None) -> pd.DataFrame:
+    """
+    runs community detection for every (resolution, seed) and scores each partition
+
+    params:
+    - G: networkx graph or CSRGraph
+    - resolutions: louvain resolutions, < 1 favors larger communities
+    - seeds: louvain seeds
+    - algs: "louvain" and/or "leiden" (cdlib_calc_communities)
+    - processes: pool size, None for os.cpu_count(), 1 runs in this process
+
+    returns:
+    - one row per run: alg, resolution, seed, modularity, coverage, performance,
+      number_of_communities, largest_community, time
+    """
+    shared = prepare_detection_runs(G)
+    tasks = sweep_tasks(resolutions, seeds, algs)
+    print(f"    {len(tasks)} community detection runs")
+
+    if processes == 1:
+        _init_worker(shared)
+        rows = list(map(_run, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(shared,)) as pool:
+            rows = list(pool.map(_run, tasks))
+    return pd.DataFrame(rows)
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+"""
+content addressed cache of pipeline stage outputs, kept under {path}cache/.
+
+a stage's key is the hash of its name, the content of its input files and its
+parameters, so a stage is skipped only when neither changed. Artifacts (files
+or .csr directories) are copied into cache/<key>/ and copied back on a hit;
+the least recently used entries are evicted when the cache grows past max_bytes.
+
+file hashes are memoised by (size, mtime), large inputs like comments.csv are
+only read again when they change
+"""
+
+INDEX_FILE = "index.json"
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f))
+                   for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def _copy(src: str, dst: str):
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+        shutil.copy2(src, dst)
+
+
+class StageCache:
+    """
+    index.json holds:
+    - entries: {key: {"stage", "files": {name: digest}, "size", "last_used"}}
+    - digests: {file path: [size, mtime_ns, sha256]}
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        params:
+        - cache_dir: i.e ./data/{youtuber}/cache/
+        - max_bytes: total artifact size kept, older entries are evicted past it
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, INDEX_FILE)
+        self._index = {"entries": {}, "digests": {}}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+
+    def digest(self, path: str) -> str:
+        """
+        sha256 of a file, or of the file names and contents of a directory
+        """
+        if os.path.isdir(path):
+            h = hashlib.sha256()
+            for name in sorted(os.listdir(path)):
+                h.update(name.encode())
+                h.update(self.digest(os.path.join(path, name)).encode())
+            return h.hexdigest()
+
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        memo = self._index["digests"].get(path)
+        if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+            return memo[2]
+        digest = _file_sha256(path)
+        self._index["digests"][path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def key(self, stage: str, inputs: list, params: dict) -> str:
+        h = hashlib.sha256(stage.encode())
+        for path in inputs:
+            h.update(self.digest(path).encode())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        self._save_index()
+        return h.hexdigest()
+
+    def get(self, key: str, outputs: dict) -> bool:
+        """
+        restores the artifacts of key to outputs ({name: path}), returns False on a miss
+        """
+        entry = self._index["entries"].get(key)
+        if entry is None or set(entry["files"]) != set(outputs):
+            return False
+        for name, path in outputs.items():
+            # skip the copy if path already holds the cached content
+            if os.path.exists(path) and self.digest(path) == entry["files"][name]:
+                continue
+            _copy(os.path.join(self.cache_dir, key, name), path)
+        entry["last_used"] = time.time()
+        self._save_index()
+        print(f"    cache hit for {entry['stage']} ({key[:12]})")
+        return True
+
+    def put(self, key: str, stage: str, outputs: dict):
+        """
+        stores the artifacts outputs ({name: path}) under key, then evicts the
+        least recently used entries above max_bytes
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.makedirs(entry_dir)
+        for name, path in outputs.items():
+            _copy(path, os.path.join(entry_dir, name))
+        self._index["entries"][key] = {
+            "stage": stage,
+            "files": {name: self.digest(path) for name, path in outputs.items()},
+            "size": _size(entry_dir),
+            "last_used": time.time(),
+        }
+        self._evict(keep=key)
+        self._save_index()
+
+    def total_size(self) -> int:
+        return sum(e["size"] for e in self._index["entries"].values())
+
+    def _evict(self, keep: str):
+        entries = self._index["entries"]
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if self.total_size() <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            print(f"    evicted cached {entries[key]['stage']} ({key[:12]})")
+            del entries[key]
+
+    def _save_index(self):
+        # digests of deleted files are dropped
+        digests = self._index["digests"]
+        for path in [p for p in digests if not os.path.exists(p)]:
+            del digests[path]
+        tmp = f"{self._index_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_path)
@@ -3,22 +3,36 @@ from graphs.metrics_commenter_nets import *
 from graphs.plot_commenter_nets import *
 from graphs.build_commenter_networks import *
 from graphs.plot_communities import *
+from graphs.graph_store import save_graph_csr, graph_name
+from graphs.resolution_sweep import resolution_sweep
+from graphs.consensus import consensus_communities
+from graphs.graph_filter import threshold_sweep
+from graphs.pipeline import run_pipeline, load_communities
+from graphs.stage_cache import StageCache
+from graphs.community_graph import community_summary_graph, export_summary_graph
 from graphs.feature_similarity import plot_feature_simmilarity
 
 from crawler.crawling import Crawling
-from constants import CURR_PATH, CURR_YTBR
+from crawler.dataset import partition_path, partition_mtime, write_comments_dataset
+from profiling import start_trace, stop_trace
+from constants import (CURR_PATH, CURR_YTBR, YTBRS_LIST, CACHE_MAX_BYTES, CRAWLER_PATH,
+                       COMMENTS_DATASET_PATH)
 
 import networkx as nx
 import pandas as pd
-import pickle
 import os
+import time
 
 
 def run_crawler():
-    craw = Crawling()
-    craw.build_channels_list()
-    # craw.build_youtubers_videos_list()
-    # craw.build_videos_comments_df()
+    start_trace(f"crawl-{time.strftime('%Y%m%d-%H%M%S')}")
+    try:
+        craw = Crawling()
+        craw.build_channels_list()
+        # craw.build_youtubers_videos_list()
+        # craw.build_videos_comments_df()
+    finally:
+        stop_trace(f"{CRAWLER_PATH}traces/")
 
 
 def save_graph_metrics(G: nx.Graph, communities, res):
@@ -33,7 +47,7 @@ def save_graph_metrics(G: nx.Graph, communities, res):
 def save_community_metrics(G: nx.Graph, communities):
     print(f"calculating community metrics ...")
 
-    metrics = calc_per_community_metrics(G, communities)
+    metrics = calc_per_community_metrics_parallel(G, communities)
 
     df = pd.DataFrame(metrics)
     os.makedirs(f"{CURR_PATH}metrics/", exist_ok=True)
@@ -49,39 +63,140 @@ def save_clique_metrics(G: nx.Graph):
     df.to_csv(f"{CURR_PATH}metrics/commenter_network_clique_metricstest.csv")
 
 
-def build_networks():
-    df = pd.read_csv(f"{CURR_PATH}comments.csv")
-
-    build_co_commenter_net(df)
-    build_video_commenter_net(df)
-    # build_vid_co_commenter_net(df)
+def stage_cache():
+    return StageCache(f"{CURR_PATH}cache/", CACHE_MAX_BYTES)
 
 
-def filter_and_save_graph(path):
-    name = path.split("/")[-1].replace(".pickle", "")
+def build_networks():
+    cache = stage_cache()
+    outputs = {
+        "co_commenter_network.csr": f'{CURR_PATH}/co_commenter_network.csr',
+        "video_commenter_network.csr": f'{CURR_PATH}/video_commenter_network.csr',
+    }
+    # the youtuber's partition of the parquet comment dataset, unless comments.csv is newer
+    source = f"{CURR_PATH}comments.csv"
+    partition = partition_path(COMMENTS_DATASET_PATH, CURR_YTBR)
+    if os.path.isdir(partition) and (not os.path.exists(source) or
+                                     partition_mtime(partition) >= os.path.getmtime(source)):
+        source = partition
+    print(f"building networks from {source}")
+    key = cache.key("build", [source], {})
+    if cache.get(key, outputs):
+        return
+
+    # the builders stream the video / author columns of source in chunks
+    build_co_commenter_net_sparse(source)
+    build_video_commenter_net(source)
+    # build_vid_co_commenter_net(df)
+    cache.put(key, "build", outputs)
+
+
+def convert_comments_dataset(youtubers=YTBRS_LIST):
+    """
+    writes the typed parquet comment dataset (crawler.dataset) from the
+    comments.csv of youtubers crawled before it existed
+    """
+    for youtuber in youtubers:
+        csv_path = f"{CRAWLER_PATH}{youtuber}/comments.csv"
+        if os.path.exists(csv_path):
+            write_comments_dataset(csv_path, COMMENTS_DATASET_PATH, youtuber)
+
+
+def update_networks(comments_path=f"{CURR_PATH}_comments.csv",
+                    delta_path=f"{CURR_PATH}_comments_delta.csv"):
+    """
+    applies the comments of an incremental crawl (Crawling.update_videos_comments_df)
+    to the stored co-commenter network and its filtered version
+
+    params:
+    - comments_path: comments the crawl merged the delta into, {path}_comments.csv
+    - delta_path: new comments of the crawl, {path}_comments_delta.csv
+    """
+    cols = ["video_id", "comment_author_channel_id", "comment_id"]
+    df = pd.read_csv(comments_path, usecols=cols)
+    delta = pd.read_csv(delta_path, usecols=cols)
+    # the crawl has already merged the delta into comments_path
+    df = df[~df["comment_id"].isin(delta["comment_id"])]
+
+    update_co_commenter_net(df, delta, f'{CURR_PATH}/co_commenter_network.csr',
+                            f'{CURR_PATH}/co_commenter_network_filtered_noselfloop.csr',
+                            min_edge_weight=10)
+
+
+def filter_and_save_graph(path, min_edge_weight=10):
+    name = graph_name(path)
     print(f"filtering and saving {name} of youtuber {CURR_YTBR}")
 
-    G = load_graph(path)
+    cache = stage_cache()
+    out_path = f'{CURR_PATH}/{name}_filtered_noselfloop.csr'
+    outputs = {f"{name}_filtered_noselfloop.csr": out_path}
+    key = cache.key("filter", [path], {"min_edge_weight": min_edge_weight})
+    if cache.get(key, outputs):
+        return
+
+    G = load_graph(path, as_arrays=True)
     # mininum number of videos users co-commented on
-    G = filter_graph(G, min_edge_weight=10)
+    G = filter_graph(G, min_edge_weight=min_edge_weight)
 
-    pickle.dump(G, open(f'{CURR_PATH}/{name}_filtered_noselfloop.pickle', 'wb'))
+    save_graph_csr(G, out_path)
+    cache.put(key, "filter", outputs)
     print(f"saved ..")
 
 
-def community_metrics(path, save_metrics=True, plot=True):
-    G = load_graph(path)
+def sweep_filter_thresholds(path, thresholds=range(1, 31)):
+    """
+    size of the filtered graph per min_edge_weight, to pick the cut-off of filter_and_save_graph
+    """
+    G = load_graph(path, as_arrays=True)
+
+    print(f'filter threshold sweep of {graph_name(path)} - {CURR_YTBR}')
+    df = threshold_sweep(G, thresholds)
+
+    os.makedirs(f"{CURR_PATH}metrics/", exist_ok=True)
+    df.to_csv(f"{CURR_PATH}metrics/{graph_name(path)}_filter_sweep.csv", index=False)
+    print(df)
+
+
+def community_metrics(path, save_metrics=True, plot=True, consensus_runs=0, seed=42,
+                      summary=False):
+    """
+    communities and metrics are cached (graphs.stage_cache), recomputed only when
+    the graph or the parameters change
 
-    print(f'{path.split("/")[-1][:-7]} - {CURR_YTBR}')
+    params:
+    - consensus_runs: > 0 uses the consensus of that many seeded louvain runs
+      (graphs.consensus) and saves their agreement, 0 runs louvain once with seed
+    - summary: saves the community summary graph (graphs.community_graph) as
+      metrics/community_graph.{gexf,graphml,json} and plots it instead of every node
+    """
+    print(f'{graph_name(path)} - {CURR_YTBR}')
 
     res = 0.8
 
-    communities = calc_louvain_communities(G, res)
+    cache = stage_cache()
+    comm_path = f"{CURR_PATH}metrics/communitiestest.csv"
+    comm_outputs = {"communitiestest.csv": comm_path}
+    if consensus_runs:
+        comm_outputs["communities_agreementtest.csv"] = \
+            f"{CURR_PATH}metrics/communities_agreementtest.csv"
+    params = {"resolution": res, "seed": seed, "consensus_runs": consensus_runs}
+    if consensus_runs:
+        # consensus communities are louvain communities of the agreement graph
+        params["consensus"] = "louvain"
+    key = cache.key("communities", [path], params)
+
+    G = None
+    if cache.get(key, comm_outputs):
+        communities = load_communities(comm_path)
+    else:
+        G = load_graph(path)
+        os.makedirs(f"{CURR_PATH}metrics/", exist_ok=True)
+        if consensus_runs:
+            communities, agreement = consensus_communities(G, consensus_runs, res, seed)
+            agreement.to_csv(comm_outputs["communities_agreementtest.csv"], index=False)
+        else:
+            communities = calc_louvain_communities(G, res, seed=seed)
 
-    if save_metrics:
-        save_graph_metrics(G, communities, res)
-        save_community_metrics(G, communities)
-        save_clique_metrics(G)
         comm_map = []
         for i, c in enumerate(list(communities)):
             for node in c:
@@ -91,22 +206,79 @@ def community_metrics(path, save_metrics=True, plot=True):
                 })
 
         comm_map_df = pd.DataFrame(comm_map)
-        comm_map_df.to_csv(f"{CURR_PATH}metrics/communitiestest.csv", index=False)
-
+        comm_map_df.to_csv(comm_path, index=False)
+        cache.put(key, "communities", comm_outputs)
 
-    if plot:
+    if save_metrics:
+        metric_outputs = {
+            name: f"{CURR_PATH}metrics/{name}"
+            for name in ["commenter_network_metricstest.csv",
+                         "commenter_network_community_metricstest.csv",
+                         "commenter_network_clique_metricstest.csv"]
+        }
+        key = cache.key("metrics", [path, comm_path], {"resolution": res})
+        if not cache.get(key, metric_outputs):
+            G = load_graph(path) if G is None else G
+            save_graph_metrics(G, communities, res)
+            save_community_metrics(G, communities)
+            save_clique_metrics(G)
+            cache.put(key, "metrics", metric_outputs)
+
+    if summary:
+        G = load_graph(path) if G is None else G
+        H = community_summary_graph(G, communities)
+        export_summary_graph(H, f"{CURR_PATH}metrics/community_graph")
+        if plot:
+            plot_community_summary(H)
+    elif plot:
+        G = load_graph(path) if G is None else G
         plot_communities(G, communities)
         # plot_community_graph(G, communities,res=res,
         #                      path=path.replace(CURR_PATH,"").replace(".pickle","").replace("/",""))
 
-def main():
-    # co_commenter_path = f'{CURR_PATH}/co_commenter_network.pickle'
-    # co_commenter_ftr_path = f'{CURR_PATH}/co_commenter_network_filtered.pickle'
-    co_commenter_nsl_path = f'{CURR_PATH}/co_commenter_network_filtered_noselfloop.pickle'
+def sweep_resolutions(path, resolutions=(0.4, 0.6, 0.8, 1., 1.2, 1.5), seeds=(42, 43, 44),
+                      algs=("louvain",)):
+    """
+    scores louvain partitions over a grid of resolutions and seeds, to pick the
+    resolution used by community_metrics
+    """
+    G = load_graph(path, as_arrays=True)
+
+    print(f'resolution sweep of {graph_name(path)} - {CURR_YTBR}')
+    df = resolution_sweep(G, resolutions, seeds, algs)
+
+    os.makedirs(f"{CURR_PATH}metrics/", exist_ok=True)
+    df.to_csv(f"{CURR_PATH}metrics/{graph_name(path)}_resolution_sweep.csv", index=False)
+    print(df.groupby(["alg", "resolution"], dropna=False)[
+        ["modularity", "number_of_communities"]].mean())
+
+
+def run_all_youtubers(processes=None):
+    """
+    build, filter, communities and metrics of every youtuber in YTBRS_LIST,
+    skipping stages that are up to date, and the merged youtubers_networks_* tables
+    """
+    run_pipeline(YTBRS_LIST, processes=processes)
+
+
+def main(profile=False):
+    """
+    - profile: cProfile every top level stage, .prof files saved in {CURR_PATH}traces/profiles/
+    """
+    # co_commenter_path = f'{CURR_PATH}/co_commenter_network.csr'
+    # co_commenter_ftr_path = f'{CURR_PATH}/co_commenter_network_filtered.csr'
+    co_commenter_nsl_path = f'{CURR_PATH}/co_commenter_network_filtered_noselfloop.csr'
 
     print(f"current youtuber: {CURR_YTBR}")
 
-    community_metrics(co_commenter_nsl_path, save_metrics=True, plot=False)
+    # timing trace of the run, saved in {CURR_PATH}traces/
+    start_trace(f"{CURR_YTBR}-{time.strftime('%Y%m%d-%H%M%S')}",
+                profile_stages=("*",) if profile else (),
+                profile_dir=f"{CURR_PATH}traces/profiles/")
+    try:
+        community_metrics(co_commenter_nsl_path, save_metrics=True, plot=False)
+    finally:
+        stop_trace(f"{CURR_PATH}traces/")
 
 
 
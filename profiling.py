@@ -0,0 +1,331 @@
+import os
+import csv
+import json
+import time
+import shutil
+import signal
+import cProfile
+import functools
+import threading
+import subprocess
+import resource
+import pandas as pd
+import scipy.sparse as sp
+
+"""
+per run timing trace of the crawler and graph pipeline.
+
+code marks its stages with `with stage(name, **sizes)` or the @timed decorator.
+While a trace is active (start_trace ... stop_trace) every stage records wall and
+cpu time, rss at start / end and the peak rss while it ran (sampled by one
+background thread), its input sizes (nodes, edges, rows) and its parent stage.
+Without an active trace a stage only measures its wall time. The trace belongs
+to the process that started it, forked workers (process pools) start without one.
+
+stop_trace writes the records to {out_dir}{run}.json (with a per stage summary)
+and {out_dir}{run}.csv. Stages can also be profiled, with cProfile (.prof files,
+readable by snakeviz / pstats) or with py-spy attached to the process
+"""
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_trace = None
+
+
+def _drop_trace_in_child():
+    # the sampler thread is not forked, and may have held the trace lock at fork time
+    global _trace
+    _trace = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_drop_trace_in_child)
+
+
+def current_rss_mb() -> float:
+    """
+    resident memory of this process, peak so far where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def input_sizes(obj, prefix="") -> dict:
+    """
+    nodes / edges / rows of graphs, dataframes, sparse matrices and collections
+    """
+    # CSRGraph counts its edges from the arrays, nnz is enough
+    if hasattr(obj, "indptr") and hasattr(obj, "nodes"):
+        return {f"{prefix}nodes": len(obj.nodes), f"{prefix}adjacency_nnz": len(obj.indices)}
+    if hasattr(obj, "number_of_nodes") and hasattr(obj, "number_of_edges"):
+        return {f"{prefix}nodes": obj.number_of_nodes(), f"{prefix}edges": obj.number_of_edges()}
+    if isinstance(obj, pd.DataFrame):
+        return {f"{prefix}rows": len(obj)}
+    if sp.issparse(obj):
+        return {f"{prefix}rows": obj.shape[0], f"{prefix}nnz": obj.nnz}
+    if isinstance(obj, (list, tuple, set, dict)):
+        return {f"{prefix}items": len(obj)}
+    return {}
+
+
+class PySpyHook:
+    """
+    stage hook recording a py-spy flamegraph of each profiled stage,
+    {out_dir}{stage}-{id}.svg. Needs py-spy on PATH (and ptrace permission)
+    """
+
+    def __init__(self, out_dir: str, rate: int = 100):
+        self.out_dir = out_dir
+        self.rate = rate
+        self._procs = {}
+        if shutil.which("py-spy") is None:
+            raise RuntimeError("py-spy not found on PATH")
+
+    def __call__(self, event: str, record: dict):
+        if event == "start":
+            os.makedirs(self.out_dir, exist_ok=True)
+            out = os.path.join(self.out_dir, f"{record['stage']}-{record['id']}.svg")
+            self._procs[record["id"]] = subprocess.Popen(
+                ["py-spy", "record", "--pid", str(os.getpid()), "--rate", str(self.rate),
+                 "--output", out], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            proc = self._procs.pop(record["id"], None)
+            if proc is not None:
+                # py-spy writes the flamegraph on SIGINT
+                proc.send_signal(signal.SIGINT)
+                proc.wait()
+
+
+class Trace:
+    def __init__(self, run: str, profile_stages=(), profile_dir=None, hooks=(),
+                 sample_interval: float = 0.05):
+        """
+        params:
+        - run: run name, file name of the saved trace
+        - profile_stages: stage names profiled with cProfile, "*" for every outermost stage
+        - profile_dir: directory of the .prof files
+        - hooks: callables (event, record), event "start" or "end", called for profiled stages
+        - sample_interval: seconds between rss samples
+        """
+        self.run = run
+        self.profile_stages = set(profile_stages)
+        self.profile_dir = profile_dir
+        self.hooks = list(hooks)
+        self.sample_interval = sample_interval
+        self.records = []
+        self._ids = 0
+        self._open = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiling = False
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            rss = current_rss_mb()
+            with self._lock:
+                for rid in self._open:
+                    self._open[rid] = max(self._open[rid], rss)
+
+    def _profiled(self, name: str) -> bool:
+        return name in self.profile_stages or \
+            ("*" in self.profile_stages and not getattr(self._local, "stack", None))
+
+    def begin(self, name: str, sizes: dict) -> dict:
+        stack = self._local.__dict__.setdefault("stack", [])
+        rss = current_rss_mb()
+        with self._lock:
+            self._ids += 1
+            record = {
+                "id": self._ids,
+                "run": self.run,
+                "stage": name,
+                "parent": stack[-1]["id"] if stack else None,
+                "depth": len(stack),
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+                "start": time.time(),
+                "rss_start_mb": rss,
+                **sizes,
+            }
+            self._open[record["id"]] = rss
+
+        record["_t0"] = time.perf_counter()
+        record["_cpu0"] = time.process_time()
+        record["_profile"] = None
+        record["_hooks"] = self._profiled(name)
+        if record["_hooks"]:
+            for hook in self.hooks:
+                hook("start", record)
+            # cProfile profiles one stage at a time
+            with self._lock:
+                if self.profile_dir and not self._profiling:
+                    self._profiling = True
+                    record["_profile"] = cProfile.Profile()
+            if record["_profile"] is not None:
+                record["_profile"].enable()
+        stack.append(record)
+        return record
+
+    def end(self, record: dict, error=None):
+        wall = time.perf_counter() - record.pop("_t0")
+        cpu = time.process_time() - record.pop("_cpu0")
+        profile = record.pop("_profile")
+        if profile is not None:
+            profile.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profile.dump_stats(os.path.join(self.profile_dir,
+                                            f"{record['stage']}-{record['id']}.prof"))
+            with self._lock:
+                self._profiling = False
+        if record.pop("_hooks"):
+            for hook in self.hooks:
+                hook("end", record)
+        self._local.stack.pop()
+
+        rss = current_rss_mb()
+        with self._lock:
+            peak = max(self._open.pop(record["id"]), rss)
+            record.update({
+                "wall_s": wall,
+                # process cpu time, includes other threads running meanwhile
+                "cpu_s": cpu,
+                "rss_end_mb": rss,
+                "peak_rss_mb": peak,
+                "error": repr(error) if error is not None else None,
+            })
+            self.records.append(record)
+
+    def close(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def summary(self) -> list:
+        """
+        calls, total / max wall time and max peak rss per stage
+        """
+        if not self.records:
+            return []
+        df = pd.DataFrame(self.records)
+        summary = df.groupby("stage").agg(
+            calls=("id", "count"),
+            total_wall_s=("wall_s", "sum"),
+            max_wall_s=("wall_s", "max"),
+            max_peak_rss_mb=("peak_rss_mb", "max"),
+        ).sort_values("total_wall_s", ascending=False)
+        return summary.reset_index().to_dict("records")
+
+    def save(self, out_dir: str) -> str:
+        """
+        writes {out_dir}{run}.json and {out_dir}{run}.csv, returns the json path
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        records = sorted(self.records, key=lambda r: r["id"])
+        path = os.path.join(out_dir, f"{self.run}.json")
+        with open(path, "w") as f:
+            json.dump({"run": self.run, "summary": self.summary(), "records": records},
+                      f, indent=4, default=str)
+
+        columns = []
+        for r in records:
+            columns += [k for k in r if k not in columns]
+        with open(os.path.join(out_dir, f"{self.run}.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(records)
+        return path
+
+
+def start_trace(run: str = None, **kwargs) -> Trace:
+    """
+    starts recording stages of this process, kwargs as in Trace.
+    run defaults to run-{timestamp}
+    """
+    global _trace
+    if _trace is not None:
+        _trace.close()
+    run = run or time.strftime("run-%Y%m%d-%H%M%S")
+    _trace = Trace(run, **kwargs)
+    return _trace
+
+
+def stop_trace(out_dir: str = None):
+    """
+    stops recording, saving the trace to out_dir if given
+    """
+    global _trace
+    trace, _trace = _trace, None
+    if trace is None:
+        return None
+    trace.close()
+    if out_dir is not None:
+        path = trace.save(out_dir)
+        print(f"trace of {len(trace.records)} stages saved at {path}")
+    return trace
+
+
+class stage:
+    """
+    context manager timing a stage, yields the stage record, sizes can be added to it.
+    record["wall_s"] is set on exit, also without an active trace
+
+        with stage("build_co_commenter_net", rows=len(df)) as rec:
+            ...
+            rec["edges"] = W.nnz
+    """
+
+    def __init__(self, name: str, **sizes):
+        self.name = name
+        self.sizes = sizes
+        self.record = None
+
+    def __enter__(self) -> dict:
+        self.trace = _trace
+        if self.trace is None:
+            # wall time only
+            self.record = dict(self.sizes)
+            self._t0 = time.perf_counter()
+        else:
+            self.record = self.trace.begin(self.name, self.sizes)
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            self.trace.end(self.record, exc)
+        else:
+            self.record["wall_s"] = time.perf_counter() - self._t0
+        return False
+
+
+def timed(name: str = None, sizes=None, output_sizes: bool = True):
+    """
+    decorator recording every call of a function as a stage
+
+    params:
+    - name: stage name, the function name if None
+    - sizes: function (*args, **kwargs) -> dict of input sizes, by default the
+      sizes of the first argument (input_sizes)
+    - output_sizes: also record the sizes of the returned value, prefixed out_
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace is None:
+                return func(*args, **kwargs)
+            if sizes is not None:
+                _sizes = sizes(*args, **kwargs)
+            else:
+                _sizes = input_sizes(args[0]) if args else {}
+            with stage(stage_name, **_sizes) as record:
+                result = func(*args, **kwargs)
+                if output_sizes:
+                    record.update(input_sizes(result, prefix="out_"))
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,51 @@
+import numpy as np
+import networkx as nx
+import pytest
+
+from graphs.cliques import stream_clique_stats, degeneracy_order
+
+
+@pytest.fixture
+def graph():
+    G = nx.relabel_nodes(nx.powerlaw_cluster_graph(300, 8, 0.6, seed=3), lambda u: f"n{u}")
+    G.add_edge("n0", "n0")
+    return G
+
+
+def test_stats_match_find_cliques(graph):
+    G = graph.copy()
+    G.remove_edges_from(list(nx.selfloop_edges(G)))
+    sizes = [len(c) for c in nx.find_cliques(G) if len(c) >= 5]
+    members = {u for c in nx.find_cliques(G) if len(c) >= 5 for u in c}
+
+    stats = stream_clique_stats(graph, min_size=5)
+    assert stats.complete
+    assert stats.count == len(sizes)
+    assert stats.max_size == max(sizes)
+    assert stats.median() == np.median(sizes)
+    assert stats.members == members
+
+
+def test_parallel_matches_serial(graph):
+    serial = stream_clique_stats(graph, min_size=5)
+    for processes in (2, 3):
+        parallel = stream_clique_stats(graph, min_size=5, processes=processes)
+        assert parallel.count == serial.count
+        assert parallel.sizes == serial.sizes
+        assert parallel.max_idx == serial.max_idx
+        assert parallel.members == serial.members
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_max_cliques_is_a_global_cap(graph, processes):
+    stats = stream_clique_stats(graph, min_size=5, max_cliques=10, processes=processes)
+    assert stats.count == 10
+    assert not stats.complete
+
+
+def test_degeneracy_order(graph):
+    G = graph.copy()
+    G.remove_edges_from(list(nx.selfloop_edges(G)))
+    pos = {u: i for i, u in enumerate(degeneracy_order(G))}
+    later = max(sum(pos[v] > pos[u] for v in G[u]) for u in G)
+    assert later == max(nx.core_number(G).values())
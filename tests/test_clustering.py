@@ -0,0 +1,34 @@
+import numpy as np
+import networkx as nx
+import pytest
+
+from graphs.clustering import weighted_clustering, average_weighted_clustering
+from graphs.graph_store import graph_to_csr
+
+
+@pytest.fixture
+def graph():
+    """
+    random graph with uneven (heavy tailed) weights, isolated nodes and self loops
+    """
+    rng = np.random.default_rng(0)
+    G = nx.gnp_random_graph(200, 0.05, seed=1)
+    for u, v in G.edges():
+        G[u][v]["weight"] = float(rng.pareto(1.5) + 1)
+    G.add_nodes_from(range(200, 210))
+    G.add_edge(5, 5, weight=3.)
+    return nx.relabel_nodes(G, str)
+
+
+@pytest.mark.parametrize("processes, max_wedges", [(1, 20_000_000), (1, 500), (2, 500)])
+def test_weighted_clustering_matches_networkx(graph, processes, max_wedges):
+    csr = graph_to_csr(graph)
+    expected = nx.clustering(graph, weight="weight")
+    result = weighted_clustering(csr.adjacency(), processes=processes, max_wedges=max_wedges)
+    np.testing.assert_allclose(result, [expected[n] for n in csr.nodes.tolist()], atol=1e-12)
+
+
+def test_average_weighted_clustering_matches_networkx(graph):
+    expected = nx.average_clustering(graph, weight="weight")
+    assert average_weighted_clustering(graph) == pytest.approx(expected, abs=1e-12)
+    assert average_weighted_clustering(graph_to_csr(graph)) == pytest.approx(expected, abs=1e-12)
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+from googleapiclient.errors import HttpError
+
+from crawler.crawling import Crawling
+from crawler.fake_api import FakeYouTubeAPI, build_canned_comments
+
+
+@pytest.fixture
+def canned():
+    data = build_canned_comments(n_videos=10)
+    data["disabled"].add("video0003")
+    return data
+
+
+@pytest.fixture
+def api_url(canned):
+    api = FakeYouTubeAPI(canned)
+    yield api.start()
+    api.stop()
+
+
+def crawl(url, canned, tmp_path, name, max_workers=1, mode="serial"):
+    """
+    crawls every canned video into tmp_path/name/, returns the saved comments
+    """
+    path = f"{tmp_path}/{name}/"
+    (tmp_path / name).mkdir()
+    crawler = Crawling(max_workers=max_workers, api_endpoint=url, api_keys=["fake"],
+                       comments_dataset=None)
+    videos = [{"video_id": v, "video_title": f"title of {v}"} for v in canned["commentThreads"]]
+    if mode == "serial":
+        crawler._get_comments_from_video_ids(videos, path)
+    elif mode == "concurrent":
+        crawler._get_comments_from_video_ids_concurrent(videos, path)
+    else:
+        crawler._get_comments_from_video_ids_checkpointed(videos, path)
+    return pd.read_csv(f"{path}_comments.csv", dtype=str, keep_default_na=False)
+
+
+@pytest.mark.parametrize("mode", ["concurrent", "checkpointed"])
+def test_concurrent_crawl_matches_serial(api_url, canned, tmp_path, monkeypatch, mode):
+    monkeypatch.chdir(tmp_path)
+    serial = crawl(api_url, canned, tmp_path, "serial")
+    concurrent = crawl(api_url, canned, tmp_path, mode, max_workers=8, mode=mode)
+
+    # 9 videos with comments, 3 pages of 20 threads and their replies each
+    assert len(serial) > 0
+    assert not serial["video_id"].eq("video0003").any()
+    pd.testing.assert_frame_equal(serial, concurrent)
+
+
+def test_failed_page_is_fetched_on_resume(canned, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    api = FakeYouTubeAPI(canned)
+    url = api.start()
+    try:
+        serial = crawl(url, canned, tmp_path, "serial")
+
+        # the first request fails, with no retries left
+        api.failures = [503]
+        path = f"{tmp_path}/resumed/"
+        (tmp_path / "resumed").mkdir()
+        crawler = Crawling(max_workers=4, api_endpoint=url, api_keys=["fake"],
+                           comments_dataset=None)
+        crawler.scheduler.max_retries = 0
+        videos = [{"video_id": v, "video_title": f"title of {v}"} for v in canned["commentThreads"]]
+        with pytest.raises(HttpError):
+            crawler._get_comments_from_video_ids_checkpointed(videos, path)
+
+        crawler._get_comments_from_video_ids_checkpointed(videos, path)
+        resumed = pd.read_csv(f"{path}_comments.csv", dtype=str, keep_default_na=False)
+    finally:
+        api.stop()
+    pd.testing.assert_frame_equal(serial, resumed)
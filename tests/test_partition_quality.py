@@ -0,0 +1,63 @@
+import numpy as np
+import networkx as nx
+import pytest
+
+from graphs.graph_store import graph_to_csr
+from graphs.partition_quality import (partition_quality, partition_labels, modularity,
+                                      coverage_performance)
+
+
+def weighted_graph(n, p, seed, self_loops=False):
+    rng = np.random.default_rng(seed)
+    G = nx.gnp_random_graph(n, p, seed=seed)
+    for u, v in G.edges():
+        G[u][v]["weight"] = float(rng.integers(1, 10))
+    if self_loops:
+        G.add_edge(0, 0, weight=4.)
+        G.add_edge(3, 3, weight=1.)
+    return nx.relabel_nodes(G, str)
+
+
+@pytest.fixture(params=[(12, 0.4, 0, False), (30, 0.2, 1, True), (60, 0.1, 2, True)])
+def graph(request):
+    return weighted_graph(*request.param)
+
+
+@pytest.fixture
+def communities(graph):
+    return nx.community.louvain_communities(graph, weight="weight", seed=0)
+
+
+@pytest.mark.parametrize("resolution", [0.5, 1., 2.])
+def test_modularity_matches_networkx(graph, communities, resolution):
+    csr = graph_to_csr(graph)
+    u, v, w = csr.edge_arrays()
+    expected = nx.community.modularity(graph, communities, weight="weight",
+                                       resolution=resolution)
+    result = modularity(u, v, w, partition_labels(csr, communities), resolution)
+    assert result == pytest.approx(expected, abs=1e-12)
+
+
+def test_coverage_performance_matches_networkx(graph, communities):
+    csr = graph_to_csr(graph)
+    u, v, _ = csr.edge_arrays()
+    expected = nx.community.partition_quality(graph, communities)
+    result = coverage_performance(u, v, partition_labels(csr, communities))
+    assert result == pytest.approx(expected, abs=1e-12)
+
+
+def test_partition_quality_matches_networkx(graph, communities):
+    quality = partition_quality(graph, communities, 1.5)
+    coverage, performance = nx.community.partition_quality(graph, communities)
+    assert quality["modularity"] == pytest.approx(
+        nx.community.modularity(graph, communities, weight="weight", resolution=1.5), abs=1e-12)
+    assert quality["coverage"] == pytest.approx(coverage, abs=1e-12)
+    assert quality["performance"] == pytest.approx(performance, abs=1e-12)
+
+
+def test_partition_labels_rejects_missing_nodes(graph, communities):
+    csr = graph_to_csr(graph)
+    partial = communities[1:]
+    with pytest.raises(nx.NetworkXError):
+        partition_labels(csr, partial)
+    assert (partition_labels(csr, partial, allow_missing=True) == -1).sum() == len(communities[0])
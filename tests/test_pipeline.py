@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from graphs import pipeline
+
+
+def comments(n, n_videos, n_authors, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "video_id": [f"v{i}" for i in rng.integers(0, n_videos, n)],
+        "comment_author_channel_id": [f"UC{i}" for i in rng.integers(0, n_authors, n)],
+    })
+
+
+@pytest.fixture
+def crawler_path(tmp_path, monkeypatch):
+    for seed, youtuber in enumerate(["a", "b"]):
+        (tmp_path / youtuber).mkdir()
+        comments(3000, 30, 120, seed).to_csv(tmp_path / youtuber / "comments.csv", index=False)
+    monkeypatch.setattr(pipeline, "CRAWLER_PATH", f"{tmp_path}/")
+    monkeypatch.setattr(pipeline, "MERGED_FILES",
+                        {name: f"{tmp_path}/{name}.csv" for name in pipeline.MERGED_FILES})
+    return tmp_path
+
+
+def test_missing_youtuber_writes_no_trace(crawler_path):
+    with pytest.raises(FileNotFoundError):
+        pipeline.run_youtuber("missing")
+    assert not os.path.exists(crawler_path / "missing")
+
+
+def test_trace_written_when_stages_run(crawler_path):
+    pipeline.run_youtuber("a", min_edge_weight=2)
+    assert os.listdir(crawler_path / "a" / "traces")
+
+
+def test_parallel_pipeline_matches_serial(crawler_path):
+    serial = pipeline.run_pipeline(["a", "b", "missing"], processes=1, min_edge_weight=2,
+                                   force=True)
+    parallel = pipeline.run_pipeline(["a", "b", "missing"], processes=2, min_edge_weight=2,
+                                     force=True)
+    assert len(serial["network"]) == 2
+    for name in pipeline.MERGED_FILES:
+        pd.testing.assert_frame_equal(serial[name], parallel[name])
@@ -0,0 +1,80 @@
+import googleapiclient.discovery
+import pytest
+from googleapiclient.errors import HttpError
+
+from crawler.fake_api import FakeYouTubeAPI, build_canned_comments
+from crawler.scheduler import RequestScheduler, QuotaExhaustedError
+
+
+@pytest.fixture
+def api():
+    api = FakeYouTubeAPI(build_canned_comments(n_videos=1), quota=2)
+    api.start()
+    yield api
+    api.stop()
+
+
+def scheduler(api, keys, **kwargs):
+    def build_client(key):
+        return googleapiclient.discovery.build("youtube", "v3", developerKey=key,
+                                               client_options={"api_endpoint": api.url})
+    return RequestScheduler(keys, build_client, backoff_base=0.01, **kwargs)
+
+
+def list_threads(s):
+    return s.execute("commentThreads.list", lambda yt: yt.commentThreads().list(
+        part="snippet", videoId="video0000"))
+
+
+def test_switches_key_on_quota_exceeded(api):
+    # k1 is already out of quota on the server
+    api.used["k1"] = 2
+    s = scheduler(api, ["k1", "k2"])
+
+    assert list_threads(s)["items"]
+    assert s.errors["quotaExceeded"] == 1
+    assert s.report()["exhausted_keys"] == 1
+    assert s.units_per_key["k1"] == 0 and s.units_per_key["k2"] == 1
+    # k1 is skipped from now on
+    list_threads(s)
+    assert s.errors["quotaExceeded"] == 1
+    assert api.used["k2"] == 2
+
+
+def test_raises_when_every_key_is_spent(api):
+    s = scheduler(api, ["k1", "k2"])
+    for _ in range(4):
+        list_threads(s)
+    with pytest.raises(QuotaExhaustedError):
+        list_threads(s)
+    assert s.errors["quotaExceeded"] == 2
+    assert s.remaining_quota() == 0
+
+
+def test_local_quota_is_enforced_before_requesting(api):
+    s = scheduler(api, ["k1"], daily_quota=1)
+    list_threads(s)
+    with pytest.raises(QuotaExhaustedError):
+        list_threads(s)
+    assert api.used["k1"] == 1
+
+
+def test_retries_rate_limit_and_server_errors(api):
+    api.quota = None
+    api.failures = [429, 503]
+    s = scheduler(api, ["k1"])
+
+    assert list_threads(s)["items"]
+    assert s.retries == 2
+    assert s.errors["rateLimitExceeded"] == 1 and s.errors["backendError"] == 1
+    # failed requests reached the API, they cost quota too
+    assert s.units_per_key["k1"] == 3
+
+
+def test_raises_after_max_retries(api):
+    api.quota = None
+    api.failures = [503, 503]
+    s = scheduler(api, ["k1"], max_retries=1)
+    with pytest.raises(HttpError):
+        list_threads(s)
+    assert s.retries == 1
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from graphs.build_commenter_networks import build_co_commenter_net_sparse, update_co_commenter_net
+from graphs.graph_store import load_graph_csr, save_graph_csr
+from graphs.plot_commenter_nets import filter_graph
+
+MIN_EDGE_WEIGHT = 2
+
+
+def comments(n, n_videos, n_authors, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "video_id": [f"v{i}" for i in rng.integers(0, n_videos, n)],
+        "comment_author_channel_id": [f"UC{i}" for i in rng.integers(0, n_authors, n)],
+    })
+
+
+def build(df, path):
+    """
+    raw and filtered co-commenter networks of df, saved under path
+    """
+    path.mkdir()
+    build_co_commenter_net_sparse(df, as_graph=False, path=str(path))
+    raw = f"{path}/co_commenter_network.csr"
+    filtered = f"{path}/co_commenter_network_filtered_noselfloop.csr"
+    save_graph_csr(filter_graph(load_graph_csr(raw), min_edge_weight=MIN_EDGE_WEIGHT), filtered)
+    return raw, filtered
+
+
+def nodes(path) -> set:
+    return set(load_graph_csr(path).nodes.tolist())
+
+
+def edges(path) -> dict:
+    csr = load_graph_csr(path)
+    nodes = csr.nodes.tolist()
+    u, v, w = csr.edge_arrays()
+    return {tuple(sorted((nodes[a], nodes[b]))): c
+            for a, b, c in zip(u.tolist(), v.tolist(), w.tolist())}
+
+
+@pytest.mark.parametrize("delta", [
+    # new comments on already crawled videos, by known commenters
+    comments(150, 20, 40, seed=1),
+    # new videos and new commenters, some on old videos
+    pd.concat([comments(100, 30, 60, seed=2),
+               comments(50, 5, 10, seed=3).assign(
+                   comment_author_channel_id=lambda d: "new" + d.comment_author_channel_id)],
+              ignore_index=True),
+], ids=["existing_videos", "new_commenters"])
+def test_update_matches_full_rebuild(tmp_path, delta):
+    old = comments(400, 20, 40, seed=0)
+    raw, filtered = build(old, tmp_path / "updated")
+    before = edges(raw)
+    update_co_commenter_net(old, delta, raw, filtered, min_edge_weight=MIN_EDGE_WEIGHT)
+
+    expected_raw, expected_filtered = build(pd.concat([old, delta], ignore_index=True),
+                                            tmp_path / "rebuilt")
+    assert edges(raw) != before
+    assert edges(raw) == edges(expected_raw)
+    assert edges(filtered) == edges(expected_filtered)
+    assert nodes(raw) == nodes(expected_raw)
+    assert nodes(filtered) == nodes(expected_filtered)
+    assert len(edges(filtered)) > 0